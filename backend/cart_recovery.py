@@ -0,0 +1,275 @@
+"""
+Abandoned-cart recovery scheduler
+Walks open carts through the warm/cooling/cold abandonment stages and sends one
+email/WhatsApp nudge per stage. Each stage keeps a watermark on
+last_activity_at in the cart_recovery_state collection, so a run only reads carts
+that crossed the stage threshold since the previous run, in (last_activity_at,
+cart_id) keyset batches off the (cart_state, last_activity_at, cart_id) index. A nudge is claimed on the cart document
+before it is sent, so several workers never message the same cart twice.
+
+recovery_status moves pending -> contacted on the first nudge, contacted ->
+recovered when the cart converts (see mark_carts_converted in server.py) and
+contacted -> lost once the cart has been idle for GIVE_UP_HOURS.
+"""
+
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Any, Optional
+
+STATE_COLLECTION = "cart_recovery_state"
+
+# (stage, hours idle before the nudge); a stage's window ends where the next begins
+RECOVERY_STAGES = [("warm", 1), ("cooling", 24), ("cold", 72)]
+GIVE_UP_HOURS = 168
+
+CLOSED_STATUSES = ["recovered", "lost"]
+
+
+def _as_utc(value: datetime) -> datetime:
+    """Mongo hands back naive UTC datetimes"""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class RateLimiter:
+    """Spaces calls evenly so at most `rate` start per second"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def whatsapp_reminder(cart: Dict[str, Any], stage: str, cart_url: str) -> str:
+    """WhatsApp text for a cart nudge"""
+    items = cart["items"]
+    items_text = ", ".join(item["product_name"][:25] for item in items[:2])
+    if len(items) > 2:
+        items_text += f" +{len(items) - 2} more"
+
+    opener = {
+        "warm": "🛒 *You left something in your cart!*",
+        "cooling": "🛍️ *Your cart is still waiting for you*",
+        "cold": "⏳ *Last reminder about your cart*",
+    }[stage]
+
+    return f"""{opener}
+
+Your picks from *Paridhaan Creations* are saved:
+
+🛍️ *Items:* {items_text}
+💰 *Total:* ₹{cart['total_amount']:.2f}
+
+Complete your order here:
+{cart_url}
+
+*Paridhaan Creations* 🙏"""
+
+
+class CartRecoveryScheduler:
+    """Periodic, batched abandoned-cart outreach"""
+
+    def __init__(
+        self,
+        db,
+        send_email: Callable[[Dict, str], Awaitable[Any]],
+        send_whatsapp: Callable[[str, str], Awaitable[Dict]],
+        cart_url: str,
+        batch_size: int = 200,
+        sends_per_second: float = 5.0,
+        concurrency: int = 5,
+    ):
+        self.db = db
+        self.send_email = send_email
+        self.send_whatsapp = send_whatsapp
+        self.cart_url = cart_url
+        self.batch_size = batch_size
+        self.rate_limiter = RateLimiter(sends_per_second)
+        self.concurrency = concurrency
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    async def _watermark(self, stage: str) -> Optional[datetime]:
+        state = await self.db[STATE_COLLECTION].find_one({"_id": stage})
+        watermark = state.get("watermark") if state else None
+        return _as_utc(watermark) if watermark else None
+
+    async def _advance_watermark(self, stage: str, watermark: datetime):
+        # $max keeps the watermark monotonic when several workers run the scheduler
+        await self.db[STATE_COLLECTION].update_one(
+            {"_id": stage}, {"$max": {"watermark": watermark}}, upsert=True
+        )
+
+    async def run_once(self) -> Dict[str, Any]:
+        """One pass over every stage; returns per-stage counts"""
+        started = datetime.now(timezone.utc)
+        report = {"started_at": started.isoformat(), "stages": {}}
+
+        for index, (stage, hours) in enumerate(RECOVERY_STAGES):
+            next_hours = RECOVERY_STAGES[index + 1][1] if index + 1 < len(RECOVERY_STAGES) else GIVE_UP_HOURS
+            report["stages"][stage] = await self._run_stage(stage, hours, next_hours, started)
+
+        lost = await self.db.cart.update_many(
+            {
+                "cart_state": "open",
+                "recovery_status": "contacted",
+                "last_activity_at": {"$lt": started - timedelta(hours=GIVE_UP_HOURS)},
+            },
+            {"$set": {"recovery_status": "lost", "recovery_closed_at": started}}
+        )
+        report["marked_lost"] = lost.modified_count
+        report["duration_seconds"] = round((datetime.now(timezone.utc) - started).total_seconds(), 2)
+        self.last_run = report
+        return report
+
+    async def _run_stage(self, stage: str, hours: int, next_hours: int, now: datetime) -> Dict[str, int]:
+        # Carts idle longer than the next stage's threshold have moved past this
+        # stage already (e.g. while the scheduler was down) and skip its nudge
+        upper = now - timedelta(hours=hours)
+        lower = now - timedelta(hours=next_hours)
+        watermark = await self._watermark(stage)
+        if watermark and watermark > lower:
+            lower = watermark
+
+        counts = {"scanned": 0, "nudged": 0, "skipped": 0}
+        # Keyset on (last_activity_at, cart_id): carts sharing a timestamp can straddle batches
+        last_cart_id = None
+        while lower < upper or last_cart_id is not None:
+            after = {"last_activity_at": {"$gt": lower}}
+            if last_cart_id is not None:
+                after = {"$or": [after, {"last_activity_at": lower, "cart_id": {"$gt": last_cart_id}}]}
+            carts = await self.db.cart.find(
+                {
+                    "cart_state": "open",
+                    "$and": [after, {"last_activity_at": {"$lte": upper}}],
+                    "recovery_status": {"$nin": CLOSED_STATUSES},
+                },
+                {"_id": 0}
+            ).sort([("last_activity_at", 1), ("cart_id", 1)]).limit(self.batch_size).to_list(self.batch_size)
+            if not carts:
+                break
+
+            sent = await self._nudge_batch(stage, carts, now)
+            counts["scanned"] += len(carts)
+            counts["nudged"] += sent
+            counts["skipped"] += len(carts) - sent
+
+            lower = _as_utc(carts[-1]["last_activity_at"])
+            last_cart_id = carts[-1]["cart_id"]
+            # The watermark is a bare timestamp, so it only covers timestamps this
+            # batch finished; carts tied with the last one may still follow
+            finished = [_as_utc(cart["last_activity_at"]) for cart in carts]
+            finished = [activity for activity in finished if activity < lower]
+            if finished:
+                await self._advance_watermark(stage, max(finished))
+            if len(carts) < self.batch_size:
+                break
+
+        await self._advance_watermark(stage, upper)
+        return counts
+
+    async def _nudge_batch(self, stage: str, carts: List[Dict], now: datetime) -> int:
+        """Enrich one batch with two $in lookups, then send with bounded concurrency"""
+        product_ids = list({item["product_id"] for cart in carts for item in cart.get("items", [])})
+        products = await self.db.products.find(
+            {"product_id": {"$in": product_ids}}, {"_id": 0, "product_id": 1, "name": 1, "price": 1}
+        ).to_list(len(product_ids) or 1)
+        products_by_id = {p["product_id"]: p for p in products}
+
+        user_ids = list({cart["user_id"] for cart in carts if cart.get("user_id")})
+        users = await self.db.users.find(
+            {"user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1, "email": 1, "name": 1}
+        ).to_list(len(user_ids) or 1)
+        users_by_id = {u["user_id"]: u for u in users}
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def nudge(cart: Dict) -> bool:
+            async with semaphore:
+                return await self._nudge(stage, cart, products_by_id, users_by_id, now)
+
+        results = await asyncio.gather(*(nudge(cart) for cart in carts), return_exceptions=True)
+        for cart, result in zip(carts, results):
+            if isinstance(result, Exception):
+                logging.error(f"Cart recovery nudge failed for {cart.get('cart_id')}: {str(result)}")
+        return sum(1 for result in results if result is True)
+
+    async def _nudge(self, stage: str, cart: Dict, products_by_id: Dict, users_by_id: Dict, now: datetime) -> bool:
+        user = users_by_id.get(cart.get("user_id"), {})
+        email = user.get("email") or cart.get("guest_email")
+        phone = cart.get("guest_phone")
+        items = [
+            {
+                "product_name": products_by_id[item["product_id"]].get("name", "Product"),
+                "quantity": item.get("quantity", 1),
+                "price": products_by_id[item["product_id"]].get("price", 0),
+            }
+            for item in cart.get("items", []) if item["product_id"] in products_by_id
+        ]
+        if not items or not (email or phone):
+            return False
+
+        # Claim the stage first so concurrent runs never send it twice
+        claimed = await self.db.cart.update_one(
+            {"cart_id": cart["cart_id"], f"recovery_nudges.{stage}": {"$exists": False}},
+            {"$set": {f"recovery_nudges.{stage}": {"claimed_at": now}}}
+        )
+        if not claimed.modified_count:
+            return False
+
+        reminder = {
+            "order_id": cart["cart_id"],
+            "guest_email": email,
+            "items": items,
+            "total_amount": sum(item["price"] * item["quantity"] for item in items),
+        }
+        channels = {}
+        if email:
+            await self.rate_limiter.wait()
+            channels["email"] = bool(await self.send_email(reminder, "cart_reminder"))
+        if phone:
+            await self.rate_limiter.wait()
+            result = await self.send_whatsapp(phone, whatsapp_reminder(reminder, stage, self.cart_url))
+            channels["whatsapp"] = bool(result.get("success"))
+
+        update = {
+            f"recovery_nudges.{stage}": {"claimed_at": now, "sent_at": datetime.now(timezone.utc), "channels": channels}
+        }
+        if any(channels.values()):
+            update["last_contacted_at"] = datetime.now(timezone.utc)
+            await self.db.cart.update_one(
+                {"cart_id": cart["cart_id"], "recovery_status": {"$in": [None, "pending"]}},
+                {"$set": {"recovery_status": "contacted"}}
+            )
+        await self.db.cart.update_one({"cart_id": cart["cart_id"]}, {"$set": update})
+        return any(channels.values())
+
+    async def run_forever(self, interval_seconds: float):
+        while True:
+            try:
+                report = await self.run_once()
+                nudged = sum(stage["nudged"] for stage in report["stages"].values())
+                if nudged or report["marked_lost"]:
+                    logging.info(f"Cart recovery: {nudged} nudges sent, {report['marked_lost']} carts marked lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Cart recovery run failed: {str(e)}")
+            await asyncio.sleep(interval_seconds)
+
+    async def status(self) -> Dict[str, Any]:
+        watermarks = {}
+        for stage, _ in RECOVERY_STAGES:
+            watermark = await self._watermark(stage)
+            watermarks[stage] = watermark.isoformat() if watermark else None
+        return {"watermarks": watermarks, "last_run": self.last_run}
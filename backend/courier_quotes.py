@@ -0,0 +1,197 @@
+"""
+Courier quote cache
+Shiprocket serviceability/rate lookups keyed by (pickup pincode, delivery
+pincode, weight band, cod). Quotes live in an in-process LRU and in the
+courier_quotes collection, so every worker and restart shares them. A quote is
+served as-is while fresh; once older than fresh_hours it is still served and
+refreshed in the background (stale-while-revalidate), and it is dropped after
+max_age_hours by a TTL index. Only one fetch per key runs at a time, so a burst
+of checkouts for the same pincode makes a single Shiprocket call, and a failed
+refresh keeps the old quote in service.
+
+Weights are rounded up to WEIGHT_BAND_KG, the slab couriers charge in, which
+keeps the number of keys small. prewarm() fetches quotes for the pincodes that
+appear most in recent orders.
+"""
+
+import math
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Any, Optional, Tuple
+
+from cache_utils import TTLCache
+
+QUOTE_COLLECTION = "courier_quotes"
+
+WEIGHT_BAND_KG = 0.5
+
+QuoteKey = Tuple[str, str, float, int]
+
+
+def weight_band(weight: float) -> float:
+    """Round a parcel weight up to its charging slab"""
+    return max(1, math.ceil(round(weight / WEIGHT_BAND_KG, 6))) * WEIGHT_BAND_KG
+
+
+def _document_id(key: QuoteKey) -> str:
+    pickup, delivery, band, cod = key
+    return f"{pickup}:{delivery}:{band}:{cod}"
+
+
+class CourierQuoteCache:
+    """Two-tier (memory + Mongo) cache of courier quotes"""
+
+    def __init__(
+        self,
+        db,
+        fetch: Callable[[str, str, float, int], Awaitable[List[Dict[str, Any]]]],
+        fresh_hours: float = 6,
+        max_age_hours: float = 48,
+        memory_size: int = 2000,
+    ):
+        self.quotes = db[QUOTE_COLLECTION]
+        self.orders = db.orders
+        self.fetch = fetch
+        self.fresh_seconds = fresh_hours * 3600
+        self.max_age_seconds = max_age_hours * 3600
+        self.memory = TTLCache(max_size=memory_size, ttl_seconds=self.max_age_seconds)
+        self._inflight: Dict[QuoteKey, asyncio.Task] = {}
+        self.refresh_failures = 0
+
+    def _age_seconds(self, entry: Dict[str, Any]) -> float:
+        return (datetime.now(timezone.utc) - entry["fetched_at"]).total_seconds()
+
+    async def get(self, pickup: str, delivery: str, weight: float, cod: int = 0) -> Dict[str, Any]:
+        """Quote for a route: {"couriers", "fetched_at", "source"}; raises if nothing is cached and the fetch fails"""
+        key = (pickup, delivery, weight_band(weight), cod)
+
+        entry, source = self.memory.get(key), "memory"
+        if entry is None:
+            entry, source = await self._load(key), "db"
+        if entry is None:
+            return {**await self._refresh(key), "source": "shiprocket"}
+
+        if self._age_seconds(entry) > self.fresh_seconds and key not in self._inflight:
+            self._start_refresh(key)
+        return {**entry, "source": source}
+
+    async def _load(self, key: QuoteKey) -> Optional[Dict[str, Any]]:
+        document = await self.quotes.find_one({"_id": _document_id(key)})
+        if document is None:
+            return None
+        fetched_at = document["fetched_at"]
+        if fetched_at.tzinfo is None:
+            fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+        entry = {"couriers": document["couriers"], "fetched_at": fetched_at}
+        remaining = self.max_age_seconds - self._age_seconds(entry)
+        if remaining <= 0:
+            return None
+        self.memory.set(key, entry, ttl_seconds=remaining)
+        return entry
+
+    def _start_refresh(self, key: QuoteKey) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_and_store(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+            # Background refreshes are awaited by nobody; keep their errors out of the loop's log
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def _refresh(self, key: QuoteKey) -> Dict[str, Any]:
+        # shield: a client disconnecting must not cancel a fetch other callers share
+        return await asyncio.shield(self._start_refresh(key))
+
+    async def _fetch_and_store(self, key: QuoteKey) -> Dict[str, Any]:
+        pickup, delivery, band, cod = key
+        try:
+            couriers = await self.fetch(pickup, delivery, band, cod)
+        except Exception as e:
+            self.refresh_failures += 1
+            logging.error(f"Courier quote fetch failed for {_document_id(key)}: {str(e)}")
+            raise
+
+        now = datetime.now(timezone.utc)
+        entry = {"couriers": couriers, "fetched_at": now}
+        self.memory.set(key, entry)
+        await self.quotes.update_one(
+            {"_id": _document_id(key)},
+            {"$set": {
+                "pickup_pincode": pickup,
+                "delivery_pincode": delivery,
+                "weight_band": band,
+                "cod": cod,
+                "couriers": couriers,
+                "fetched_at": now,
+                "expires_at": now + timedelta(seconds=self.max_age_seconds),
+            }},
+            upsert=True
+        )
+        return entry
+
+    async def top_pincodes(self, limit: int = 50, days: int = 90) -> List[str]:
+        """Delivery pincodes with the most orders in the last `days` days"""
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
+        rows = await self.orders.aggregate([
+            {"$match": {"created_at": {"$gte": since}, "shipping_address.pincode": {"$type": "string"}}},
+            {"$group": {"_id": "$shipping_address.pincode", "orders": {"$sum": 1}}},
+            {"$sort": {"orders": -1}},
+            {"$limit": limit},
+        ]).to_list(limit)
+        return [row["_id"] for row in rows]
+
+    async def prewarm(
+        self,
+        pickup: str,
+        limit: int = 50,
+        weights: Tuple[float, ...] = (WEIGHT_BAND_KG,),
+        cod: int = 0,
+        concurrency: int = 3,
+    ) -> Dict[str, int]:
+        """Fetch quotes that are missing or no longer fresh for the top destinations"""
+        pincodes = await self.top_pincodes(limit)
+        keys = [(pickup, pincode, weight_band(weight), cod) for pincode in pincodes for weight in weights]
+
+        fresh = {
+            document["_id"] for document in await self.quotes.find(
+                {
+                    "_id": {"$in": [_document_id(key) for key in keys]},
+                    "fetched_at": {"$gt": datetime.now(timezone.utc) - timedelta(seconds=self.fresh_seconds)},
+                },
+                {"_id": 1}
+            ).to_list(len(keys) or 1)
+        }
+        due = [key for key in keys if _document_id(key) not in fresh]
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def warm(key: QuoteKey):
+            async with semaphore:
+                await self._refresh(key)
+
+        results = await asyncio.gather(*(warm(key) for key in due), return_exceptions=True)
+        failed = sum(1 for result in results if isinstance(result, Exception))
+        return {"pincodes": len(pincodes), "already_fresh": len(keys) - len(due), "fetched": len(due) - failed, "failed": failed}
+
+    async def run_prewarm_forever(self, pickup: str, interval_seconds: float, limit: int = 50):
+        while True:
+            try:
+                report = await self.prewarm(pickup, limit)
+                if report["fetched"] or report["failed"]:
+                    logging.info(f"Courier quotes pre-warmed: {report}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Courier quote pre-warm failed: {str(e)}")
+            await asyncio.sleep(interval_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory": self.memory.stats(),
+            "refreshing": len(self._inflight),
+            "refresh_failures": self.refresh_failures,
+            "fresh_hours": self.fresh_seconds / 3600,
+            "max_age_hours": self.max_age_seconds / 3600,
+        }
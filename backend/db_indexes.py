@@ -0,0 +1,234 @@
+"""
+MongoDB Index Registry
+Declares every index the API relies on. Applied on app startup, or manually:
+
+    python db_indexes.py           # create missing indexes
+    python db_indexes.py --report  # show missing / unused / unregistered indexes
+"""
+
+import os
+import sys
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, List, Any
+
+from pymongo.errors import OperationFailure
+
+# collection -> list of index specs. "keys" is a list of (field, direction);
+# "required": True marks indexes the API cannot run correctly without (reported
+# separately so startup can refuse to serve); any other entry is passed straight
+# to create_index (unique, sparse, expireAfterSeconds, ...)
+INDEX_REGISTRY: Dict[str, List[Dict[str, Any]]] = {
+    "users": [
+        {"keys": [("user_id", 1)], "unique": True},
+        {"keys": [("email", 1)], "unique": True},
+    ],
+    "user_sessions": [
+        {"keys": [("session_token", 1)], "unique": True},
+        {"keys": [("user_id", 1)]},
+        # Mongo removes sessions once expires_at has passed
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "products": [
+        {"keys": [("product_id", 1)], "unique": True},
+        {"keys": [("created_at", -1), ("product_id", -1)]},
+        {"keys": [("category", 1), ("created_at", -1), ("product_id", -1)]},
+        {"keys": [("featured", 1)]},
+        {"keys": [("laddu_gopal_sizes", 1)]},
+        {"keys": [("stock", 1)]},
+    ],
+    "categories": [
+        {"keys": [("category_id", 1)], "unique": True},
+        {"keys": [("slug", 1)]},
+    ],
+    "cart": [
+        {"keys": [("cart_id", 1)], "unique": True},
+        # One cart per user / guest session; atomic add-to-cart upserts rely on it.
+        # Guest carts store user_id: null (and user carts session_id: null), hence partial.
+        {"keys": [("user_id", 1)], "unique": True, "partialFilterExpression": {"user_id": {"$type": "string"}}, "required": True},
+        {"keys": [("session_id", 1)], "unique": True, "partialFilterExpression": {"session_id": {"$type": "string"}}, "required": True},
+        {"keys": [("updated_at", -1)]},
+        {"keys": [("guest_email", 1)], "sparse": True},
+        # Abandoned-cart queries: open carts by last activity; cart_id breaks ties for the recovery keyset
+        {"keys": [("cart_state", 1), ("last_activity_at", -1), ("cart_id", -1)]},
+    ],
+    "stock_reservations": [
+        {"keys": [("reservation_id", 1)], "unique": True},
+        # Expiry sweep: held reservations past expires_at
+        {"keys": [("status", 1), ("expires_at", 1)]},
+    ],
+    "webhook_inbox": [
+        # Keyed by "<source>:<dedupe key>" in _id
+        # Claim pass: unfinished events in arrival order, grouped by ordering key
+        {"keys": [("status", 1), ("received_at", 1)]},
+        # Processed events are kept DONE_RETENTION_DAYS (the dedupe window)
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "notification_outbox": [
+        # Keyed by "<order_id>:<event>:<channel>" in _id; the dispatcher claims per channel
+        {"keys": [("channel", 1), ("status", 1), ("next_attempt_at", 1)]},
+        {"keys": [("order_id", 1)]},
+        # Delivered messages are kept RETENTION_DAYS
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "courier_quotes": [
+        # Keyed by route in _id; quotes past COURIER_QUOTE_MAX_AGE_HOURS are dropped
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "idempotency_keys": [
+        # Keys are the _id; stored responses expire after IDEMPOTENCY_TTL_HOURS
+        {"keys": [("expires_at", 1)], "expireAfterSeconds": 0},
+    ],
+    "wishlist": [
+        {"keys": [("user_id", 1)], "unique": True},
+    ],
+    "orders": [
+        {"keys": [("order_id", 1)], "unique": True},
+        {"keys": [("user_id", 1), ("created_at", -1), ("order_id", -1)]},
+        {"keys": [("payment_status", 1), ("created_at", -1)]},
+        {"keys": [("created_at", -1), ("order_id", -1)]},
+        {"keys": [("guest_email", 1), ("created_at", -1)], "sparse": True},
+    ],
+    "analytics_snapshots": [
+        {"keys": [("snapshot_id", 1)], "unique": True},
+    ],
+    "revenue_daily": [
+        {"keys": [("day", 1)], "unique": True},
+    ],
+    "payment_transactions": [
+        {"keys": [("session_id", 1)], "sparse": True},
+        {"keys": [("razorpay_order_id", 1)], "sparse": True},
+        {"keys": [("order_id", 1)]},
+    ],
+    "banners": [
+        {"keys": [("banner_id", 1)], "unique": True},
+        {"keys": [("status", 1), ("placement", 1), ("position", 1)]},
+    ],
+    "banner_stats_hourly": [
+        {"keys": [("banner_id", 1), ("hour", 1)], "unique": True},
+        {"keys": [("hour", 1), ("placement", 1)]},
+    ],
+    "coupons": [
+        {"keys": [("coupon_id", 1)], "unique": True},
+        {"keys": [("code", 1), ("active", 1)]},
+        {"keys": [("created_at", -1), ("coupon_id", -1)]},
+    ],
+    "reviews": [
+        {"keys": [("review_id", 1)], "unique": True},
+        {"keys": [("product_id", 1), ("created_at", -1), ("review_id", -1)]},
+        {"keys": [("product_id", 1), ("user_id", 1)]},
+    ],
+    "support_tickets": [
+        {"keys": [("ticket_id", 1)], "unique": True},
+        {"keys": [("user_id", 1), ("created_at", -1)]},
+        {"keys": [("created_at", -1), ("ticket_id", -1)]},
+        {"keys": [("status", 1), ("created_at", -1), ("ticket_id", -1)]},
+    ],
+    "shipments": [
+        {"keys": [("shipment_id", 1)], "unique": True},
+        {"keys": [("order_id", 1)]},
+        {"keys": [("awb_number", 1)], "sparse": True},
+        # Tracking poller: in-transit shipments without a recent webhook
+        {"keys": [("status", 1), ("last_webhook_at", 1)]},
+        {"keys": [("created_at", -1)]},
+    ],
+    "invoices": [
+        {"keys": [("invoice_id", 1)], "unique": True},
+        {"keys": [("invoice_number", 1)], "unique": True},
+        {"keys": [("order_id", 1)], "unique": True},
+        {"keys": [("created_at", -1)]},
+    ],
+    "email_logs": [
+        {"keys": [("order_id", 1)]},
+    ],
+}
+
+
+def _key_tuple(keys) -> tuple:
+    return tuple((field, direction) for field, direction in keys)
+
+
+async def ensure_indexes(db) -> Dict[str, Any]:
+    """Create every registered index. Failures are logged and reported, never raised;
+    failures of required indexes are also listed under required_failed."""
+    created = []
+    failed = []
+    required_failed = []
+
+    for collection_name, specs in INDEX_REGISTRY.items():
+        collection = db[collection_name]
+        for spec in specs:
+            options = {k: v for k, v in spec.items() if k not in ("keys", "required")}
+            try:
+                name = await collection.create_index(spec["keys"], **options)
+                created.append(f"{collection_name}.{name}")
+            except OperationFailure as e:
+                # Usually duplicate data under a unique index or conflicting options
+                logging.error(f"Index {collection_name}{spec['keys']} failed: {str(e)}")
+                failure = {"collection": collection_name, "keys": spec["keys"], "error": str(e)}
+                failed.append(failure)
+                if spec.get("required"):
+                    required_failed.append(failure)
+
+    logging.info(f"Index bootstrap complete: {len(created)} ensured, {len(failed)} failed")
+    return {"ensured": created, "failed": failed, "required_failed": required_failed}
+
+
+async def index_report(db) -> Dict[str, Any]:
+    """Compare registry with the live database: missing, unused and unregistered indexes"""
+    missing = []
+    unused = []
+    unregistered = []
+
+    for collection_name, specs in INDEX_REGISTRY.items():
+        collection = db[collection_name]
+        existing = {}
+        async for index in collection.list_indexes():
+            existing[_key_tuple(index["key"].items())] = index["name"]
+
+        registered = {_key_tuple(spec["keys"]) for spec in specs}
+        for spec in specs:
+            if _key_tuple(spec["keys"]) not in existing:
+                missing.append({"collection": collection_name, "keys": spec["keys"]})
+
+        for keys, name in existing.items():
+            if name != "_id_" and keys not in registered:
+                unregistered.append({"collection": collection_name, "name": name})
+
+        try:
+            stats = await collection.aggregate([{"$indexStats": {}}]).to_list(100)
+        except OperationFailure:
+            stats = []  # $indexStats needs clusterMonitor on some deployments
+        for stat in stats:
+            if stat["name"] != "_id_" and stat.get("accesses", {}).get("ops", 0) == 0:
+                unused.append({
+                    "collection": collection_name,
+                    "name": stat["name"],
+                    "since": stat.get("accesses", {}).get("since")
+                })
+
+    return {"missing": missing, "unused": unused, "unregistered": unregistered}
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / ".env")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        db = client[os.environ["DB_NAME"]]
+        if "--report" in sys.argv:
+            result = await index_report(db)
+        else:
+            result = await ensure_indexes(db)
+        client.close()
+        for key, values in result.items():
+            print(f"{key}: {len(values)}")
+            for value in values:
+                print(f"  - {value}")
+
+    asyncio.run(main())
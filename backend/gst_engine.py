@@ -0,0 +1,159 @@
+"""
+Batched GST engine
+Computes the CGST/SGST/IGST breakdown for one order or thousands at once:
+one $in query for every product involved, a cached category GST/HSN table and
+numpy arithmetic over all order lines together. Output matches the original
+per-item calculation, rounding included.
+"""
+
+import time
+from typing import Callable, Dict, List, Any, Optional
+
+import numpy as np
+
+# How long the category GST/HSN table is trusted before it is re-read
+CATEGORY_TABLE_TTL_SECONDS = 300
+
+PRODUCT_GST_FIELDS = {"_id": 0, "product_id": 1, "name": 1, "category": 1, "gst_rate": 1, "hsn_code": 1}
+
+
+class GSTEngine:
+    """GST calculation over preloaded products and a cached category table"""
+
+    def __init__(self, db, state_code: Callable[[str], str], category_ttl_seconds: float = CATEGORY_TABLE_TTL_SECONDS):
+        self.db = db
+        self.state_code = state_code
+        self.category_ttl_seconds = category_ttl_seconds
+        self._categories: Optional[Dict[str, Dict[str, Any]]] = None
+        self._categories_loaded_at = 0.0
+
+    def invalidate_categories(self):
+        self._categories = None
+
+    async def category_table(self) -> Dict[str, Dict[str, Any]]:
+        """slug -> {gst_rate, hsn_code} for every category"""
+        expired = time.monotonic() - self._categories_loaded_at > self.category_ttl_seconds
+        if self._categories is None or expired:
+            categories = await self.db.categories.find(
+                {}, {"_id": 0, "slug": 1, "gst_rate": 1, "hsn_code": 1}
+            ).to_list(None)
+            self._categories = {c["slug"]: c for c in categories if c.get("slug")}
+            self._categories_loaded_at = time.monotonic()
+        return self._categories
+
+    async def load_products(self, product_ids) -> Dict[str, Dict[str, Any]]:
+        product_ids = list(set(product_ids))
+        if not product_ids:
+            return {}
+        products = await self.db.products.find(
+            {"product_id": {"$in": product_ids}}, PRODUCT_GST_FIELDS
+        ).to_list(len(product_ids))
+        return {p["product_id"]: p for p in products}
+
+    async def calculate(self, items: List[Dict], customer_state: str, gst_settings: Dict) -> Dict:
+        """GST breakdown for a single order's items"""
+        return (await self.calculate_many([(items, customer_state)], gst_settings))[0]
+
+    async def calculate_many(self, orders: List[tuple], gst_settings: Dict) -> List[Dict]:
+        """GST breakdown for many (items, customer_state) pairs with one product query"""
+        products = await self.load_products(
+            item["product_id"] for items, _ in orders for item in items
+        )
+        categories = await self.category_table()
+        return compute_gst(orders, products, categories, gst_settings, self.state_code)
+
+
+def resolve_rate(product: Dict, categories: Dict, default_rate: float) -> tuple:
+    """Priority: Product GST > Category GST > Default GST. HSN falls back to the
+    category only when the rate does too."""
+    gst_rate = product.get("gst_rate")
+    hsn_code = product.get("hsn_code", "")
+
+    if gst_rate is None:
+        category = categories.get(product.get("category"))
+        if category:
+            gst_rate = category.get("gst_rate")
+            if not hsn_code:
+                hsn_code = category.get("hsn_code", "")
+
+    if gst_rate is None:
+        gst_rate = default_rate
+    return gst_rate, hsn_code
+
+
+def compute_gst(
+    orders: List[tuple],
+    products: Dict[str, Dict],
+    categories: Dict[str, Dict],
+    gst_settings: Dict,
+    state_code: Callable[[str], str],
+) -> List[Dict]:
+    """Vectorized GST over every line of every order; one result per order"""
+    business_state_code = gst_settings.get("business_state_code", "08")
+    default_rate = gst_settings.get("default_gst_rate", 18.0)
+    prices_include_gst = gst_settings.get("prices_include_gst", True)
+
+    # Flatten all lines; lines whose product no longer exists are skipped
+    lines = []
+    line_order = []
+    inter_state_flags = []
+    for order_index, (items, customer_state) in enumerate(orders):
+        inter_state_flags.append(business_state_code != state_code(customer_state))
+        for item in items:
+            product = products.get(item["product_id"])
+            if not product:
+                continue
+            gst_rate, hsn_code = resolve_rate(product, categories, default_rate)
+            lines.append((item, product, gst_rate, hsn_code))
+            line_order.append(order_index)
+
+    results = [{"is_inter_state": flag, "items": []} for flag in inter_state_flags]
+    totals = [[0, 0, 0, 0] for _ in orders]  # taxable, cgst, sgst, igst
+
+    if lines:
+        prices = np.array([line[0]["price"] for line in lines], dtype=np.float64)
+        quantities = np.array([line[0]["quantity"] for line in lines], dtype=np.float64)
+        rates = np.array([line[2] for line in lines], dtype=np.float64)
+        inter_state = np.array([inter_state_flags[i] for i in line_order], dtype=bool)
+
+        # Same operation order as the scalar version so every float is identical
+        item_totals = prices * quantities
+        if prices_include_gst:
+            taxable = item_totals / (1 + rates / 100)
+        else:
+            taxable = item_totals
+        igst = np.where(inter_state, taxable * rates / 100, 0.0)
+        half = np.where(inter_state, 0.0, taxable * (rates / 2) / 100)
+
+        for (item, product, gst_rate, hsn_code), order_index, line_total, line_taxable, line_half, line_igst in zip(
+            lines, line_order, item_totals.tolist(), taxable.tolist(), half.tolist(), igst.tolist()
+        ):
+            order_totals = totals[order_index]
+            order_totals[0] += line_taxable
+            order_totals[1] += line_half
+            order_totals[2] += line_half
+            order_totals[3] += line_igst
+
+            results[order_index]["items"].append({
+                "product_id": item["product_id"],
+                "product_name": item.get("product_name", product.get("name")),
+                "hsn_code": hsn_code,
+                "quantity": item["quantity"],
+                "unit_price": item["price"],
+                "taxable_amount": round(line_taxable, 2),
+                "gst_rate": gst_rate,
+                "cgst": round(line_half, 2),
+                "sgst": round(line_half, 2),
+                "igst": round(line_igst, 2),
+                "total": round(line_total, 2)
+            })
+
+    for result, (total_taxable, total_cgst, total_sgst, total_igst) in zip(results, totals):
+        result.update({
+            "taxable_amount": round(total_taxable, 2),
+            "cgst_amount": round(total_cgst, 2),
+            "sgst_amount": round(total_sgst, 2),
+            "igst_amount": round(total_igst, 2),
+            "total_gst": round(total_cgst + total_sgst + total_igst, 2)
+        })
+    return results
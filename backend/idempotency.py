@@ -0,0 +1,206 @@
+"""
+Idempotency keys
+Clients send an Idempotency-Key header on endpoints that create orders or
+payment objects. The first request with a key runs and its response is stored
+in idempotency_keys (expired by a TTL index); retries with the same key get the
+stored response back without running the handler again. Concurrent duplicates
+are single-flighted: within a worker they await the first request's future,
+across workers they wait on the in-progress record.
+
+Reusing a key with a different request body is a client error (422). Failed
+requests are not stored, so the client can retry them with the same key.
+
+The owner of a key refreshes locked_at while its handler runs, so only a claim
+whose worker died goes stale and can be taken over. Handlers get an
+IdempotencyClaim and record a marker (the order_id they are about to create,
+the gateway object they opened) before and after each side effect; a takeover
+hands that marker to the new handler, which resumes from it instead of
+creating a second order or payment.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+KEY_COLLECTION = "idempotency_keys"
+
+MAX_KEY_LENGTH = 255
+
+# An in-progress record not refreshed for this long belongs to a crashed worker and can be taken over
+LOCK_TIMEOUT_SECONDS = 60
+# Running handlers refresh locked_at this often
+HEARTBEAT_SECONDS = LOCK_TIMEOUT_SECONDS / 4
+
+REPLAY_HEADER = "Idempotent-Replayed"
+
+
+def fingerprint(payload: Any) -> str:
+    """Stable hash of the request inputs a key is bound to"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class IdempotencyClaim:
+    """A handler's hold on a key, and the marker of side effects it has started"""
+
+    def __init__(self, keys=None, record_id: Optional[str] = None, lease: Optional[str] = None, marker: Optional[Dict[str, Any]] = None):
+        self._keys = keys
+        self.record_id = record_id
+        self.lease = lease
+        # Left by a previous owner of the key; empty on a first run
+        self.marker: Dict[str, Any] = dict(marker or {})
+
+    async def mark(self, **fields):
+        """Store fields in the key's marker; raises 409 if the key was taken over"""
+        self.marker.update(fields)
+        if self._keys is None:
+            return  # Request without an Idempotency-Key
+        result = await self._keys.update_one(
+            {"_id": self.record_id, "lease": self.lease, "status": "in_progress"},
+            {"$set": {f"marker.{name}": value for name, value in fields.items()}}
+        )
+        if not result.matched_count:
+            raise HTTPException(status_code=409, detail="Idempotency-Key was taken over by another request")
+
+
+class IdempotencyStore:
+    """Stores one response per (scope, key) for ttl_hours"""
+
+    def __init__(self, db, ttl_hours: float = 24, wait_timeout_seconds: float = 30):
+        self.keys = db[KEY_COLLECTION]
+        self.ttl_hours = ttl_hours
+        self.wait_timeout_seconds = wait_timeout_seconds
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.replays = 0
+
+    async def run(
+        self,
+        scope: str,
+        key: Optional[str],
+        request_fingerprint: str,
+        handler: Callable[[IdempotencyClaim], Awaitable[Any]],
+    ):
+        """Run handler(claim) once per key; retries get the stored response"""
+        if not key:
+            return await handler(IdempotencyClaim())
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+
+        record_id = f"{scope}:{key}"
+        inflight = self._inflight.get(record_id)
+        if inflight is not None:
+            # Same worker already running this key
+            await asyncio.shield(inflight)
+            return await self._replay(record_id, request_fingerprint)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[record_id] = future
+        try:
+            claim = await self._acquire(record_id, request_fingerprint)
+            if claim is None:
+                return await self._replay(record_id, request_fingerprint)
+
+            heartbeat = asyncio.create_task(self._heartbeat(claim))
+            try:
+                result = await handler(claim)
+            except BaseException:
+                await self.keys.delete_one({"_id": record_id, "lease": claim.lease, "status": "in_progress"})
+                raise
+            finally:
+                heartbeat.cancel()
+
+            body = jsonable_encoder(result)
+            await self.keys.update_one(
+                {"_id": record_id, "lease": claim.lease},
+                {"$set": {"status": "done", "status_code": 200, "body": body, "completed_at": datetime.now(timezone.utc)}}
+            )
+            return result
+        finally:
+            del self._inflight[record_id]
+            future.set_result(None)
+
+    async def _acquire(self, record_id: str, request_fingerprint: str) -> Optional[IdempotencyClaim]:
+        """Claim the key; None when another request owns or completed it"""
+        now = datetime.now(timezone.utc)
+        lease = uuid.uuid4().hex
+        record = {
+            "_id": record_id,
+            "fingerprint": request_fingerprint,
+            "status": "in_progress",
+            "lease": lease,
+            "locked_at": now,
+            "marker": {},
+            "expires_at": now + timedelta(hours=self.ttl_hours),
+        }
+        try:
+            await self.keys.insert_one(record)
+            return IdempotencyClaim(self.keys, record_id, lease)
+        except DuplicateKeyError:
+            pass
+
+        # Take over a claim whose worker stopped refreshing it; resume from its marker
+        taken = await self.keys.find_one_and_update(
+            {
+                "_id": record_id,
+                "fingerprint": request_fingerprint,
+                "status": "in_progress",
+                "locked_at": {"$lt": now - timedelta(seconds=LOCK_TIMEOUT_SECONDS)},
+            },
+            {"$set": {"lease": lease, "locked_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        if taken is None:
+            return None
+        return IdempotencyClaim(self.keys, record_id, lease, taken.get("marker"))
+
+    async def _heartbeat(self, claim: IdempotencyClaim):
+        """Keep locked_at fresh while the handler runs so the claim is not taken over"""
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            try:
+                await self.keys.update_one(
+                    {"_id": claim.record_id, "lease": claim.lease, "status": "in_progress"},
+                    {"$set": {"locked_at": datetime.now(timezone.utc)}}
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Idempotency heartbeat for {claim.record_id} failed: {str(e)}")
+
+    async def _replay(self, record_id: str, request_fingerprint: str) -> JSONResponse:
+        """Stored response for a key, waiting while the first request is still running"""
+        deadline = time.monotonic() + self.wait_timeout_seconds
+        delay = 0.05
+        while True:
+            record = await self.keys.find_one({"_id": record_id})
+            if record is None:
+                # First request failed and released the key
+                raise HTTPException(status_code=409, detail="Original request failed; retry with the same key")
+            if record["fingerprint"] != request_fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            if record["status"] == "done":
+                self.replays += 1
+                return JSONResponse(
+                    content=record["body"],
+                    status_code=record["status_code"],
+                    headers={REPLAY_HEADER: "true"}
+                )
+            if time.monotonic() > deadline:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": "2"}
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1.0)
@@ -0,0 +1,182 @@
+"""
+Inventory reservations
+Stock is taken when an order is placed, not when it ships. Each order line is
+a conditional $inc ({"stock": {"$gte": qty}}), so concurrent checkouts can never
+drive stock below zero and no global lock is needed; if any line fails the
+lines already taken are put back. The hold is recorded in stock_reservations
+and ends in exactly one of:
+
+    held -> confirmed   payment succeeded (mark_order_paid)
+    held -> released    hold expired, payment failed or order cancelled
+
+Transitions are conditional updates on status, so a payment racing the expiry
+sweeper is settled once. A payment that lands after its hold was released
+takes the stock again unconditionally (it is already paid for); stock can then
+go negative and is listed under "oversold" in /admin/stock-alerts.
+
+Products also carry a `reserved` counter with the quantity currently on hold.
+"""
+
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Any, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+RESERVATION_COLLECTION = "stock_reservations"
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id: str, requested: int, available: int):
+        super().__init__(f"{product_id}: requested {requested}, available {available}")
+        self.product_id = product_id
+        self.requested = requested
+        self.available = available
+
+
+def _quantities(items: List[Dict[str, Any]]) -> Dict[str, int]:
+    # One $inc per product even if a client sends the same product twice
+    quantities = Counter()
+    for item in items:
+        quantities[item["product_id"]] += item["quantity"]
+    return dict(quantities)
+
+
+class InventoryReservations:
+    """Time-limited stock holds for orders awaiting payment"""
+
+    def __init__(self, db, hold_minutes: float = 30):
+        self.products = db.products
+        self.reservations = db[RESERVATION_COLLECTION]
+        self.hold_minutes = hold_minutes
+
+    async def reserve(self, order_id: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Take stock for every line or none; raises OutOfStock"""
+        quantities = _quantities(items)
+        taken = {}
+        try:
+            for product_id, quantity in quantities.items():
+                result = await self.products.update_one(
+                    {"product_id": product_id, "stock": {"$gte": quantity}},
+                    {"$inc": {"stock": -quantity, "reserved": quantity}}
+                )
+                if not result.modified_count:
+                    product = await self.products.find_one({"product_id": product_id}, {"_id": 0, "stock": 1})
+                    raise OutOfStock(product_id, quantity, max(0, product.get("stock", 0)) if product else 0)
+                taken[product_id] = quantity
+
+            now = datetime.now(timezone.utc)
+            reservation = {
+                "reservation_id": order_id,
+                "items": [{"product_id": pid, "quantity": qty} for pid, qty in quantities.items()],
+                "status": "held",
+                "created_at": now,
+                "expires_at": now + timedelta(minutes=self.hold_minutes),
+            }
+            # Written after the stock is taken: a crash in between leaves stock
+            # under-counted (fixable by restocking) rather than oversold
+            await self.reservations.insert_one(reservation)
+        except BaseException:
+            await self._return_stock(taken, reserved=True)
+            raise
+
+        reservation.pop("_id", None)
+        return reservation
+
+    async def _return_stock(self, quantities: Dict[str, int], reserved: bool):
+        for product_id, quantity in quantities.items():
+            increments = {"stock": quantity}
+            if reserved:
+                increments["reserved"] = -quantity
+            await self.products.update_one({"product_id": product_id}, {"$inc": increments})
+
+    async def confirm(self, order_id: str, items: Optional[List[Dict[str, Any]]] = None) -> str:
+        """Make the hold permanent once the order is paid; returns how it was settled"""
+        now = datetime.now(timezone.utc)
+        reservation = await self.reservations.find_one_and_update(
+            {"reservation_id": order_id, "status": "held"},
+            {"$set": {"status": "confirmed", "settled_at": now}}
+        )
+        if reservation:
+            for item in reservation["items"]:
+                await self.products.update_one(
+                    {"product_id": item["product_id"]}, {"$inc": {"reserved": -item["quantity"]}}
+                )
+            return "confirmed"
+
+        # Hold already released (expired/failed) or the order predates reservations:
+        # the customer has paid, so take the stock regardless of what is left
+        claimed = await self.reservations.find_one_and_update(
+            {"reservation_id": order_id, "status": "released"},
+            {"$set": {"status": "confirmed_late", "settled_at": now}}
+        )
+        if claimed:
+            quantities = {item["product_id"]: item["quantity"] for item in claimed["items"]}
+        elif items is not None and await self.reservations.find_one({"reservation_id": order_id}) is None:
+            quantities = _quantities(items)
+            try:
+                await self.reservations.insert_one({
+                    "reservation_id": order_id,
+                    "items": [{"product_id": pid, "quantity": qty} for pid, qty in quantities.items()],
+                    "status": "confirmed_late",
+                    "created_at": now,
+                    "settled_at": now,
+                })
+            except DuplicateKeyError:
+                # Another worker settled it first
+                return "already_settled"
+        else:
+            return "already_settled"
+
+        for product_id, quantity in quantities.items():
+            await self.products.update_one({"product_id": product_id}, {"$inc": {"stock": -quantity}})
+        logging.warning(f"Stock taken after payment for {order_id} without an active hold")
+        return "confirmed_late"
+
+    async def release(self, order_id: str, reason: str) -> bool:
+        """Return held stock; False when there was no active hold"""
+        reservation = await self.reservations.find_one_and_update(
+            {"reservation_id": order_id, "status": "held"},
+            {"$set": {"status": "released", "release_reason": reason, "settled_at": datetime.now(timezone.utc)}}
+        )
+        if not reservation:
+            return False
+        await self._return_stock(
+            {item["product_id"]: item["quantity"] for item in reservation["items"]}, reserved=True
+        )
+        return True
+
+    async def release_expired(self, limit: int = 500) -> int:
+        """Release holds whose payment window has passed"""
+        expired = await self.reservations.find(
+            {"status": "held", "expires_at": {"$lt": datetime.now(timezone.utc)}},
+            {"_id": 0, "reservation_id": 1}
+        ).limit(limit).to_list(limit)
+        released = 0
+        for reservation in expired:
+            if await self.release(reservation["reservation_id"], "expired"):
+                released += 1
+        return released
+
+    async def run_expiry_sweeper(self, interval_seconds: float = 60):
+        while True:
+            try:
+                released = await self.release_expired()
+                if released:
+                    logging.info(f"Released {released} expired stock holds")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Stock hold sweep failed: {str(e)}")
+            await asyncio.sleep(interval_seconds)
+
+    async def summary(self) -> Dict[str, Any]:
+        counts = await self.reservations.aggregate([
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]).to_list(None)
+        return {
+            "hold_minutes": self.hold_minutes,
+            "by_status": {c["_id"]: c["count"] for c in counts},
+        }
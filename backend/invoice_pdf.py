@@ -0,0 +1,445 @@
+"""
+Invoice PDF rendering
+ReportLab layouts for invoices plus a renderer that runs them in a bounded
+process pool and keeps the rendered files on disk keyed by document + content hash.
+The render_* functions are module-level so they can be pickled into worker processes.
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, Any, Optional
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.enums import TA_CENTER, TA_RIGHT
+
+# Fields that change without changing what the PDF looks like
+VOLATILE_FIELDS = {"_id", "pdf_path", "pdf_hash", "updated_at"}
+
+
+class RendererBusy(Exception):
+    """Raised when the render queue stays full for longer than the wait timeout"""
+
+
+def _hash_default(value: Any) -> str:
+    # Mongo hands datetimes back naive and truncated to milliseconds, so hash
+    # them at second precision in UTC to match the document we inserted
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.strftime("%Y-%m-%dT%H:%M:%S")
+    return str(value)
+
+
+def content_hash(document: Dict[str, Any]) -> str:
+    """Stable short hash of everything that ends up on the PDF"""
+    relevant = {k: v for k, v in document.items() if k not in VOLATILE_FIELDS}
+    raw = json.dumps(relevant, sort_keys=True, default=_hash_default, separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+def _build(path: str, elements: list, **doc_options):
+    # Render next to the target and rename so readers never see a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    SimpleDocTemplate(tmp_path, pagesize=A4, **doc_options).build(elements)
+    os.replace(tmp_path, path)
+
+
+def render_tax_invoice(invoice: Dict[str, Any], path: str) -> str:
+    """GST tax invoice layout for a stored invoice document"""
+    elements = []
+    styles = getSampleStyleSheet()
+
+    # Custom styles
+    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=20, alignment=TA_CENTER, spaceAfter=20, textColor=colors.HexColor('#8B4513'))
+    header_style = ParagraphStyle('Header', parent=styles['Normal'], fontSize=10, alignment=TA_CENTER, textColor=colors.grey)
+    normal_style = ParagraphStyle('Normal', parent=styles['Normal'], fontSize=9)
+    bold_style = ParagraphStyle('Bold', parent=styles['Normal'], fontSize=9, fontName='Helvetica-Bold')
+    right_style = ParagraphStyle('Right', parent=styles['Normal'], fontSize=9, alignment=TA_RIGHT)
+
+    # Header - Tax Invoice
+    elements.append(Paragraph("TAX INVOICE", title_style))
+    elements.append(Spacer(1, 10))
+
+    # Invoice details row
+    invoice_info = [
+        [Paragraph(f"<b>Invoice No:</b> {invoice['invoice_number']}", normal_style),
+         Paragraph(f"<b>Invoice Date:</b> {invoice['invoice_date'][:10]}", right_style)],
+        [Paragraph(f"<b>Order ID:</b> {invoice['order_id']}", normal_style),
+         Paragraph(f"<b>Order Date:</b> {invoice['order_date'][:10]}", right_style)]
+    ]
+    invoice_table = Table(invoice_info, colWidths=[280, 250])
+    invoice_table.setStyle(TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+    ]))
+    elements.append(invoice_table)
+    elements.append(Spacer(1, 15))
+
+    # Seller and Buyer Details
+    seller_buyer_data = [
+        [Paragraph("<b>SELLER DETAILS</b>", bold_style), Paragraph("<b>BUYER DETAILS</b>", bold_style)],
+        [Paragraph(f"<b>{invoice['seller_name']}</b>", normal_style),
+         Paragraph(f"<b>{invoice['buyer_name']}</b>", normal_style)],
+        [Paragraph(f"GSTIN: {invoice['seller_gstin']}", normal_style),
+         Paragraph(f"GSTIN: {invoice.get('buyer_gstin') or 'N/A'}", normal_style)],
+        [Paragraph(f"{invoice['seller_address']}", normal_style),
+         Paragraph(f"{invoice['buyer_address']}", normal_style)],
+        [Paragraph(f"State: {invoice['seller_state']} ({invoice['seller_state_code']})", normal_style),
+         Paragraph(f"State: {invoice['buyer_state']} ({invoice['buyer_state_code']})", normal_style)],
+        [Paragraph(f"Phone: {invoice.get('seller_phone') or ''}", normal_style),
+         Paragraph(f"Phone: {invoice.get('buyer_phone') or ''}", normal_style)],
+    ]
+
+    seller_buyer_table = Table(seller_buyer_data, colWidths=[265, 265])
+    seller_buyer_table.setStyle(TableStyle([
+        ('BOX', (0, 0), (-1, -1), 1, colors.black),
+        ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f5f5f5')),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('PADDING', (0, 0), (-1, -1), 8),
+    ]))
+    elements.append(seller_buyer_table)
+    elements.append(Spacer(1, 15))
+
+    # Items table header
+    is_inter_state = invoice.get("is_inter_state", False)
+    if is_inter_state:
+        items_header = ['S.No', 'Item Description', 'HSN', 'Qty', 'Rate', 'Taxable', 'IGST%', 'IGST', 'Total']
+        col_widths = [30, 130, 50, 35, 50, 55, 40, 45, 55]
+    else:
+        items_header = ['S.No', 'Item Description', 'HSN', 'Qty', 'Rate', 'Taxable', 'CGST%', 'CGST', 'SGST', 'Total']
+        col_widths = [25, 115, 45, 30, 45, 50, 35, 40, 40, 50]
+
+    items_data = [items_header]
+
+    for idx, item in enumerate(invoice['items'], 1):
+        if is_inter_state:
+            row = [
+                str(idx),
+                item['product_name'][:30],
+                item.get('hsn_code', ''),
+                str(item['quantity']),
+                f"₹{item['unit_price']:.2f}",
+                f"₹{item['taxable_amount']:.2f}",
+                f"{item['gst_rate']}%",
+                f"₹{item['igst']:.2f}",
+                f"₹{item['total']:.2f}"
+            ]
+        else:
+            row = [
+                str(idx),
+                item['product_name'][:25],
+                item.get('hsn_code', ''),
+                str(item['quantity']),
+                f"₹{item['unit_price']:.2f}",
+                f"₹{item['taxable_amount']:.2f}",
+                f"{item['gst_rate']/2}%",
+                f"₹{item['cgst']:.2f}",
+                f"₹{item['sgst']:.2f}",
+                f"₹{item['total']:.2f}"
+            ]
+        items_data.append(row)
+
+    items_table = Table(items_data, colWidths=col_widths)
+    items_table.setStyle(TableStyle([
+        ('BOX', (0, 0), (-1, -1), 1, colors.black),
+        ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.grey),
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#8B4513')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('ALIGN', (1, 1), (1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('PADDING', (0, 0), (-1, -1), 5),
+    ]))
+    elements.append(items_table)
+    elements.append(Spacer(1, 15))
+
+    # Summary table
+    summary_data = [
+        ['Subtotal:', f"₹{invoice['subtotal']:.2f}"],
+    ]
+    if invoice.get('discount', 0) > 0:
+        summary_data.append(['Discount:', f"-₹{invoice['discount']:.2f}"])
+    summary_data.append(['Taxable Amount:', f"₹{invoice['taxable_amount']:.2f}"])
+
+    if is_inter_state:
+        summary_data.append([f"IGST:", f"₹{invoice['igst_amount']:.2f}"])
+    else:
+        summary_data.append([f"CGST:", f"₹{invoice['cgst_amount']:.2f}"])
+        summary_data.append([f"SGST:", f"₹{invoice['sgst_amount']:.2f}"])
+
+    summary_data.append(['Total GST:', f"₹{invoice['total_gst']:.2f}"])
+    summary_data.append(['', ''])
+    summary_data.append([Paragraph('<b>GRAND TOTAL:</b>', bold_style), Paragraph(f"<b>₹{invoice['grand_total']:.2f}</b>", bold_style)])
+
+    summary_table = Table(summary_data, colWidths=[380, 150])
+    summary_table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ('LINEABOVE', (0, -1), (-1, -1), 1, colors.black),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('PADDING', (0, 0), (-1, -1), 5),
+    ]))
+    elements.append(summary_table)
+    elements.append(Spacer(1, 10))
+
+    # Amount in words
+    elements.append(Paragraph(f"<b>Amount in Words:</b> {invoice['amount_in_words']}", normal_style))
+    elements.append(Spacer(1, 20))
+
+    # Bank Details & Signature
+    if invoice.get('bank_name'):
+        bank_data = [
+            [Paragraph("<b>Bank Details:</b>", bold_style), '', Paragraph("<b>For Paridhaan Creations</b>", bold_style)],
+            [f"Bank: {invoice.get('bank_name', '')}", '', ''],
+            [f"A/C No: {invoice.get('bank_account_number', '')}", '', ''],
+            [f"IFSC: {invoice.get('bank_ifsc', '')}", '', ''],
+            ['', '', Paragraph("<b>Authorized Signatory</b>", normal_style)],
+        ]
+    else:
+        bank_data = [
+            ['', '', Paragraph("<b>For Paridhaan Creations</b>", bold_style)],
+            ['', '', ''],
+            ['', '', ''],
+            ['', '', Paragraph("<b>Authorized Signatory</b>", normal_style)],
+        ]
+
+    bank_table = Table(bank_data, colWidths=[200, 130, 200])
+    bank_table.setStyle(TableStyle([
+        ('ALIGN', (2, 0), (2, -1), 'CENTER'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    elements.append(bank_table)
+    elements.append(Spacer(1, 20))
+
+    # Footer
+    if invoice.get('invoice_footer_text'):
+        elements.append(Paragraph(f"<i>{invoice['invoice_footer_text']}</i>", header_style))
+
+    elements.append(Paragraph("This is a computer generated invoice and does not require a physical signature.", header_style))
+
+    _build(path, elements, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
+    return path
+
+
+def render_order_summary(order: Dict[str, Any], path: str) -> str:
+    """Simple order invoice used by GET /orders/{order_id}/invoice"""
+    elements = []
+    styles = getSampleStyleSheet()
+
+    title_style = ParagraphStyle(
+        'CustomTitle',
+        parent=styles['Heading1'],
+        fontSize=24,
+        textColor=colors.HexColor('#0F4C75'),
+        spaceAfter=30,
+        alignment=TA_CENTER
+    )
+
+    elements.append(Paragraph("Paridhaan Creations", title_style))
+    elements.append(Paragraph("INVOICE", styles['Heading2']))
+    elements.append(Spacer(1, 0.3*inch))
+
+    invoice_data = [
+        ["Invoice Number:", order["order_id"]],
+        ["Order Date:", str(order.get("created_at", ""))[:10]],
+        ["Payment Status:", order.get("payment_status", "").upper()],
+        ["Order Status:", order.get("status", "").upper()]
+    ]
+
+    invoice_table = Table(invoice_data, colWidths=[2*inch, 3*inch])
+    invoice_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    elements.append(invoice_table)
+    elements.append(Spacer(1, 0.3*inch))
+
+    elements.append(Paragraph("Bill To:", styles['Heading3']))
+    addr = order.get("shipping_address", {})
+    address_text = f"""
+        {addr.get('full_name', '')}<br/>
+        {addr.get('address_line1', '')}<br/>
+        {addr.get('address_line2', '') + '<br/>' if addr.get('address_line2') else ''}
+        {addr.get('city', '')}, {addr.get('state', '')} {addr.get('pincode', '')}<br/>
+        Phone: {addr.get('phone', '')}
+    """
+    elements.append(Paragraph(address_text, styles['Normal']))
+    elements.append(Spacer(1, 0.3*inch))
+
+    items_data = [["Product", "Quantity", "Price", "Total"]]
+    for item in order.get("items", []):
+        items_data.append([
+            item.get("product_name", ""),
+            str(item.get("quantity", 0)),
+            f"₹{item.get('price', 0):.2f}",
+            f"₹{(item.get('price', 0) * item.get('quantity', 0)):.2f}"
+        ])
+
+    items_data.append(["", "", "Total:", f"₹{order.get('total_amount', 0):.2f}"])
+
+    items_table = Table(items_data, colWidths=[3*inch, 1*inch, 1.5*inch, 1.5*inch])
+    items_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0F4C75')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('GRID', (0, 0), (-1, -2), 1, colors.grey),
+        ('LINEABOVE', (2, -1), (-1, -1), 2, colors.HexColor('#0F4C75')),
+        ('FONTNAME', (2, -1), (-1, -1), 'Helvetica-Bold'),
+    ]))
+    elements.append(items_table)
+    elements.append(Spacer(1, 0.5*inch))
+
+    footer_text = "Thank you for your business!<br/>Paridhaan Creations"
+    elements.append(Paragraph(footer_text, ParagraphStyle('Footer', parent=styles['Normal'], alignment=TA_CENTER)))
+
+    _build(path, elements)
+    return path
+
+
+class ZipStream:
+    """Write-only file object for zipfile.ZipFile that hands bytes out as they are written"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class InvoiceRenderer:
+    """
+    Runs render_* functions in a process pool. At most max_pending renders are
+    queued or running; callers beyond that wait up to queue_timeout seconds and
+    then get RendererBusy. Output lands in output_dir as
+    {prefix}_{key}_{content hash}.pdf, so an unchanged document is never re-rendered.
+    """
+
+    def __init__(self, output_dir: Path, max_workers: int = 2, max_pending: int = 8, queue_timeout: float = 10.0):
+        self.output_dir = Path(output_dir)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.queue_timeout = queue_timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.rendered = 0
+        self.cache_hits = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._executor is None:
+            # spawn: forked children would inherit the Mongo client's threads and sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        if self._slots is None:
+            # Created once: pool restarts must not reset the pending-render budget
+            self._slots = asyncio.Semaphore(self.max_pending)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def cached_path(self, prefix: str, key: str, document: Dict[str, Any]) -> Path:
+        return self.output_dir / f"{prefix}_{key}_{content_hash(document)}.pdf"
+
+    async def render(self, render_fn: Callable, prefix: str, key: str, document: Dict[str, Any]) -> Path:
+        """Return the PDF for document, rendering it in the pool only if not cached"""
+        path = self.cached_path(prefix, key, document)
+        if path.exists():
+            self.cache_hits += 1
+            return path
+
+        # Concurrent requests for the same document share one render
+        inflight = self._inflight.get(str(path))
+        if inflight is not None:
+            await asyncio.shield(inflight)
+            return path
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[str(path)] = future
+        try:
+            await self._run(render_fn, document, str(path))
+            self._remove_stale(prefix, key, path)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        finally:
+            self._inflight.pop(str(path), None)
+
+    async def _run(self, render_fn: Callable, document: Dict[str, Any], path: str):
+        self.start()
+        slots = self._slots
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise RendererBusy("Invoice renderer is busy")
+        try:
+            self.start()
+            executor = self._executor
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, render_fn, document, path)
+            self.rendered += 1
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault); start a fresh pool for the next caller.
+            # Every render in flight on the broken pool lands here; only the first replaces it.
+            if self._executor is executor:
+                logging.error("Invoice render pool broke, restarting it")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+                self.start()
+            raise
+        finally:
+            slots.release()
+
+    def _remove_stale(self, prefix: str, key: str, current: Path):
+        # Older renders of the same document (content changed since)
+        for old in self.output_dir.glob(f"{prefix}_{key}_*.pdf"):
+            if old != current:
+                try:
+                    old.unlink()
+                except OSError as e:
+                    logging.error(f"Could not remove stale invoice PDF {old}: {str(e)}")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "rendered": self.rendered,
+            "cache_hits": self.cache_hits,
+            "rejected": self.rejected,
+            "in_flight": len(self._inflight),
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+        }
@@ -0,0 +1,177 @@
+"""
+Notification outbox
+Order handlers no longer call email/SMS/WhatsApp providers themselves. They
+write one notification_outbox document per channel right after the order update
+and return; a background dispatcher delivers them. The document _id is
+"<order_id>:<event>:<channel>", so setting the same status twice does not
+message the customer twice.
+
+The dispatcher drains each channel separately, spaced by that channel's
+RateLimiter (see cart_recovery.py). A sender returns "sent" or "skipped" (channel
+not configured, no recipient) and raises to have the message retried with
+exponential backoff; after max_attempts the message is parked as failed. A
+claim whose dispatcher died is released after LEASE_SECONDS. Delivered messages
+expire after RETENTION_DAYS.
+
+    pending -> sending -> sent | skipped
+                       -> pending (retry, next_attempt_at in the future)
+                       -> failed
+
+The outbox write is not in a transaction with the order update (the deployment
+has no replica set); a crash between the two writes loses that notification,
+never the order change.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, Any, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from cart_recovery import RateLimiter
+
+OUTBOX_COLLECTION = "notification_outbox"
+
+LEASE_SECONDS = 120
+RETENTION_DAYS = 30
+MAX_BACKOFF_SECONDS = 3600
+
+
+class NotificationOutbox:
+    """Durable queue of customer notifications with per-channel delivery"""
+
+    def __init__(
+        self,
+        db,
+        senders: Dict[str, Callable[[Dict[str, Any]], Awaitable[Optional[str]]]],
+        rates: Dict[str, float],
+        max_attempts: int = 6,
+        base_delay_seconds: float = 30,
+        batch_size: int = 100,
+    ):
+        self.messages = db[OUTBOX_COLLECTION]
+        self.senders = senders
+        self.rate_limiters = {channel: RateLimiter(rates.get(channel, 0)) for channel in senders}
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+
+    async def enqueue(self, order_id: str, event: str, payloads: Dict[str, Dict[str, Any]]) -> int:
+        """Queue one message per channel for an order event; returns how many were new"""
+        now = datetime.now(timezone.utc)
+        documents = [
+            {
+                "_id": f"{order_id}:{event}:{channel}",
+                "order_id": order_id,
+                "event": event,
+                "channel": channel,
+                "payload": payload,
+                "status": "pending",
+                "attempts": 0,
+                "created_at": now,
+                "next_attempt_at": now,
+            }
+            for channel, payload in payloads.items()
+        ]
+        if not documents:
+            return 0
+        try:
+            result = await self.messages.insert_many(documents, ordered=False)
+            queued = len(result.inserted_ids)
+        except BulkWriteError as e:
+            # Duplicates of an event already queued are dropped
+            queued = e.details.get("nInserted", 0)
+        if queued:
+            self._wakeup.set()
+        return queued
+
+    async def _claim(self, channel: str) -> Optional[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        return await self.messages.find_one_and_update(
+            {"channel": channel, "status": "pending", "next_attempt_at": {"$lte": now}},
+            {
+                "$set": {"status": "sending", "locked_until": now + timedelta(seconds=LEASE_SECONDS)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _deliver(self, message: Dict[str, Any]):
+        now = datetime.now(timezone.utc)
+        try:
+            await self.rate_limiters[message["channel"]].wait()
+            status = await self.senders[message["channel"]](message["payload"]) or "sent"
+        except Exception as e:
+            error = str(e)[:500]
+            if message["attempts"] >= self.max_attempts:
+                logging.error(f"Notification {message['_id']} failed {message['attempts']} times, giving up: {error}")
+                update = {"status": "failed", "last_error": error, "failed_at": now}
+            else:
+                delay = min(self.base_delay_seconds * 2 ** (message["attempts"] - 1), MAX_BACKOFF_SECONDS)
+                logging.warning(f"Notification {message['_id']} failed (attempt {message['attempts']}), retrying in {delay:.0f}s: {error}")
+                update = {"status": "pending", "last_error": error, "next_attempt_at": now + timedelta(seconds=delay)}
+        else:
+            update = {"status": status, "delivered_at": now, "expires_at": now + timedelta(days=RETENTION_DAYS)}
+        await self.messages.update_one(
+            {"_id": message["_id"], "status": "sending"}, {"$set": update, "$unset": {"locked_until": ""}}
+        )
+
+    async def _drain_channel(self, channel: str) -> int:
+        delivered = 0
+        while delivered < self.batch_size:
+            message = await self._claim(channel)
+            if message is None:
+                break
+            await self._deliver(message)
+            delivered += 1
+        return delivered
+
+    async def dispatch_once(self) -> Dict[str, int]:
+        """Deliver due messages, each channel at its own rate; returns counts per channel"""
+        await self.messages.update_many(
+            {"status": "sending", "locked_until": {"$lt": datetime.now(timezone.utc)}},
+            {"$set": {"status": "pending"}}
+        )
+        channels = list(self.senders)
+        counts = await asyncio.gather(*(self._drain_channel(channel) for channel in channels))
+        return dict(zip(channels, counts))
+
+    async def run_dispatcher(self, poll_seconds: float = 2.0):
+        while True:
+            try:
+                self._wakeup.clear()
+                counts = await self.dispatch_once()
+                if any(count >= self.batch_size for count in counts.values()):
+                    continue  # Backlog: go again without waiting
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Notification dispatcher error: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def retry(self, message_id: str) -> bool:
+        """Requeue a message that exhausted its retries"""
+        result = await self.messages.update_one(
+            {"_id": message_id, "status": "failed"},
+            {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": datetime.now(timezone.utc)}}
+        )
+        if result.modified_count:
+            self._wakeup.set()
+        return result.modified_count == 1
+
+    async def summary(self) -> Dict[str, Any]:
+        counts = await self.messages.aggregate([
+            {"$group": {"_id": {"channel": "$channel", "status": "$status"}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+        by_channel: Dict[str, Dict[str, int]] = {}
+        for row in counts:
+            by_channel.setdefault(row["_id"]["channel"], {})[row["_id"]["status"]] = row["count"]
+        failed = await self.messages.find({"status": "failed"}).sort("failed_at", -1).limit(20).to_list(20)
+        return {"by_channel": by_channel, "failed": failed}
@@ -0,0 +1,114 @@
+"""
+Shared pagination helpers
+Opaque keyset cursors on (created_at, id) and ?fields= projections for list endpoints.
+Deep pages cost the same as the first one because there is no skip().
+"""
+
+import re
+import json
+import base64
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+FIELD_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$")
+
+
+def encode_cursor(values: List[Any]) -> str:
+    """Opaque, URL-safe cursor from a list of JSON-able values"""
+    raw = json.dumps(values, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    """Inverse of encode_cursor. Raises ValueError for anything malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, TypeError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _encode_created_at(value: Any) -> List[Any]:
+    # created_at is an ISO string on most collections but a datetime on some;
+    # keep the type so the keyset comparison runs against the same BSON type
+    if isinstance(value, datetime):
+        return ["d", value.isoformat()]
+    return ["s", value]
+
+
+def _decode_created_at(encoded: List[Any]) -> Any:
+    kind, value = encoded
+    if kind == "d":
+        return datetime.fromisoformat(value)
+    return value
+
+
+def parse_fields(fields: Optional[str], always_include: List[str]) -> Dict[str, int]:
+    """Turn ?fields=name,price into a Mongo projection. Raises ValueError on bad names."""
+    projection = {"_id": 0}
+    if not fields:
+        return projection
+
+    for field in (f.strip() for f in fields.split(",")):
+        if not field:
+            continue
+        if not FIELD_NAME_PATTERN.match(field):
+            raise ValueError(f"Invalid field name: {field}")
+        projection[field] = 1
+
+    for field in always_include:
+        projection[field] = 1
+    return projection
+
+
+def cursor_for(doc: Dict[str, Any], id_field: str) -> str:
+    """Cursor pointing just past doc in a (created_at, id_field) ordering"""
+    return encode_cursor([_encode_created_at(doc.get("created_at")), doc[id_field]])
+
+
+def keyset_filter(cursor: str, id_field: str, ascending: bool = False) -> Dict[str, Any]:
+    """Query matching the documents after cursor. Raises ValueError for a bad cursor."""
+    try:
+        created_at_encoded, last_id = decode_cursor(cursor)
+        last_created_at = _decode_created_at(created_at_encoded)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    op = "$gt" if ascending else "$lt"
+    return {"$or": [
+        {"created_at": {op: last_created_at}},
+        {"created_at": last_created_at, id_field: {op: last_id}}
+    ]}
+
+
+async def paginate(
+    collection,
+    query: Dict[str, Any],
+    id_field: str,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Newest-first keyset page over (created_at, id_field)"""
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    projection = parse_fields(fields, [id_field, "created_at"])
+
+    if cursor:
+        keyset = keyset_filter(cursor, id_field)
+        query = {"$and": [query, keyset]} if query else keyset
+
+    docs = await collection.find(query, projection).sort(
+        [("created_at", -1), (id_field, -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = cursor_for(docs[-1], id_field)
+
+    return {"items": docs, "next_cursor": next_cursor}
@@ -0,0 +1,263 @@
+"""
+Product Search Engine
+In-memory inverted index over the catalog with relevance ranking, prefix
+matching, facet counts and keyset cursors. Holds only searchable/facet fields;
+full product documents are still read from MongoDB by product_id.
+"""
+
+import re
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Optional, List, Dict, Any
+
+from pagination import encode_cursor, decode_cursor
+
+# Relevance weight per indexed field
+FIELD_WEIGHTS = {
+    "name": 5.0,
+    "tags": 3.0,
+    "brand": 2.0,
+    "material": 2.0,
+    "color": 2.0,
+    "description": 1.0,
+}
+
+# Prefix matches ("bras" -> "brass") score lower than exact token matches
+PREFIX_MATCH_FACTOR = 0.5
+MIN_PREFIX_LENGTH = 2
+
+# (lower, upper, label) - upper bound exclusive, None = open ended
+PRICE_BANDS = [
+    (0, 500, "0-500"),
+    (500, 1000, "500-1000"),
+    (1000, 2500, "1000-2500"),
+    (2500, 5000, "2500-5000"),
+    (5000, None, "5000+"),
+]
+
+SORT_OPTIONS = ["relevance", "newest", "price_asc", "price_desc"]
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase word tokens"""
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def get_price_band(price: float) -> str:
+    for lower, upper, label in PRICE_BANDS:
+        if price >= lower and (upper is None or price < upper):
+            return label
+    return PRICE_BANDS[0][2]
+
+
+def encode_search_cursor(sort: str, key: tuple) -> str:
+    return encode_cursor([sort, list(key)])
+
+
+def decode_search_cursor(cursor: str, sort: str) -> tuple:
+    """Return the sort key encoded in cursor. Raises ValueError if it is malformed or for another sort."""
+    try:
+        cursor_sort, key = decode_cursor(cursor)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or not isinstance(key, list) or len(key) != 2 or not isinstance(key[1], str):
+        raise ValueError("Invalid cursor")
+    # Keys are (created_at, product_id) for "newest", (number, product_id) otherwise
+    first_type = str if sort == "newest" else (int, float)
+    if not isinstance(key[0], first_type) or isinstance(key[0], bool):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+class ProductSearchIndex:
+    """Inverted index: token -> {product_id: weight}"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.doc_tokens: Dict[str, set] = {}
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self._vocabulary: List[str] = []
+        self._vocabulary_dirty = False
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def clear(self):
+        self.postings.clear()
+        self.doc_tokens.clear()
+        self.docs.clear()
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+
+    def add(self, product: Dict[str, Any]):
+        """Index (or re-index) a product document"""
+        product_id = product["product_id"]
+        self.remove(product_id)
+
+        weights: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            value = product.get(field)
+            if isinstance(value, list):
+                value = " ".join(str(v) for v in value)
+            for token in tokenize(value):
+                # A token's weight is its best field; repeats don't stack
+                weights[token] = max(weights.get(token, 0), weight)
+
+        for token, weight in weights.items():
+            if token not in self.postings:
+                self.postings[token] = {}
+                self._vocabulary_dirty = True
+            self.postings[token][product_id] = weight
+
+        self.doc_tokens[product_id] = set(weights)
+        price = float(product.get("price") or 0)
+        self.docs[product_id] = {
+            "category": product.get("category"),
+            "price": price,
+            "price_band": get_price_band(price),
+            "badge": product.get("badge"),
+            "featured": bool(product.get("featured")),
+            "laddu_gopal_sizes": list(product.get("laddu_gopal_sizes") or []),
+            "created_at": str(product.get("created_at") or ""),
+        }
+
+    def remove(self, product_id: str):
+        for token in self.doc_tokens.pop(product_id, set()):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            posting.pop(product_id, None)
+            if not posting:
+                del self.postings[token]
+                self._vocabulary_dirty = True
+        self.docs.pop(product_id, None)
+
+    def _prefix_tokens(self, prefix: str) -> List[str]:
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self.postings)
+            self._vocabulary_dirty = False
+        start = bisect_left(self._vocabulary, prefix)
+        end = bisect_right(self._vocabulary, prefix + "\uffff")
+        return self._vocabulary[start:end]
+
+    def _match(self, query: str) -> Optional[Dict[str, float]]:
+        """Score products matching every query term. None means no query (match all)."""
+        terms = tokenize(query)
+        if not terms:
+            return None
+
+        scores: Optional[Dict[str, float]] = None
+        for term in terms:
+            term_scores: Dict[str, float] = dict(self.postings.get(term, {}))
+            if len(term) >= MIN_PREFIX_LENGTH:
+                for token in self._prefix_tokens(term):
+                    if token == term:
+                        continue
+                    for product_id, weight in self.postings[token].items():
+                        prefix_weight = weight * PREFIX_MATCH_FACTOR
+                        if prefix_weight > term_scores.get(product_id, 0):
+                            term_scores[product_id] = prefix_weight
+
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {pid: score + term_scores[pid] for pid, score in scores.items() if pid in term_scores}
+            if not scores:
+                return {}
+        return scores
+
+    def _passes_filters(self, doc: Dict[str, Any], filters: Dict[str, Any]) -> bool:
+        if filters.get("category") and doc["category"] != filters["category"]:
+            return False
+        if filters.get("featured") is not None and doc["featured"] != filters["featured"]:
+            return False
+        if filters.get("laddu_gopal_size") and filters["laddu_gopal_size"] not in doc["laddu_gopal_sizes"]:
+            return False
+        if filters.get("badge") and doc["badge"] != filters["badge"]:
+            return False
+        if filters.get("price_band") and doc["price_band"] != filters["price_band"]:
+            return False
+        if filters.get("min_price") is not None and doc["price"] < filters["min_price"]:
+            return False
+        if filters.get("max_price") is not None and doc["price"] > filters["max_price"]:
+            return False
+        return True
+
+    def _sort_key(self, sort: str, product_id: str, score: float) -> tuple:
+        doc = self.docs[product_id]
+        if sort == "newest":
+            # ISO timestamps can't be negated, so "newest" sorts this key descending
+            return (doc["created_at"], product_id)
+        if sort == "price_asc":
+            return (doc["price"], product_id)
+        if sort == "price_desc":
+            return (-doc["price"], product_id)
+        return (-round(score, 6), product_id)
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        sort: str = "relevance",
+        cursor: Optional[str] = None,
+        limit: Optional[int] = 24,
+    ) -> Dict[str, Any]:
+        """
+        Run a query. Returns ranked product_ids for one page, the total match
+        count, facet counts over all matches and the cursor for the next page.
+        Raises ValueError for a cursor that is malformed or from another sort.
+        """
+        filters = filters or {}
+        if sort not in SORT_OPTIONS:
+            sort = "relevance"
+
+        scores = self._match(query or "")
+        candidates = scores.keys() if scores is not None else self.docs.keys()
+        matched = [pid for pid in candidates if pid in self.docs and self._passes_filters(self.docs[pid], filters)]
+
+        facets = {"category": Counter(), "price_band": Counter(), "laddu_gopal_sizes": Counter(), "badge": Counter()}
+        for product_id in matched:
+            doc = self.docs[product_id]
+            if doc["category"]:
+                facets["category"][doc["category"]] += 1
+            facets["price_band"][doc["price_band"]] += 1
+            if doc["badge"]:
+                facets["badge"][doc["badge"]] += 1
+            for size in doc["laddu_gopal_sizes"]:
+                facets["laddu_gopal_sizes"][size] += 1
+
+        descending = sort == "newest"
+        keyed = sorted(
+            ((self._sort_key(sort, pid, scores.get(pid, 0) if scores else 0), pid) for pid in matched),
+            reverse=descending
+        )
+
+        start = 0
+        if cursor:
+            after = decode_search_cursor(cursor, sort)
+            keys = [key for key, _ in keyed]
+            if descending:
+                # Keys are in descending order; find first key strictly below cursor
+                start = next((i for i, key in enumerate(keys) if key < after), len(keys))
+            else:
+                start = bisect_right(keys, after)
+
+        page = keyed[start:start + limit] if limit else keyed[start:]
+        has_more = limit is not None and start + limit < len(keyed)
+
+        return {
+            "product_ids": [pid for _, pid in page],
+            "scores": {pid: round(scores[pid], 3) for _, pid in page} if scores else {},
+            "total": len(matched),
+            "facets": {
+                "category": dict(facets["category"].most_common()),
+                "price_band": {label: facets["price_band"][label] for _, _, label in PRICE_BANDS if facets["price_band"][label]},
+                "laddu_gopal_sizes": dict(sorted(facets["laddu_gopal_sizes"].items())),
+                "badge": dict(facets["badge"].most_common()),
+            },
+            "next_cursor": encode_search_cursor(sort, page[-1][0]) if has_more and page else None,
+        }
@@ -0,0 +1,247 @@
+"""
+Revenue Rollups
+One revenue_daily document per UTC day of order creation holding revenue, paid
+order count, units (total and by category) and new vs returning customers.
+Documents are bumped with $inc when an order becomes paid, so the analytics
+dashboard sums days instead of scanning orders. The server builds them from order
+history on startup when the collection is empty (first deploy, new database).
+Repair history with:
+
+    python revenue_rollups.py --rebuild                       # all history
+    python revenue_rollups.py --rebuild --from 2025-04-01 --to 2025-04-30
+
+Run a rebuild while payments are quiet; an order paid mid-rebuild can be counted twice.
+"""
+
+import os
+import sys
+import asyncio
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+ROLLUP_COLLECTION = "revenue_daily"
+
+
+def order_day(order: Dict[str, Any]) -> str:
+    """UTC day (YYYY-MM-DD) an order belongs to"""
+    created_at = order.get("created_at")
+    if isinstance(created_at, datetime):
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc)
+        return created_at.date().isoformat()
+    return str(created_at or "")[:10]
+
+
+def _created_key(order: Dict[str, Any]) -> str:
+    created_at = order.get("created_at")
+    if isinstance(created_at, datetime):
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return created_at.isoformat()
+    return str(created_at or "")
+
+
+def customer_key(order: Dict[str, Any]) -> Optional[str]:
+    return order.get("user_id") or order.get("guest_email")
+
+
+def _category_field(slug: Optional[str]) -> str:
+    # Category slugs become field names; keep them valid for $inc paths
+    return (slug or "uncategorized").replace(".", "_").replace("$", "_")
+
+
+async def _product_categories(db, product_ids) -> Dict[str, str]:
+    product_ids = list(set(product_ids))
+    products = await db.products.find(
+        {"product_id": {"$in": product_ids}}, {"_id": 0, "product_id": 1, "category": 1}
+    ).to_list(len(product_ids) or 1)
+    return {p["product_id"]: p.get("category") for p in products}
+
+
+async def _is_returning(db, order: Dict[str, Any]) -> bool:
+    """True when the customer has an earlier paid order"""
+    key = customer_key(order)
+    if not key:
+        return False
+    field = "user_id" if order.get("user_id") else "guest_email"
+    earlier = await db.orders.find_one(
+        {
+            field: key,
+            "payment_status": "paid",
+            "order_id": {"$ne": order["order_id"]},
+            "created_at": {"$lt": order["created_at"]},
+        },
+        {"_id": 0, "order_id": 1}
+    )
+    return earlier is not None
+
+
+async def record_paid_order(db, order: Dict[str, Any]):
+    """Add a newly paid order to its day's rollup"""
+    categories = await _product_categories(db, [item["product_id"] for item in order.get("items", [])])
+    units_by_category = Counter()
+    for item in order.get("items", []):
+        units_by_category[_category_field(categories.get(item["product_id"]))] += item.get("quantity", 0)
+
+    returning = await _is_returning(db, order)
+    increments = {
+        "revenue": order.get("total_amount", 0),
+        "orders": 1,
+        "units": sum(units_by_category.values()),
+        "returning_customers" if returning else "new_customers": 1,
+    }
+    for category, units in units_by_category.items():
+        increments[f"units_by_category.{category}"] = units
+
+    await db[ROLLUP_COLLECTION].update_one(
+        {"day": order_day(order)},
+        {"$inc": increments, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+async def summarize(db, start_day: Optional[str] = None, end_day: Optional[str] = None) -> Dict[str, Any]:
+    """Sum the daily rollups between two days (inclusive)"""
+    query = {}
+    if start_day or end_day:
+        query["day"] = {}
+        if start_day:
+            query["day"]["$gte"] = start_day
+        if end_day:
+            query["day"]["$lte"] = end_day
+
+    days = await db[ROLLUP_COLLECTION].find(query, {"_id": 0, "updated_at": 0}).sort("day", 1).to_list(None)
+
+    totals = Counter()
+    units_by_category = Counter()
+    daily = []
+    for day in days:
+        for field in ["revenue", "orders", "units", "new_customers", "returning_customers"]:
+            totals[field] += day.get(field, 0)
+        units_by_category.update(day.get("units_by_category", {}))
+        daily.append({
+            "day": day["day"],
+            "revenue": round(day.get("revenue", 0), 2),
+            "orders": day.get("orders", 0),
+            "aov": round(day.get("revenue", 0) / day["orders"], 2) if day.get("orders") else 0,
+        })
+
+    return {
+        "start_date": start_day,
+        "end_date": end_day,
+        "revenue": round(totals["revenue"], 2),
+        "orders": totals["orders"],
+        "aov": round(totals["revenue"] / totals["orders"], 2) if totals["orders"] else 0,
+        "units": totals["units"],
+        "units_by_category": dict(units_by_category.most_common()),
+        "new_customers": totals["new_customers"],
+        "returning_customers": totals["returning_customers"],
+        "daily": daily,
+    }
+
+
+async def total_revenue(db) -> float:
+    result = await db[ROLLUP_COLLECTION].aggregate([
+        {"$group": {"_id": None, "revenue": {"$sum": "$revenue"}}}
+    ]).to_list(1)
+    return round(result[0]["revenue"], 2) if result else 0
+
+
+async def rebuild(db, start_day: Optional[str] = None, end_day: Optional[str] = None) -> Dict[str, Any]:
+    """Recompute rollups from paid orders, replacing the days in range"""
+    product_categories = {
+        p["product_id"]: p.get("category")
+        async for p in db.products.find({}, {"_id": 0, "product_id": 1, "category": 1})
+    }
+
+    # Whole history is read even for a partial range: "new" means the
+    # customer's first paid order ever, not the first one inside the range
+    orders = [
+        order async for order in db.orders.find(
+            {"payment_status": "paid"},
+            {"_id": 0, "order_id": 1, "user_id": 1, "guest_email": 1, "created_at": 1, "total_amount": 1,
+             "items.product_id": 1, "items.quantity": 1}
+        )
+    ]
+    orders.sort(key=_created_key)
+
+    days: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
+        "revenue": 0, "orders": 0, "units": 0, "new_customers": 0, "returning_customers": 0,
+        "units_by_category": Counter()
+    })
+    seen_customers = set()
+    for order in orders:
+        key = customer_key(order)
+        returning = key in seen_customers
+        if key:
+            seen_customers.add(key)
+
+        day = order_day(order)
+        if (start_day and day < start_day) or (end_day and day > end_day):
+            continue
+
+        rollup = days[day]
+        rollup["revenue"] += order.get("total_amount", 0)
+        rollup["orders"] += 1
+        rollup["returning_customers" if returning else "new_customers"] += 1
+        for item in order.get("items", []):
+            quantity = item.get("quantity", 0)
+            rollup["units"] += quantity
+            rollup["units_by_category"][_category_field(product_categories.get(item["product_id"]))] += quantity
+
+    query = {}
+    if start_day or end_day:
+        query["day"] = {}
+        if start_day:
+            query["day"]["$gte"] = start_day
+        if end_day:
+            query["day"]["$lte"] = end_day
+    await db[ROLLUP_COLLECTION].delete_many(query)
+
+    now = datetime.now(timezone.utc)
+    documents = [
+        {"day": day, **{**rollup, "units_by_category": dict(rollup["units_by_category"])}, "updated_at": now}
+        for day, rollup in sorted(days.items())
+    ]
+    if documents:
+        await db[ROLLUP_COLLECTION].insert_many(documents)
+
+    logging.info(f"Revenue rollups rebuilt: {len(documents)} days from {len(orders)} paid orders")
+    return {"days": len(documents), "paid_orders_scanned": len(orders)}
+
+
+async def backfill_if_empty(db) -> Optional[Dict[str, Any]]:
+    """Rebuild all history when there are paid orders but no rollups yet"""
+    if await db[ROLLUP_COLLECTION].find_one({}, {"_id": 1}) is not None:
+        return None
+    if await db.orders.find_one({"payment_status": "paid"}, {"_id": 1}) is None:
+        return None
+    # Two servers starting together both rebuild; the unique day index makes the later insert fail
+    return await rebuild(db)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(Path(__file__).parent / ".env")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    def arg(name: str) -> Optional[str]:
+        return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else None
+
+    async def main():
+        client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        db = client[os.environ["DB_NAME"]]
+        if "--rebuild" in sys.argv:
+            print(await rebuild(db, arg("--from"), arg("--to")))
+        else:
+            summary = await summarize(db, arg("--from"), arg("--to"))
+            summary.pop("daily")
+            print(summary)
+        client.close()
+
+    asyncio.run(main())
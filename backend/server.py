@@ -1,35 +1,54 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Cookie, Response, Request, Header, UploadFile, File, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import CursorType, UpdateOne, ReturnDocument
+from pymongo.errors import CollectionInvalid, BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 import uuid
+import time
+import json
+import asyncio
 from datetime import datetime, timezone, timedelta
 import razorpay
 import requests
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
 from twilio.rest import Client as TwilioClient
+from twilio.http.async_http_client import AsyncTwilioHttpClient
 import csv
 import io
 import shutil
+import zipfile
 from openpyxl import Workbook
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_RIGHT
 from collections import Counter
 from PIL import Image as PILImage
 
 # Import Shiprocket service
+import shiprocket_service
 from shiprocket_service import ShiprocketService, ShiprocketAuth, get_status_label
+from cache_utils import TTLCache
+from db_indexes import ensure_indexes, index_report
+from product_search import ProductSearchIndex, SORT_OPTIONS
+from pagination import paginate, parse_fields, cursor_for, keyset_filter
+from invoice_sequence import InvoiceSequencer
+from gst_engine import GSTEngine, resolve_rate, compute_gst
+from revenue_rollups import record_paid_order, summarize as summarize_revenue, total_revenue as rollup_total_revenue, backfill_if_empty as backfill_revenue_rollups
+from invoice_pdf import InvoiceRenderer, RendererBusy, ZipStream, render_tax_invoice, render_order_summary
+from cart_recovery import CartRecoveryScheduler
+from inventory import InventoryReservations, OutOfStock
+from idempotency import IdempotencyClaim, IdempotencyStore, fingerprint
+from courier_quotes import CourierQuoteCache
+from shipment_tracking import ShipmentTracker
+from webhook_inbox import WebhookInbox
+from whatsapp_service import WhatsAppService, send_order_whatsapp_notification
+import whatsapp_service
+from notification_outbox import NotificationOutbox
 
 ROOT_DIR = Path(__file__).parent
 UPLOAD_DIR = ROOT_DIR / "uploads"
@@ -46,33 +65,40 @@ api_router = APIRouter(prefix="/api")
 
 razorpay_client = razorpay.Client(auth=(os.environ['RAZORPAY_KEY_ID'], os.environ['RAZORPAY_KEY_SECRET']))
 
-# Initialize Twilio client if credentials are available
+# Twilio client with its aiohttp transport, so sending an SMS never blocks the event loop.
+# Created on first use: the aiohttp session has to be opened inside the running loop.
 twilio_client = None
-if os.environ.get('TWILIO_ACCOUNT_SID') and os.environ.get('TWILIO_AUTH_TOKEN'):
-    twilio_client = TwilioClient(os.environ['TWILIO_ACCOUNT_SID'], os.environ['TWILIO_AUTH_TOKEN'])
 
-async def send_order_notification(order_id: str, phone: str, status: str, tracking_url: str = None):
-    """Send SMS notification for order updates"""
-    if not twilio_client or not os.environ.get('TWILIO_PHONE_NUMBER'):
+def get_twilio_client():
+    global twilio_client
+    if twilio_client is None and os.environ.get('TWILIO_ACCOUNT_SID') and os.environ.get('TWILIO_AUTH_TOKEN'):
+        twilio_client = TwilioClient(
+            os.environ['TWILIO_ACCOUNT_SID'], os.environ['TWILIO_AUTH_TOKEN'],
+            http_client=AsyncTwilioHttpClient(timeout=30)
+        )
+    return twilio_client
+
+async def send_order_notification(order_id: str, phone: str, status: str, tracking_url: str = None) -> str:
+    """Send SMS notification for order updates; raises on failure so the outbox can retry"""
+    sms_client = get_twilio_client()
+    if not sms_client or not os.environ.get('TWILIO_PHONE_NUMBER'):
         logging.info(f"Twilio not configured. Skipping SMS for order {order_id}")
-        return
+        return "skipped"
     
-    try:
-        messages = {
-            "confirmed": f"Your order #{order_id} has been confirmed! We'll notify you when it ships.",
-            "shipped": f"Great news! Your order #{order_id} has been shipped and is on its way. Track here: {tracking_url}" if tracking_url else f"Great news! Your order #{order_id} has been shipped and is on its way.",
-            "delivered": f"Your order #{order_id} has been delivered. Thank you for shopping with Paridhaan Creations!",
-            "cancelled": f"Your order #{order_id} has been cancelled. Contact us if you have questions."
-        }
-        
-        message = twilio_client.messages.create(
-            body=messages.get(status, f"Order {order_id} status: {status}"),
-            from_=os.environ['TWILIO_PHONE_NUMBER'],
-            to=phone
-        )
-        logging.info(f"SMS sent for order {order_id}: {message.sid}")
-    except Exception as e:
-        logging.error(f"Failed to send SMS for order {order_id}: {str(e)}")
+    messages = {
+        "confirmed": f"Your order #{order_id} has been confirmed! We'll notify you when it ships.",
+        "shipped": f"Great news! Your order #{order_id} has been shipped and is on its way. Track here: {tracking_url}" if tracking_url else f"Great news! Your order #{order_id} has been shipped and is on its way.",
+        "delivered": f"Your order #{order_id} has been delivered. Thank you for shopping with Paridhaan Creations!",
+        "cancelled": f"Your order #{order_id} has been cancelled. Contact us if you have questions."
+    }
+    
+    message = await sms_client.messages.create_async(
+        body=messages.get(status, f"Order {order_id} status: {status}"),
+        from_=os.environ['TWILIO_PHONE_NUMBER'],
+        to=phone
+    )
+    logging.info(f"SMS sent for order {order_id}: {message.sid}")
+    return "sent"
 
 def generate_order_email_html(order: dict, email_type: str = "confirmation", tracking_url: str = None) -> str:
     """Generate beautiful HTML email for order notifications"""
@@ -138,6 +164,12 @@ def generate_order_email_html(order: dict, email_type: str = "confirmation", tra
         status_class = "status-delivered"
         status_text = "DELIVERED"
         main_message = "We hope you love your purchase! If you have any questions, feel free to reach out."
+    elif email_type == "cart_reminder":
+        header_title = "You Left Something Behind 🛒"
+        header_subtitle = "Your picks are saved in your cart"
+        status_class = "status-confirmed"
+        status_text = "IN YOUR CART"
+        main_message = f'Your cart at Paridhaan Creations is waiting. <a href="{site_url}/cart" style="color: #8B4513;">Complete your order →</a>'
     else:
         header_title = "Order Update"
         header_subtitle = "Here's the latest on your order"
@@ -158,6 +190,7 @@ def generate_order_email_html(order: dict, email_type: str = "confirmation", tra
     
     # Shipping address
     shipping = order.get("shipping_address", {})
+    reference_label = "Cart" if email_type == "cart_reminder" else "Order ID"
     address_html = f"""
         <strong>{shipping.get('full_name', '')}</strong><br>
         {shipping.get('address_line1', '')}<br>
@@ -166,6 +199,13 @@ def generate_order_email_html(order: dict, email_type: str = "confirmation", tra
         Phone: {shipping.get('phone', '')}
     """
     
+    address_section = f"""
+                <h3 style="margin-bottom: 15px;">Shipping Address</h3>
+                <div class="address-box">
+                    {address_html}
+                </div>
+    """ if shipping else ""
+    
     # Complete HTML
     html = f"""
     <!DOCTYPE html>
@@ -185,7 +225,7 @@ def generate_order_email_html(order: dict, email_type: str = "confirmation", tra
             
             <div class="content">
                 <div class="order-box">
-                    <div class="order-id">Order ID: {order.get('order_id', '')}</div>
+                    <div class="order-id">{reference_label}: {order.get('order_id', '')}</div>
                     <span class="order-status {status_class}">{status_text}</span>
                     <p style="margin-top: 15px; color: #495057;">{main_message}</p>
                 </div>
@@ -210,10 +250,7 @@ def generate_order_email_html(order: dict, email_type: str = "confirmation", tra
                     </tbody>
                 </table>
                 
-                <h3 style="margin-bottom: 15px;">Shipping Address</h3>
-                <div class="address-box">
-                    {address_html}
-                </div>
+                {address_section}
             </div>
             
             <div class="footer">
@@ -248,7 +285,8 @@ async def send_order_email(order: dict, email_type: str = "confirmation", tracki
     subjects = {
         "confirmation": f"Order Confirmed! #{order.get('order_id')} - Paridhaan Creations",
         "shipped": f"Your Order is on its Way! #{order.get('order_id')} - Paridhaan Creations",
-        "delivered": f"Order Delivered! #{order.get('order_id')} - Paridhaan Creations"
+        "delivered": f"Order Delivered! #{order.get('order_id')} - Paridhaan Creations",
+        "cart_reminder": "Your Cart is Waiting - Paridhaan Creations"
     }
     subject = subjects.get(email_type, f"Order Update #{order.get('order_id')}")
     
@@ -279,6 +317,64 @@ async def send_email_notification(email: str, subject: str, body: str):
     # TODO: Implement actual email sending
     pass
 
+# ============ NOTIFICATION OUTBOX ============
+# Order handlers queue customer notifications and return; the dispatcher sends
+# them in the background with per-channel rate limits and retries.
+
+NOTIFICATION_DISPATCHERS = int(os.environ.get('NOTIFICATION_DISPATCHERS', '1'))
+WHATSAPP_ORDER_NOTIFICATIONS = os.environ.get('WHATSAPP_ORDER_NOTIFICATIONS', 'false').lower() == 'true'
+
+async def deliver_order_email(payload: Dict) -> str:
+    order = await db.orders.find_one({"order_id": payload["order_id"]}, {"_id": 0})
+    if not order:
+        return "skipped"
+    sent = await send_order_email(order, payload["email_type"], payload.get("tracking_url"))
+    return "sent" if sent else "skipped"
+
+async def deliver_order_sms(payload: Dict) -> str:
+    return await send_order_notification(payload["order_id"], payload["phone"], payload["status"], payload.get("tracking_url"))
+
+async def deliver_order_whatsapp(payload: Dict) -> str:
+    order = await db.orders.find_one({"order_id": payload["order_id"]}, {"_id": 0})
+    if not order:
+        return "skipped"
+    result = await send_order_whatsapp_notification(order, payload["notification_type"], payload.get("tracking_url"))
+    if result.get("success"):
+        return "sent"
+    if result.get("reason") in ["not_configured", "no_phone", "unknown_type"]:
+        return "skipped"
+    raise Exception(result.get("error", "WhatsApp send failed"))
+
+notification_outbox = NotificationOutbox(
+    db,
+    senders={"email": deliver_order_email, "sms": deliver_order_sms, "whatsapp": deliver_order_whatsapp},
+    rates={
+        "email": float(os.environ.get('EMAIL_SENDS_PER_SECOND', '10')),
+        "sms": float(os.environ.get('SMS_SENDS_PER_SECOND', '1')),
+        "whatsapp": float(os.environ.get('WHATSAPP_SENDS_PER_SECOND', '5'))
+    }
+)
+
+async def queue_order_notifications(
+    order: Dict,
+    event: str,
+    email_type: Optional[str] = None,
+    sms_status: Optional[str] = None,
+    whatsapp_type: Optional[str] = None,
+    tracking_url: Optional[str] = None
+):
+    """Queue the customer messages for an order event; one per channel and event"""
+    order_id = order["order_id"]
+    phone = order.get("shipping_address", {}).get("phone")
+    payloads = {}
+    if email_type:
+        payloads["email"] = {"order_id": order_id, "email_type": email_type, "tracking_url": tracking_url}
+    if sms_status and phone:
+        payloads["sms"] = {"order_id": order_id, "phone": phone, "status": sms_status, "tracking_url": tracking_url}
+    if whatsapp_type and phone and WHATSAPP_ORDER_NOTIFICATIONS:
+        payloads["whatsapp"] = {"order_id": order_id, "notification_type": whatsapp_type, "tracking_url": tracking_url}
+    await notification_outbox.enqueue(order_id, event, payloads)
+
 class User(BaseModel):
     user_id: str
     email: str
@@ -666,6 +762,9 @@ class GSTSettingsUpdate(BaseModel):
     signature_image: Optional[str] = None
     authorized_signatory: Optional[str] = None
 
+class BulkGSTRequest(BaseModel):
+    order_ids: List[str]
+
 # Invoice Model
 class Invoice(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -751,11 +850,108 @@ class CouponValidate(BaseModel):
     code: str
     total_amount: float
 
+# ============ SESSION CACHE ============
+# session_token -> User, so authenticated requests usually skip both Mongo lookups.
+# Invalidated locally on login/logout and across workers via the cache_invalidations
+# capped collection (tailed by every worker).
+
+SESSION_CACHE_TTL_SECONDS = int(os.environ.get("SESSION_CACHE_TTL_SECONDS", "60"))
+SESSION_CACHE_MAX_SIZE = int(os.environ.get("SESSION_CACHE_MAX_SIZE", "10000"))
+WORKER_ID = f"worker_{uuid.uuid4().hex[:8]}"
+
+session_cache = TTLCache(max_size=SESSION_CACHE_MAX_SIZE, ttl_seconds=SESSION_CACHE_TTL_SECONDS)
+# user_id -> tokens in session_cache; bounded the same way, and each write keeps
+# the entry alive as long as the user's newest cached token
+session_tokens_by_user = TTLCache(max_size=SESSION_CACHE_MAX_SIZE, ttl_seconds=SESSION_CACHE_TTL_SECONDS)
+
+def cache_session_user(token: str, user: "User", expires_at: datetime):
+    """Cache a resolved session, never beyond the session's own expiry"""
+    ttl = min(SESSION_CACHE_TTL_SECONDS, (expires_at - datetime.now(timezone.utc)).total_seconds())
+    session_cache.set(token, user, ttl_seconds=ttl)
+    # Drop tokens that have expired out of, or been evicted from, session_cache
+    tokens = {t for t in (session_tokens_by_user.pop(user.user_id) or set()) if t in session_cache}
+    tokens.add(token)
+    session_tokens_by_user.set(user.user_id, tokens)
+
+def invalidate_cached_session(token: str):
+    user = session_cache.pop(token)
+    if user:
+        tokens = session_tokens_by_user.get(user.user_id)
+        if tokens:
+            tokens.discard(token)
+            if not tokens:
+                session_tokens_by_user.pop(user.user_id)
+
+def invalidate_cached_user(user_id: str):
+    for token in session_tokens_by_user.pop(user_id) or set():
+        session_cache.pop(token)
+
+async def apply_cache_invalidation(kind: str, key: str):
+    if kind == "session":
+        invalidate_cached_session(key)
+    elif kind == "user":
+        invalidate_cached_user(key)
+    elif kind == "product":
+        await reindex_product(key)
+    elif kind == "banners":
+        mark_banner_index_stale()
+    elif kind == "gst_categories":
+        gst_engine.invalidate_categories()
+
+async def publish_cache_invalidation(kind: str, key: str):
+    """Invalidate locally and tell the other workers"""
+    await apply_cache_invalidation(kind, key)
+    try:
+        await db.cache_invalidations.insert_one({
+            "kind": kind,
+            "key": key,
+            "origin": WORKER_ID,
+            "created_at": datetime.now(timezone.utc)
+        })
+    except Exception as e:
+        logging.error(f"Failed to publish cache invalidation {kind}:{key}: {str(e)}")
+
+async def listen_for_cache_invalidations():
+    """Tail the capped cache_invalidations collection and apply other workers' events"""
+    try:
+        await db.create_collection("cache_invalidations", capped=True, size=1024 * 1024, max=10000)
+    except CollectionInvalid:
+        pass  # Already exists
+
+    last_seen = datetime.now(timezone.utc)
+    while True:
+        try:
+            cursor = db.cache_invalidations.find(
+                {"created_at": {"$gt": last_seen}},
+                cursor_type=CursorType.TAILABLE_AWAIT
+            )
+            while cursor.alive:
+                async for event in cursor:
+                    last_seen = event["created_at"]
+                    if event.get("origin") != WORKER_ID:
+                        await apply_cache_invalidation(event.get("kind"), event.get("key"))
+                await asyncio.sleep(0.5)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Cache invalidation listener error: {str(e)}")
+            # Events may have been missed while disconnected - start from a clean slate
+            session_cache.clear()
+            session_tokens_by_user.clear()
+            await rebuild_product_search_index()
+            mark_banner_index_stale()
+            gst_engine.invalidate_categories()
+        await asyncio.sleep(1)
+
 async def get_current_user(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     token = session_token or (authorization.replace("Bearer ", "") if authorization else None)
     if not token:
         return None
     
+    cached_user = session_cache.get(token)
+    if cached_user:
+        return cached_user
+    
     session_doc = await db.user_sessions.find_one({"session_token": token}, {"_id": 0})
     if not session_doc:
         return None
@@ -772,7 +968,9 @@ async def get_current_user(authorization: Optional[str] = Header(None), session_
     if not user_doc:
         return None
     
-    return User(**user_doc)
+    user = User(**user_doc)
+    cache_session_user(token, user, expires_at)
+    return user
 
 async def require_admin(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     user = await get_current_user(authorization, session_token)
@@ -810,6 +1008,8 @@ async def create_session(request: Request, response: Response):
             {"user_id": user_id},
             {"$set": {"name": auth_data["name"], "picture": auth_data["picture"], "is_admin": is_admin}}
         )
+        # Profile/admin flag may have changed - drop cached sessions on every worker
+        await publish_cache_invalidation("user", user_id)
     else:
         user_data = {
             "user_id": user_id,
@@ -829,6 +1029,7 @@ async def create_session(request: Request, response: Response):
         "created_at": datetime.now(timezone.utc)
     }
     await db.user_sessions.insert_one(session_data)
+    await publish_cache_invalidation("session", session_token)
     
     response.set_cookie(
         key="session_token",
@@ -855,29 +1056,162 @@ async def logout(response: Response, authorization: Optional[str] = Header(None)
     token = session_token or (authorization.replace("Bearer ", "") if authorization else None)
     if token:
         await db.user_sessions.delete_one({"session_token": token})
+        await publish_cache_invalidation("session", token)
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out successfully"}
 
+# ============ PRODUCT SEARCH ============
+# Every worker keeps its own in-memory index; product writes go through
+# publish_cache_invalidation("product", ...) so all workers re-index.
+
+product_search_index = ProductSearchIndex()
+PRODUCT_SEARCH_FIELDS = {
+    "_id": 0, "product_id": 1, "name": 1, "description": 1, "tags": 1, "material": 1, "color": 1,
+    "brand": 1, "category": 1, "price": 1, "badge": 1, "featured": 1, "laddu_gopal_sizes": 1, "created_at": 1
+}
+
+async def rebuild_product_search_index():
+    try:
+        products = await db.products.find({}, PRODUCT_SEARCH_FIELDS).to_list(None)
+    except Exception as e:
+        logging.error(f"Product search index rebuild failed: {str(e)}")
+        return
+    product_search_index.clear()
+    for product in products:
+        product_search_index.add(product)
+    logging.info(f"Product search index built: {len(product_search_index)} products")
+
+async def reindex_product(product_id: str):
+    product = await db.products.find_one({"product_id": product_id}, PRODUCT_SEARCH_FIELDS)
+    if product:
+        product_search_index.add(product)
+    else:
+        product_search_index.remove(product_id)
+
+async def fetch_products_in_order(product_ids: List[str], projection: Optional[dict] = None) -> List[dict]:
+    """Load product documents with one $in query, preserving the given order"""
+    if not product_ids:
+        return []
+    products = await db.products.find({"product_id": {"$in": product_ids}}, projection or {"_id": 0}).to_list(len(product_ids))
+    by_id = {p["product_id"]: p for p in products}
+    return [by_id[pid] for pid in product_ids if pid in by_id]
+
+async def list_documents(
+    collection,
+    query: dict,
+    id_field: str,
+    cap: int,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    sort: Optional[list] = None
+):
+    """
+    Shared list endpoint behaviour: a keyset page ({"items", "next_cursor"}) when
+    cursor/limit is given, otherwise the plain capped list. fields= projects both.
+    """
+    try:
+        if cursor or limit:
+            return await paginate(collection, query, id_field, cursor, limit, fields)
+        projection = parse_fields(fields, [id_field])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    find = collection.find(query, projection)
+    if sort:
+        find = find.sort(sort)
+    return await find.to_list(cap)
+
 @api_router.get("/products")
 async def get_products(
     category: Optional[str] = None, 
     search: Optional[str] = None, 
     featured: Optional[bool] = None,
-    laddu_gopal_size: Optional[str] = None  # Filter by Laddu Gopal size
+    laddu_gopal_size: Optional[str] = None,  # Filter by Laddu Gopal size
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None
 ):
+    if search:
+        # Ranked full-text match from the search index instead of an unindexed $regex
+        try:
+            projection = parse_fields(fields, ["product_id"])
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        paginated = bool(cursor or limit)
+        try:
+            result = product_search_index.search(
+                search,
+                filters={"category": category, "featured": featured, "laddu_gopal_size": laddu_gopal_size},
+                cursor=cursor,
+                limit=max(1, min(limit or 20, 100)) if paginated else 1000
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        products = await fetch_products_in_order(result["product_ids"], projection)
+        if paginated:
+            return {"items": products, "next_cursor": result["next_cursor"]}
+        return products
+    
     query = {}
     if category:
         query["category"] = category
-    if search:
-        query["name"] = {"$regex": search, "$options": "i"}
     if featured is not None:
         query["featured"] = featured
     if laddu_gopal_size:
         # Filter products that fit this Laddu Gopal size
         query["laddu_gopal_sizes"] = laddu_gopal_size
     
-    products = await db.products.find(query, {"_id": 0}).to_list(1000)
-    return products
+    return await list_documents(db.products, query, "product_id", 1000, cursor, limit, fields)
+
+@api_router.get("/products/search")
+async def search_products(
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    featured: Optional[bool] = None,
+    laddu_gopal_size: Optional[str] = None,
+    badge: Optional[str] = None,
+    price_band: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    sort: str = "relevance",
+    cursor: Optional[str] = None,
+    limit: int = 24
+):
+    """Faceted product search with relevance ranking, prefix matching and cursor pagination"""
+    if sort not in SORT_OPTIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort. Use: {', '.join(SORT_OPTIONS)}")
+    limit = max(1, min(limit, 100))
+    
+    try:
+        result = product_search_index.search(
+            q,
+            filters={
+                "category": category,
+                "featured": featured,
+                "laddu_gopal_size": laddu_gopal_size,
+                "badge": badge,
+                "price_band": price_band,
+                "min_price": min_price,
+                "max_price": max_price
+            },
+            sort=sort,
+            cursor=cursor,
+            limit=limit
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    products = await fetch_products_in_order(result["product_ids"])
+    for product in products:
+        if product["product_id"] in result["scores"]:
+            product["relevance"] = result["scores"][product["product_id"]]
+    
+    return {
+        "products": products,
+        "total": result["total"],
+        "facets": result["facets"],
+        "next_cursor": result["next_cursor"]
+    }
 
 @api_router.get("/products/{product_id}")
 async def get_product(product_id: str):
@@ -912,6 +1246,7 @@ async def create_product(product: ProductCreate, authorization: Optional[str] =
     doc = product_obj.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
     await db.products.insert_one(doc)
+    await publish_cache_invalidation("product", product_obj.product_id)
     return {"message": "Product created", "product_id": product_obj.product_id}
 
 @api_router.put("/products/{product_id}")
@@ -941,6 +1276,7 @@ async def update_product(product_id: str, product: ProductCreate, authorization:
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await publish_cache_invalidation("product", product_id)
     return await db.products.find_one({"product_id": product_id}, {"_id": 0})
 
 @api_router.delete("/products/{product_id}")
@@ -949,6 +1285,7 @@ async def delete_product(product_id: str, authorization: Optional[str] = Header(
     result = await db.products.delete_one({"product_id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    await publish_cache_invalidation("product", product_id)
     return {"message": "Product deleted successfully"}
 
 @api_router.get("/categories")
@@ -963,15 +1300,178 @@ async def create_category(category: CategoryCreate, authorization: Optional[str]
     doc = category_obj.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
     await db.categories.insert_one(doc)
+    await publish_cache_invalidation("gst_categories", category_obj.category_id)
     return category_obj
 
+def as_utc_datetime(value) -> Optional[datetime]:
+    """Timestamps are stored both as datetimes and ISO strings; normalize to aware UTC"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+async def cart_state_fields(items: List[Dict]) -> Dict:
+    """Denormalized abandonment fields written with every cart change"""
+    product_ids = [item["product_id"] for item in items]
+    prices = {}
+    if product_ids:
+        products = await db.products.find(
+            {"product_id": {"$in": product_ids}}, {"_id": 0, "product_id": 1, "price": 1}
+        ).to_list(len(product_ids))
+        prices = {p["product_id"]: p.get("price", 0) for p in products}
+    
+    return {
+        "cart_value": round(sum(prices.get(item["product_id"], 0) * item.get("quantity", 1) for item in items), 2),
+        "item_count": len(items),
+        "cart_state": "open" if items else "empty",  # open / empty / converted
+        "last_activity_at": datetime.now(timezone.utc),
+        "recovery_nudges": {}  # New activity starts a new abandonment episode
+    }
+
+async def mark_carts_converted(order: Dict):
+    """A paid order closes its owner's open cart so it never shows as abandoned"""
+    owners = []
+    if order.get("user_id"):
+        owners.append({"user_id": order["user_id"]})
+    if order.get("cart_session_id"):
+        owners.append({"session_id": order["cart_session_id"]})
+    if order.get("guest_email"):
+        owners.append({"guest_email": order["guest_email"]})
+    if not owners:
+        return
+    
+    converted = {
+        "cart_state": "converted",
+        "converted_at": datetime.now(timezone.utc),
+        "converted_order_id": order["order_id"]
+    }
+    # Carts we had nudged count as recovered
+    await db.cart.update_many(
+        {"$or": owners, "cart_state": "open", "recovery_status": "contacted"},
+        {"$set": {**converted, "recovery_status": "recovered", "recovery_closed_at": converted["converted_at"]}}
+    )
+    await db.cart.update_many({"$or": owners, "cart_state": "open"}, {"$set": converted})
+
+async def backfill_cart_states():
+    """Give carts written before cart_state existed their abandonment fields"""
+    try:
+        count = 0
+        async for cart in db.cart.find({"cart_state": {"$exists": False}}, {"_id": 0}):
+            fields = await cart_state_fields(cart.get("items", []))
+            fields["last_activity_at"] = as_utc_datetime(cart.get("updated_at")) or fields["last_activity_at"]
+            if fields["cart_state"] == "open" and cart.get("user_id"):
+                paid = await db.orders.find_one({"user_id": cart["user_id"], "payment_status": "paid"}, {"_id": 0, "order_id": 1})
+                if paid:
+                    fields["cart_state"] = "converted"
+                    fields["converted_order_id"] = paid["order_id"]
+            await db.cart.update_one({"cart_id": cart["cart_id"]}, {"$set": fields})
+            count += 1
+        if count:
+            logging.info(f"Backfilled abandonment state on {count} carts")
+    except Exception as e:
+        logging.error(f"Cart state backfill failed: {str(e)}")
+
+async def merge_duplicate_carts() -> int:
+    """Fold carts sharing a user_id or session_id into one, so the unique cart indexes can be built.
+    Duplicates date from before add-to-cart was atomic. Their open lines are added to the
+    newest open cart; the duplicates are detached (owner cleared, merged_into set) rather
+    than deleted, and converted carts keep their state for the recovery stats."""
+    detached = 0
+    for field in ["user_id", "session_id"]:
+        groups = await db.cart.aggregate([
+            {"$match": {field: {"$type": "string"}}},
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ]).to_list(None)
+        for group in groups:
+            carts = await db.cart.find({field: group["_id"]}, {"_id": 0}).to_list(None)
+            # Keep the newest cart that is still shoppable, else the newest one
+            carts.sort(
+                key=lambda c: (
+                    c.get("cart_state") != "converted",
+                    as_utc_datetime(c.get("updated_at") or c.get("created_at")) or datetime.min.replace(tzinfo=timezone.utc)
+                ),
+                reverse=True
+            )
+            keep, duplicates = carts[0], carts[1:]
+            
+            if keep.get("cart_state") != "converted":
+                lines = {}
+                for cart in [keep] + [c for c in duplicates if c.get("cart_state") != "converted"]:
+                    for item in cart.get("items", []):
+                        if item["product_id"] in lines:
+                            lines[item["product_id"]]["quantity"] += item.get("quantity", 1)
+                        else:
+                            lines[item["product_id"]] = dict(item)
+                items = list(lines.values())
+                for item in items:
+                    item["price"] = await cart_product_price(item["product_id"]) or 0
+                await db.cart.update_one(
+                    {"cart_id": keep["cart_id"]},
+                    {"$set": {
+                        "items": items,
+                        "cart_value": round(sum(item["price"] * item.get("quantity", 1) for item in items), 2),
+                        "item_count": len(items)
+                    }}
+                )
+            
+            for cart in duplicates:
+                update = {field: None, "merged_into": keep["cart_id"]}
+                if cart.get("cart_state") != "converted":
+                    update["cart_state"] = "merged"
+                await db.cart.update_one({"cart_id": cart["cart_id"]}, {"$set": update})
+            detached += len(duplicates)
+    if detached:
+        logging.warning(f"Merged {detached} duplicate carts before building the unique cart indexes")
+    return detached
+
 @api_router.get("/cart")
 async def get_cart(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None), guest_session: Optional[str] = Cookie(None)):
     user = await get_current_user(authorization, session_token)
+    if not user and not guest_session:
+        return {"items": []}
     query = {"user_id": user.user_id} if user else {"session_id": guest_session}
     cart = await db.cart.find_one(query, {"_id": 0})
     return cart or {"items": []}
 
+async def cart_product_price(product_id: str) -> Optional[float]:
+    """Current price from the in-memory catalog index, falling back to MongoDB"""
+    indexed = product_search_index.docs.get(product_id)
+    if indexed:
+        return indexed["price"]
+    product = await db.products.find_one({"product_id": product_id}, {"_id": 0, "price": 1})
+    return product.get("price", 0) if product else None
+
+def cart_activity() -> Dict:
+    """Fields every cart mutation sets alongside its atomic operator"""
+    now = datetime.now(timezone.utc)
+    return {"updated_at": now, "last_activity_at": now, "recovery_nudges": {}}
+
+async def cart_line_price(line: Dict) -> float:
+    """Unit price a cart line is counted at in cart_value; lines from before prices
+    were stored on them count at the current price"""
+    if line.get("price") is not None:
+        return line["price"]
+    return await cart_product_price(line["product_id"]) or 0
+
+def cart_line_filter(cart_id: str, line: Dict) -> Dict:
+    """Matches the cart only while the line is exactly as read (compare-and-set)"""
+    return {"cart_id": cart_id, "items": {"$elemMatch": {
+        "product_id": line["product_id"], "quantity": line.get("quantity"), "price": line.get("price")
+    }}}
+
+async def settle_empty_cart(cart: Dict) -> Dict:
+    """Mark a cart empty once its last line is gone; guarded so a concurrent add wins"""
+    if cart and not cart.get("items") and cart.get("cart_state") == "open":
+        result = await db.cart.update_one(
+            {"cart_id": cart["cart_id"], "items": {"$size": 0}},
+            {"$set": {"cart_state": "empty", "cart_value": 0}}
+        )
+        if result.modified_count:
+            cart.update(cart_state="empty", cart_value=0)
+    return cart
+
 @api_router.post("/cart/add")
 async def add_to_cart(item: CartItem, response: Response, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None), guest_session: Optional[str] = Cookie(None)):
     user = await get_current_user(authorization, session_token)
@@ -984,44 +1484,137 @@ async def add_to_cart(item: CartItem, response: Response, authorization: Optiona
             response.set_cookie(key="guest_session", value=guest_session, max_age=30*24*60*60)
         identifier = {"session_id": guest_session}
     
-    cart = await db.cart.find_one(identifier, {"_id": 0})
-    
-    if cart:
-        items = cart["items"]
-        found = False
-        for existing_item in items:
-            if existing_item["product_id"] == item.product_id:
-                existing_item["quantity"] += item.quantity
-                found = True
+    if item.quantity < 1:
+        raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+    price = await cart_product_price(item.product_id)
+    if price is None:
+        raise HTTPException(status_code=404, detail="Product not found")
+    line_value = price * item.quantity
+    
+    # Each step is a single atomic update, so concurrent adds never lose a line.
+    # Lines store the unit price they are counted at, so cart_value is always
+    # the sum of price * quantity over the stored lines.
+    # The unique user_id/session_id indexes turn a racing first insert into a retry.
+    for _ in range(3):
+        # Product already in the cart at the current price: bump its quantity in place
+        cart = await db.cart.find_one_and_update(
+            {**identifier, "items": {"$elemMatch": {"product_id": item.product_id, "price": price}}},
+            {
+                "$inc": {"items.$.quantity": item.quantity, "cart_value": line_value},
+                "$set": {**cart_activity(), "cart_state": "open"}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if cart:
+            break
+        
+        # Already in the cart at an older price: re-price the line along with the new quantity
+        existing = await db.cart.find_one({**identifier, "items.product_id": item.product_id}, {"_id": 0, "cart_id": 1, "items": 1})
+        if existing:
+            line = next(line for line in existing["items"] if line["product_id"] == item.product_id)
+            quantity = line.get("quantity", 1) + item.quantity
+            cart = await db.cart.find_one_and_update(
+                cart_line_filter(existing["cart_id"], line),
+                {
+                    "$set": {"items.$.quantity": quantity, "items.$.price": price, **cart_activity(), "cart_state": "open"},
+                    "$inc": {"cart_value": price * quantity - line.get("price", price) * line.get("quantity", 1)}
+                },
+                return_document=ReturnDocument.AFTER
+            )
+            if cart:
                 break
-        if not found:
-            items.append(item.model_dump())
+            continue
         
-        await db.cart.update_one(
-            identifier,
-            {"$set": {"items": items, "updated_at": datetime.now(timezone.utc)}}
-        )
+        # New line; creates the cart on the first add
+        new_cart = Cart(**identifier, items=[]).model_dump(exclude={"items", "cart_value", "updated_at", *identifier})
+        new_cart["created_at"] = new_cart["created_at"].isoformat()
+        try:
+            cart = await db.cart.find_one_and_update(
+                {**identifier, "items.product_id": {"$ne": item.product_id}},
+                {
+                    "$push": {"items": {**item.model_dump(), "price": price}},
+                    "$inc": {"cart_value": line_value, "item_count": 1},
+                    "$set": {**cart_activity(), "cart_state": "open"},
+                    "$setOnInsert": new_cart
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            continue
     else:
-        cart_obj = Cart(**identifier, items=[item])
-        doc = cart_obj.model_dump()
-        doc["created_at"] = doc["created_at"].isoformat()
-        doc["updated_at"] = doc["updated_at"].isoformat()
-        await db.cart.insert_one(doc)
+        raise HTTPException(status_code=409, detail="Cart is being updated, please retry")
     
-    return {"message": "Item added to cart"}
+    cart.pop("_id", None)
+    return {"message": "Item added to cart", **cart}
+
+@api_router.put("/cart/items/{product_id}")
+async def update_cart_quantity(product_id: str, quantity: int, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None), guest_session: Optional[str] = Cookie(None)):
+    """Set a line's quantity in place"""
+    user = await get_current_user(authorization, session_token)
+    if not user and not guest_session:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    identifier = {"user_id": user.user_id} if user else {"session_id": guest_session}
+    if quantity < 1:
+        raise HTTPException(status_code=400, detail="Quantity must be at least 1")
+    
+    # Quantity and cart_value change in one write, compare-and-set on the line as read
+    for _ in range(3):
+        current = await db.cart.find_one({**identifier, "items.product_id": product_id}, {"_id": 0, "cart_id": 1, "items": 1})
+        if not current:
+            raise HTTPException(status_code=404, detail="Item not in cart")
+        line = next(item for item in current["items"] if item["product_id"] == product_id)
+        price = await cart_line_price(line)
+        cart = await db.cart.find_one_and_update(
+            cart_line_filter(current["cart_id"], line),
+            {
+                "$set": {"items.$.quantity": quantity, "items.$.price": price, **cart_activity(), "cart_state": "open"},
+                "$inc": {"cart_value": price * (quantity - line.get("quantity", 1))}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if cart:
+            break
+    else:
+        raise HTTPException(status_code=409, detail="Cart is being updated, please retry")
+    cart.pop("_id", None)
+    return {"message": "Cart updated", **cart}
 
 @api_router.delete("/cart/remove/{product_id}")
 async def remove_from_cart(product_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None), guest_session: Optional[str] = Cookie(None)):
     user = await get_current_user(authorization, session_token)
-    identifier = {"user_id": user.user_id} if user else {"session_id": guest_session}
-    
-    cart = await db.cart.find_one(identifier, {"_id": 0})
-    if not cart:
+    if not user and not guest_session:
         raise HTTPException(status_code=404, detail="Cart not found")
+    identifier = {"user_id": user.user_id} if user else {"session_id": guest_session}
     
-    items = [item for item in cart["items"] if item["product_id"] != product_id]
-    await db.cart.update_one(identifier, {"$set": {"items": items, "updated_at": datetime.now(timezone.utc)}})
-    return {"message": "Item removed from cart"}
+    # The line and its share of cart_value go in one write, compare-and-set on the line as read
+    for _ in range(3):
+        current = await db.cart.find_one({**identifier, "items.product_id": product_id}, {"_id": 0, "cart_id": 1, "items": 1})
+        if not current:
+            # Nothing to remove; still 404 when there is no cart at all
+            cart = await db.cart.find_one(identifier, {"_id": 0})
+            if not cart:
+                raise HTTPException(status_code=404, detail="Cart not found")
+            return {"message": "Item removed from cart", **cart}
+        line = next(item for item in current["items"] if item["product_id"] == product_id)
+        price = await cart_line_price(line)
+        cart = await db.cart.find_one_and_update(
+            cart_line_filter(current["cart_id"], line),
+            {
+                "$pull": {"items": {"product_id": product_id}},
+                "$inc": {"item_count": -1, "cart_value": -price * line.get("quantity", 1)},
+                "$set": cart_activity()
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if cart:
+            break
+    else:
+        raise HTTPException(status_code=409, detail="Cart is being updated, please retry")
+    cart.pop("_id", None)
+    cart = await settle_empty_cart(cart)
+    return {"message": "Item removed from cart", **cart}
 
 @api_router.post("/cart/clear")
 async def clear_cart(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None), guest_session: Optional[str] = Cookie(None)):
@@ -1030,6 +1623,136 @@ async def clear_cart(authorization: Optional[str] = Header(None), session_token:
     await db.cart.delete_one(identifier)
     return {"message": "Cart cleared"}
 
+CART_PRODUCT_FIELDS = {"_id": 0, "product_id": 1, "name": 1, "images": 1, "price": 1, "stock": 1,
+                       "category": 1, "gst_rate": 1, "hsn_code": 1}
+
+async def price_cart(cart: Dict, customer_state: Optional[str] = None) -> Dict:
+    """Cart with a product snapshot and line totals from one $in query, plus
+    subtotal, GST estimate and the applied coupon. Also corrects cart_value."""
+    items = cart.get("items", [])
+    product_ids = [item["product_id"] for item in items]
+    products = {}
+    if product_ids:
+        found = await db.products.find({"product_id": {"$in": product_ids}}, CART_PRODUCT_FIELDS).to_list(len(product_ids))
+        products = {p["product_id"]: p for p in found}
+    gst_settings = await db.gst_settings.find_one({"setting_id": "gst_settings"}, {"_id": 0}) or DEFAULT_INVOICE_GST_SETTINGS
+    categories = await gst_engine.category_table()
+    
+    lines = []
+    priced_items = []
+    for item in items:
+        product = products.get(item["product_id"])
+        quantity = item.get("quantity", 1)
+        if not product:
+            # Product was removed from the catalog after it was added
+            lines.append({"product_id": item["product_id"], "quantity": quantity, "available": False})
+            continue
+        
+        price = product.get("price", 0)
+        stock = product.get("stock", 0)
+        gst_rate, _ = resolve_rate(product, categories, gst_settings.get("default_gst_rate", 18.0))
+        lines.append({
+            "product_id": item["product_id"],
+            "quantity": quantity,
+            "available": True,
+            "name": product.get("name"),
+            "image": product["images"][0] if product.get("images") else "/placeholder.jpg",
+            "price": price,
+            "gst_rate": gst_rate,
+            "stock": stock,
+            "in_stock": stock >= quantity,
+            "line_total": round(price * quantity, 2)
+        })
+        priced_items.append({"product_id": item["product_id"], "quantity": quantity, "price": price})
+    
+    subtotal = round(sum(line["line_total"] for line in lines if line["available"]), 2)
+    
+    coupon = None
+    discount = 0
+    if cart.get("coupon_code"):
+        try:
+            discount = min(subtotal, await coupon_discount(cart["coupon_code"], subtotal))
+            coupon = {"code": cart["coupon_code"], "valid": True, "discount": round(discount, 2)}
+        except HTTPException as e:
+            coupon = {"code": cart["coupon_code"], "valid": False, "error": e.detail}
+    
+    gst = None
+    if gst_settings.get("gst_enabled", True):
+        state = customer_state or gst_settings.get("business_state", "Rajasthan")
+        gst_calc = compute_gst([(priced_items, state)], products, categories, gst_settings, get_state_code)[0]
+        # Discount is spread over the lines, as at checkout
+        ratio = 1 - discount / subtotal if subtotal else 1
+        gst = {
+            "state": state,
+            "is_inter_state": gst_calc["is_inter_state"],
+            "prices_include_gst": gst_settings.get("prices_include_gst", True),
+            **{field: round(gst_calc[field] * ratio, 2)
+               for field in ["taxable_amount", "cgst_amount", "sgst_amount", "igst_amount", "total_gst"]}
+        }
+    
+    # Re-price the stored lines to match; compare-and-set on the lines as read so a
+    # concurrent cart mutation is never overwritten
+    current_prices = {line["product_id"]: line["price"] if line["available"] else 0 for line in lines}
+    repriced = [{**item, "price": current_prices[item["product_id"]]} for item in items]
+    if cart.get("cart_id") and (cart.get("cart_value") != subtotal or repriced != items):
+        await db.cart.update_one(
+            {"cart_id": cart["cart_id"], "items": items},
+            {"$set": {"items": repriced, "cart_value": subtotal}}
+        )
+    
+    return {
+        **cart,
+        "items": lines,
+        "item_count": len(lines),
+        "cart_value": subtotal,
+        "subtotal": subtotal,
+        "coupon": coupon,
+        "discount": round(discount, 2),
+        "gst": gst,
+        "total": round(max(0, subtotal - discount), 2)
+    }
+
+@api_router.get("/cart/priced")
+async def get_priced_cart(state: Optional[str] = None, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None), guest_session: Optional[str] = Cookie(None)):
+    """Cart ready to render: product details, line totals, subtotal, GST estimate and coupon.
+    Pass the shipping state to estimate inter-state (IGST) tax."""
+    user = await get_current_user(authorization, session_token)
+    if not user and not guest_session:
+        return await price_cart({"items": []}, state)
+    query = {"user_id": user.user_id} if user else {"session_id": guest_session}
+    cart = await db.cart.find_one(query, {"_id": 0})
+    return await price_cart(cart or {"items": []}, state)
+
+@api_router.post("/cart/coupon")
+async def apply_cart_coupon(code: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None), guest_session: Optional[str] = Cookie(None)):
+    """Validate a coupon against the cart and keep it applied"""
+    user = await get_current_user(authorization, session_token)
+    if not user and not guest_session:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    query = {"user_id": user.user_id} if user else {"session_id": guest_session}
+    
+    cart = await db.cart.find_one(query, {"_id": 0})
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    
+    await coupon_discount(code, cart.get("cart_value", 0))
+    cart["coupon_code"] = code.upper()
+    await db.cart.update_one({"cart_id": cart["cart_id"]}, {"$set": {"coupon_code": cart["coupon_code"]}})
+    return await price_cart(cart)
+
+@api_router.delete("/cart/coupon")
+async def remove_cart_coupon(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None), guest_session: Optional[str] = Cookie(None)):
+    user = await get_current_user(authorization, session_token)
+    if not user and not guest_session:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    query = {"user_id": user.user_id} if user else {"session_id": guest_session}
+    
+    cart = await db.cart.find_one_and_update(query, {"$unset": {"coupon_code": ""}}, return_document=ReturnDocument.AFTER)
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    cart.pop("_id", None)
+    return await price_cart(cart)
+
 @api_router.get("/wishlist")
 async def get_wishlist(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
     user = await get_current_user(authorization, session_token)
@@ -1077,29 +1800,98 @@ async def remove_from_wishlist(product_id: str, authorization: Optional[str] = H
     )
     return {"message": "Removed from wishlist"}
 
+# Stock is held for this long while payment is pending
+inventory = InventoryReservations(db, hold_minutes=float(os.environ.get('STOCK_HOLD_MINUTES', '30')))
+
+# Responses to requests carrying an Idempotency-Key are replayed for this long
+idempotency = IdempotencyStore(db, ttl_hours=float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24')))
+
 @api_router.post("/orders")
-async def create_order(order: OrderCreate, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def create_order(order: OrderCreate, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None), guest_session: Optional[str] = Cookie(None), idempotency_key: Optional[str] = Header(None)):
     user = await get_current_user(authorization, session_token)
+    # Bound to the caller too, so a key reused by someone else is rejected rather than replayed
+    request_fingerprint = fingerprint({
+        "order": order.model_dump(),
+        "caller": user.user_id if user else guest_session,
+    })
+    return await idempotency.run(
+        "orders", idempotency_key, request_fingerprint, lambda claim: place_order(order, user, guest_session, claim)
+    )
+
+async def place_order(order: OrderCreate, user: Optional[User], guest_session: Optional[str], claim: IdempotencyClaim) -> Order:
+    resumed_order_id = claim.marker.get("order_id")
+    if resumed_order_id:
+        # A previous attempt with this Idempotency-Key died after choosing its order_id
+        existing = await db.orders.find_one({"order_id": resumed_order_id}, {"_id": 0})
+        if existing:
+            return Order(**existing)
+        # It never inserted the order; return any stock it held and place the order afresh
+        await inventory.release(resumed_order_id, "idempotent_retry")
+    
+    if not order.items or any(item.quantity < 1 for item in order.items):
+        raise HTTPException(status_code=400, detail="Order must contain items with a positive quantity")
+    
+    # Price lines from the catalog rather than trusting the client
+    product_ids = list({item.product_id for item in order.items})
+    products = {
+        p["product_id"]: p for p in await db.products.find(
+            {"product_id": {"$in": product_ids}}, {"_id": 0, "product_id": 1, "name": 1, "price": 1}
+        ).to_list(len(product_ids))
+    }
+    missing = [pid for pid in product_ids if pid not in products]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Product not found: {missing[0]}")
     
     order_data = order.model_dump()
+    for item in order_data["items"]:
+        product = products[item["product_id"]]
+        item["price"] = product.get("price", 0)
+        item["product_name"] = product.get("name", item["product_name"])
+    subtotal = sum(item["price"] * item["quantity"] for item in order_data["items"])
+    discount = min(subtotal, await coupon_discount(order.coupon_code, subtotal)) if order.coupon_code else 0
+    total_amount = round(max(0, subtotal - discount), 2)
+    if abs(total_amount - order.total_amount) > 0.01:
+        logging.warning(f"Order total corrected from {order.total_amount} to {total_amount}")
+    order_data.update(total_amount=total_amount, discount_amount=round(discount, 2))
     if user:
         order_data["user_id"] = user.user_id
     
     order_obj = Order(**order_data)
+    # Recorded before any stock is taken so a retry after a crash resumes this order
+    await claim.mark(order_id=order_obj.order_id)
     doc = order_obj.model_dump()
     doc["created_at"] = doc["created_at"].isoformat()
+    if not user and guest_session:
+        # Lets payment close the guest's cart for abandoned-cart tracking
+        doc["cart_session_id"] = guest_session
+    
+    try:
+        await inventory.reserve(order_obj.order_id, doc["items"])
+    except OutOfStock as e:
+        name = products[e.product_id].get("name", e.product_id)
+        detail = f"{name} is out of stock" if e.available == 0 else f"Only {e.available} of {name} left in stock"
+        raise HTTPException(status_code=409, detail=detail)
     
-    await db.orders.insert_one(doc)
+    try:
+        await db.orders.insert_one(doc)
+    except Exception:
+        await inventory.release(order_obj.order_id, "order_insert_failed")
+        raise
     return order_obj
 
 @api_router.get("/orders")
-async def get_orders(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def get_orders(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
     user = await get_current_user(authorization, session_token)
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
     
-    orders = await db.orders.find({"user_id": user.user_id}, {"_id": 0}).to_list(1000)
-    return orders
+    return await list_documents(db.orders, {"user_id": user.user_id}, "order_id", 1000, cursor, limit, fields)
 
 @api_router.get("/orders/{order_id}")
 async def get_order(order_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -1114,6 +1906,79 @@ async def get_order(order_id: str, authorization: Optional[str] = Header(None),
     
     return order
 
+# ============ BANNER RESOLUTION CACHE ============
+# Active banners live in memory; each (placement, device, audience, category)
+# combination is resolved once and memoized until the next banner write.
+# The memo is keyed on public query values, so it is a bounded LRU.
+# Schedule windows are checked per request against the current time.
+
+BANNER_INDEX_MAX_AGE_SECONDS = 300  # Safety-net rebuild in case an invalidation is missed
+BANNER_RESOLVED_MAX_KEYS = 500
+
+banner_index = {
+    "banners": [],
+    "resolved": TTLCache(max_size=BANNER_RESOLVED_MAX_KEYS, ttl_seconds=BANNER_INDEX_MAX_AGE_SECONDS),
+    "stale": True,
+    "built_at": None,
+    # Bumped on every invalidation; a rebuild only clears "stale" if none arrived while it queried
+    "generation": 0
+}
+banner_index_lock = asyncio.Lock()
+
+def mark_banner_index_stale():
+    banner_index["stale"] = True
+    banner_index["generation"] += 1
+
+def banner_in_schedule(banner: dict, now_iso: str) -> bool:
+    """In-memory equivalent of the old start_date/end_date query"""
+    if "start_date" not in banner:
+        return True
+    start_date = banner.get("start_date")
+    end_date = banner.get("end_date")
+    if isinstance(start_date, datetime):
+        start_date = (start_date if start_date.tzinfo else start_date.replace(tzinfo=timezone.utc)).isoformat()
+    if isinstance(end_date, datetime):
+        end_date = (end_date if end_date.tzinfo else end_date.replace(tzinfo=timezone.utc)).isoformat()
+    return (start_date is None or start_date <= now_iso) and (end_date is None or end_date >= now_iso)
+
+async def get_banner_index() -> List[dict]:
+    now = datetime.now(timezone.utc)
+    built_at = banner_index["built_at"]
+    expired = built_at is None or (now - built_at).total_seconds() > BANNER_INDEX_MAX_AGE_SECONDS
+    if banner_index["stale"] or expired:
+        async with banner_index_lock:
+            # Another request may have rebuilt the index while we waited for the lock
+            if banner_index["stale"] or (banner_index["built_at"] is built_at and expired):
+                generation = banner_index["generation"]
+                banners = await db.banners.find({"status": "active"}, {"_id": 0}).sort("position", 1).to_list(None)
+                for banner in banners:
+                    # For backward compatibility, add 'image' field from 'image_desktop'
+                    if not banner.get('image') and banner.get('image_desktop'):
+                        banner['image'] = banner['image_desktop']
+                banner_index["banners"] = banners
+                banner_index["resolved"].clear()
+                banner_index["stale"] = banner_index["generation"] != generation
+                banner_index["built_at"] = now
+    return banner_index["banners"]
+
+def resolve_banners(banners: List[dict], placement: Optional[str], category: Optional[str], device: Optional[str], user_type: Optional[str]) -> List[dict]:
+    """Targeting filter (without schedule), memoized per key"""
+    key = (placement, category, device, user_type)
+    resolved = banner_index["resolved"].get(key)
+    if resolved is not None:
+        return resolved
+    
+    audience = f"{user_type}_users" if user_type else None
+    resolved = [
+        b for b in banners
+        if (not placement or b.get("placement") == placement)
+        and (not category or b.get("category") in (None, category))
+        and (b.get("target_device", "all") == "all" or (device and b.get("target_device") == device))
+        and (b.get("target_audience", "all") == "all" or (audience and b.get("target_audience") == audience))
+    ]
+    banner_index["resolved"].set(key, resolved)
+    return resolved
+
 @api_router.get("/banners")
 async def get_banners(
     placement: Optional[str] = None, 
@@ -1122,57 +1987,10 @@ async def get_banners(
     user_type: Optional[str] = None  # new or returning
 ):
     """Get active banners for public display with targeting"""
-    now = datetime.now(timezone.utc)
-    now_iso = now.isoformat()
-    
-    # Base query - only active status
-    query = {"status": "active"}
-    
-    # Schedule filter - check if banner is within valid date range
-    schedule_filter = {
-        "$or": [
-            {"start_date": None, "end_date": None},
-            {"start_date": {"$exists": False}},
-            {
-                "$and": [
-                    {"$or": [{"start_date": None}, {"start_date": {"$lte": now_iso}}]},
-                    {"$or": [{"end_date": None}, {"end_date": {"$gte": now_iso}}]}
-                ]
-            }
-        ]
-    }
-    
-    # Device targeting
-    device_filter = {"$or": [{"target_device": "all"}, {"target_device": {"$exists": False}}]}
-    if device:
-        device_filter["$or"].append({"target_device": device})
-    
-    # User type targeting
-    audience_filter = {"$or": [{"target_audience": "all"}, {"target_audience": {"$exists": False}}]}
-    if user_type:
-        audience_filter["$or"].append({"target_audience": f"{user_type}_users"})
-    
-    # Placement filter
-    if placement:
-        query["placement"] = placement
-    
-    # Category filter for category-specific placements
-    if category:
-        query["$or"] = [{"category": category}, {"category": None}, {"category": {"$exists": False}}]
-    
-    # Combine all filters
-    final_query = {
-        "$and": [query, schedule_filter, device_filter, audience_filter]
-    }
-    
-    banners = await db.banners.find(final_query, {"_id": 0}).sort("position", 1).to_list(100)
-    
-    # For backward compatibility, add 'image' field from 'image_desktop'
-    for banner in banners:
-        if not banner.get('image') and banner.get('image_desktop'):
-            banner['image'] = banner['image_desktop']
-    
-    return banners
+    now_iso = datetime.now(timezone.utc).isoformat()
+    banners = await get_banner_index()
+    candidates = resolve_banners(banners, placement, category, device, user_type)
+    return [b for b in candidates if banner_in_schedule(b, now_iso)][:100]
 
 @api_router.get("/banners/all")
 async def get_all_banners(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -1205,7 +2023,68 @@ async def get_banner_stats(authorization: Optional[str] = Header(None), session_
     return {
         "total_banners": total_banners,
         "active_banners": active_banners,
-        "by_placement": {s["_id"]: s for s in stats if s["_id"]}
+        "by_placement": {s["_id"]: s for s in stats if s["_id"]},
+        "tracking_buffer": banner_counter_buffer.metrics()
+    }
+
+@api_router.get("/banners/stats/timeseries")
+async def get_banner_stats_timeseries(
+    days: int = 30,
+    granularity: str = "day",  # hour, day
+    placement: Optional[str] = None,
+    banner_id: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """Impressions, clicks and CTR over time per placement, read from hourly rollups (admin only)"""
+    await require_admin(authorization, session_token)
+    
+    if granularity not in ["hour", "day"]:
+        raise HTTPException(status_code=400, detail="Invalid granularity. Use: hour, day")
+    days = max(1, min(days, 365))
+    
+    match = {"hour": {"$gte": datetime.now(timezone.utc) - timedelta(days=days)}}
+    if placement:
+        match["placement"] = placement
+    if banner_id:
+        match["banner_id"] = banner_id
+    
+    period_format = "%Y-%m-%dT%H:00" if granularity == "hour" else "%Y-%m-%d"
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "placement": "$placement",
+                "period": {"$dateToString": {"format": period_format, "date": "$hour"}}
+            },
+            "impressions": {"$sum": "$impressions"},
+            "clicks": {"$sum": "$clicks"}
+        }},
+        {"$sort": {"_id.period": 1}}
+    ]
+    buckets = await db.banner_stats_hourly.aggregate(pipeline).to_list(None)
+    
+    by_placement: Dict[str, dict] = {}
+    for bucket in buckets:
+        impressions = bucket.get("impressions") or 0
+        clicks = bucket.get("clicks") or 0
+        entry = by_placement.setdefault(bucket["_id"]["placement"] or "unknown", {"impressions": 0, "clicks": 0, "series": []})
+        entry["impressions"] += impressions
+        entry["clicks"] += clicks
+        entry["series"].append({
+            "period": bucket["_id"]["period"],
+            "impressions": impressions,
+            "clicks": clicks,
+            "ctr": round(clicks / impressions * 100, 2) if impressions else 0
+        })
+    
+    for entry in by_placement.values():
+        entry["ctr"] = round(entry["clicks"] / entry["impressions"] * 100, 2) if entry["impressions"] else 0
+    
+    return {
+        "days": days,
+        "granularity": granularity,
+        "by_placement": by_placement
     }
 
 @api_router.post("/banners")
@@ -1234,6 +2113,7 @@ async def create_banner(banner: BannerCreate, authorization: Optional[str] = Hea
         doc["end_date"] = doc["end_date"].isoformat()
     
     await db.banners.insert_one(doc)
+    await publish_cache_invalidation("banners", banner_obj.banner_id)
     return {"message": "Banner created successfully", "banner_id": banner_obj.banner_id}
 
 @api_router.put("/banners/{banner_id}")
@@ -1256,6 +2136,7 @@ async def update_banner(banner_id: str, banner: BannerUpdate, authorization: Opt
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
     await db.banners.update_one({"banner_id": banner_id}, {"$set": update_data})
+    await publish_cache_invalidation("banners", banner_id)
     return {"message": "Banner updated successfully"}
 
 @api_router.patch("/banners/{banner_id}/status")
@@ -1273,8 +2154,114 @@ async def update_banner_status(banner_id: str, status: str, authorization: Optio
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Banner not found")
     
+    await publish_cache_invalidation("banners", banner_id)
     return {"message": f"Banner status updated to {status}"}
 
+# ============ BANNER COUNTER BUFFER ============
+# Impressions/clicks are coalesced in memory per banner and written with one
+# bulk_write every few seconds (or sooner once the buffer fills up). Each flush
+# also $inc's the hourly buckets in banner_stats_hourly used for CTR charts.
+
+BANNER_COUNTER_FLUSH_INTERVAL_SECONDS = float(os.environ.get("BANNER_COUNTER_FLUSH_INTERVAL_SECONDS", "5"))
+BANNER_COUNTER_FLUSH_THRESHOLD = int(os.environ.get("BANNER_COUNTER_FLUSH_THRESHOLD", "1000"))
+
+class BannerCounterBuffer:
+    """Per-worker buffer of pending banner counter increments"""
+    
+    def __init__(self):
+        self.pending: Counter = Counter()  # (banner_id, field, hour) -> increments
+        self.pending_events = 0
+        self.oldest_pending_at: Optional[float] = None
+        self.last_flush_at: Optional[datetime] = None
+        self.flushed_events = 0
+        self.bulk_writes = 0
+        self.lock = asyncio.Lock()
+        self.threshold_reached = asyncio.Event()
+    
+    def add(self, banner_id: str, field: str):
+        if self.oldest_pending_at is None:
+            self.oldest_pending_at = time.monotonic()
+        hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        self.pending[(banner_id, field, hour)] += 1
+        self.pending_events += 1
+        if self.pending_events >= BANNER_COUNTER_FLUSH_THRESHOLD:
+            self.threshold_reached.set()
+    
+    async def flush(self) -> int:
+        """Write all pending increments in one bulk_write; returns events flushed"""
+        async with self.lock:
+            if not self.pending:
+                return 0
+            pending, events = self.pending, self.pending_events
+            self.pending, self.pending_events, self.oldest_pending_at = Counter(), 0, None
+            
+            increments: Dict[str, Counter] = {}
+            bucket_increments: Dict[tuple, Counter] = {}
+            for (banner_id, field, hour), count in pending.items():
+                increments.setdefault(banner_id, Counter())[field] += count
+                bucket_increments.setdefault((banner_id, hour), Counter())[field] += count
+            operations = [UpdateOne({"banner_id": banner_id}, {"$inc": dict(inc)}) for banner_id, inc in increments.items()]
+            
+            try:
+                await db.banners.bulk_write(operations, ordered=False)
+            except Exception as e:
+                logging.error(f"Banner counter flush failed, will retry: {str(e)}")
+                for key, count in pending.items():
+                    self.pending[key] += count
+                self.pending_events += events
+                if self.oldest_pending_at is None:
+                    self.oldest_pending_at = time.monotonic()
+                return 0
+            
+            # Hourly buckets are best-effort: retrying them would double count the totals above
+            try:
+                banners = await db.banners.find(
+                    {"banner_id": {"$in": list(increments)}}, {"_id": 0, "banner_id": 1, "placement": 1}
+                ).to_list(None)
+                placements = {b["banner_id"]: b.get("placement") for b in banners}
+                bucket_operations = [
+                    UpdateOne(
+                        {"banner_id": banner_id, "hour": hour},
+                        {"$inc": dict(inc), "$set": {"placement": placements[banner_id]}},
+                        upsert=True
+                    )
+                    for (banner_id, hour), inc in bucket_increments.items()
+                    if banner_id in placements  # Skip unknown/deleted banners
+                ]
+                if bucket_operations:
+                    await db.banner_stats_hourly.bulk_write(bucket_operations, ordered=False)
+            except Exception as e:
+                logging.error(f"Banner hourly stats flush failed: {str(e)}")
+            
+            self.flushed_events += events
+            self.bulk_writes += 1
+            self.last_flush_at = datetime.now(timezone.utc)
+            return events
+    
+    def metrics(self) -> dict:
+        return {
+            "pending_events": self.pending_events,
+            "pending_banners": len({banner_id for banner_id, _, _ in self.pending}),
+            "lag_seconds": round(time.monotonic() - self.oldest_pending_at, 2) if self.oldest_pending_at else 0,
+            "last_flush_at": self.last_flush_at.isoformat() if self.last_flush_at else None,
+            "flushed_events": self.flushed_events,
+            "bulk_writes": self.bulk_writes,
+            "flush_interval_seconds": BANNER_COUNTER_FLUSH_INTERVAL_SECONDS,
+            "flush_threshold": BANNER_COUNTER_FLUSH_THRESHOLD
+        }
+
+banner_counter_buffer = BannerCounterBuffer()
+
+async def run_banner_counter_flusher():
+    """Flush the counter buffer on an interval, or early when the threshold is hit"""
+    while True:
+        try:
+            await asyncio.wait_for(banner_counter_buffer.threshold_reached.wait(), timeout=BANNER_COUNTER_FLUSH_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        banner_counter_buffer.threshold_reached.clear()
+        await banner_counter_buffer.flush()
+
 @api_router.post("/banners/{banner_id}/track")
 async def track_banner_interaction(banner_id: str, interaction_type: str = "impression"):
     """Track banner impressions and clicks"""
@@ -1282,7 +2269,7 @@ async def track_banner_interaction(banner_id: str, interaction_type: str = "impr
         raise HTTPException(status_code=400, detail="Invalid interaction type")
     
     field = "impressions" if interaction_type == "impression" else "clicks"
-    await db.banners.update_one({"banner_id": banner_id}, {"$inc": {field: 1}})
+    banner_counter_buffer.add(banner_id, field)
     
     return {"success": True}
 
@@ -1292,6 +2279,7 @@ async def delete_banner(banner_id: str, authorization: Optional[str] = Header(No
     result = await db.banners.delete_one({"banner_id": banner_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Banner not found")
+    await publish_cache_invalidation("banners", banner_id)
     return {"message": "Banner deleted successfully"}
 
 @api_router.post("/banners/reorder")
@@ -1305,11 +2293,12 @@ async def reorder_banners(banner_orders: List[dict], authorization: Optional[str
             {"$set": {"position": item["position"]}}
         )
     
+    await publish_cache_invalidation("banners", "reorder")
     return {"message": "Banners reordered successfully"}
 
-@api_router.post("/coupons/validate")
-async def validate_coupon(coupon_data: CouponValidate):
-    coupon = await db.coupons.find_one({"code": coupon_data.code.upper(), "active": True}, {"_id": 0})
+async def coupon_discount(code: str, total_amount: float) -> float:
+    """Discount a coupon gives on total_amount; 404/400 when invalid or expired"""
+    coupon = await db.coupons.find_one({"code": code.upper(), "active": True}, {"_id": 0})
     if not coupon:
         raise HTTPException(status_code=404, detail="Invalid coupon code")
     
@@ -1331,10 +2320,14 @@ async def validate_coupon(coupon_data: CouponValidate):
     
     discount = 0
     if coupon.get("discount_percentage"):
-        discount = (coupon_data.total_amount * coupon["discount_percentage"]) / 100
+        discount = (total_amount * coupon["discount_percentage"]) / 100
     elif coupon.get("discount_amount"):
         discount = coupon["discount_amount"]
-    
+    return discount
+
+@api_router.post("/coupons/validate")
+async def validate_coupon(coupon_data: CouponValidate):
+    discount = await coupon_discount(coupon_data.code, coupon_data.total_amount)
     return {
         "valid": True,
         "discount": discount,
@@ -1391,10 +2384,15 @@ async def create_coupon(coupon: CouponCreate, authorization: Optional[str] = Hea
     return coupon_obj
 
 @api_router.get("/coupons")
-async def get_coupons(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def get_coupons(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
     await require_admin(authorization, session_token)
-    coupons = await db.coupons.find({}, {"_id": 0}).to_list(100)
-    return coupons
+    return await list_documents(db.coupons, {}, "coupon_id", 100, cursor, limit, fields)
 
 @api_router.get("/coupons/{coupon_id}")
 async def get_coupon(coupon_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -1429,11 +2427,24 @@ async def delete_coupon(coupon_id: str, authorization: Optional[str] = Header(No
     return {"message": "Coupon deleted successfully"}
 
 @api_router.post("/payments/stripe/session")
-async def create_stripe_session(request: Request, order_id: str, origin_url: str):
+async def create_stripe_session(request: Request, order_id: str, origin_url: str, idempotency_key: Optional[str] = Header(None)):
+    return await idempotency.run(
+        "stripe_session", idempotency_key, fingerprint({"order_id": order_id, "origin_url": origin_url}),
+        lambda claim: open_stripe_session(order_id, origin_url, claim)
+    )
+
+async def open_stripe_session(order_id: str, origin_url: str, claim: IdempotencyClaim) -> Dict:
     order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
+    if claim.marker.get("session_id"):
+        # A previous attempt with this Idempotency-Key opened the session but never stored its response
+        await record_payment_transaction(
+            {"session_id": claim.marker["session_id"]}, order_id, order["total_amount"], "usd", "stripe"
+        )
+        return {"url": claim.marker["url"], "session_id": claim.marker["session_id"]}
+    
     host_url = origin_url
     webhook_url = f"{host_url}/api/webhook/stripe"
     stripe_checkout = StripeCheckout(api_key=os.environ['STRIPE_API_KEY'], webhook_url=webhook_url)
@@ -1450,24 +2461,56 @@ async def create_stripe_session(request: Request, order_id: str, origin_url: str
     )
     
     session = await stripe_checkout.create_checkout_session(checkout_request)
+    await claim.mark(session_id=session.session_id, url=session.url)
     
-    await db.payment_transactions.insert_one({
-        "transaction_id": f"txn_{uuid.uuid4().hex[:12]}",
-        "order_id": order_id,
-        "session_id": session.session_id,
-        "amount": order["total_amount"],
-        "currency": "usd",
-        "payment_status": "pending",
-        "payment_method": "stripe",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await record_payment_transaction(
+        {"session_id": session.session_id}, order_id, order["total_amount"], "usd", "stripe"
+    )
     
     return {"url": session.url, "session_id": session.session_id}
 
-@api_router.get("/payments/stripe/status/{session_id}")
-async def get_stripe_status(session_id: str):
-    webhook_url = f"{os.environ['REACT_APP_BACKEND_URL']}/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=os.environ['STRIPE_API_KEY'], webhook_url=webhook_url)
+async def record_payment_transaction(gateway_ref: Dict, order_id: str, amount: float, currency: str, payment_method: str):
+    """Pending transaction for a gateway session/order; a resumed request does not add a second one"""
+    await db.payment_transactions.update_one(
+        gateway_ref,
+        {"$setOnInsert": {
+            **gateway_ref,
+            "transaction_id": f"txn_{uuid.uuid4().hex[:12]}",
+            "order_id": order_id,
+            "amount": amount,
+            "currency": currency,
+            "payment_status": "pending",
+            "payment_method": payment_method,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }},
+        upsert=True
+    )
+
+async def mark_order_paid(order_id: str) -> Optional[Dict]:
+    """Move an order to paid exactly once and add it to the revenue rollups"""
+    order = await db.orders.find_one_and_update(
+        {"order_id": order_id, "payment_status": {"$ne": "paid"}},
+        {"$set": {"payment_status": "paid", "status": "confirmed"}},
+        return_document=ReturnDocument.AFTER
+    )
+    if order:
+        order.pop("_id", None)
+        try:
+            await record_paid_order(db, order)
+        except Exception as e:
+            # Rollups can be repaired with revenue_rollups.py --rebuild
+            logging.error(f"Revenue rollup update failed for {order_id}: {str(e)}")
+        await mark_carts_converted(order)
+        try:
+            await inventory.confirm(order_id, order.get("items", []))
+        except Exception as e:
+            logging.error(f"Stock confirmation failed for {order_id}: {str(e)}")
+    return order
+
+@api_router.get("/payments/stripe/status/{session_id}")
+async def get_stripe_status(session_id: str):
+    webhook_url = f"{os.environ['REACT_APP_BACKEND_URL']}/webhook/stripe"
+    stripe_checkout = StripeCheckout(api_key=os.environ['STRIPE_API_KEY'], webhook_url=webhook_url)
     
     status = await stripe_checkout.get_checkout_status(session_id)
     
@@ -1478,13 +2521,23 @@ async def get_stripe_status(session_id: str):
             {"$set": {"payment_status": "paid"}}
         )
         
-        await db.orders.update_one(
-            {"order_id": status.metadata.get("order_id")},
-            {"$set": {"payment_status": "paid", "status": "confirmed"}}
-        )
+        await mark_order_paid(status.metadata.get("order_id"))
+    elif status.status == "expired" and status.metadata.get("order_id"):
+        # Checkout session ran out without payment
+        await inventory.release(status.metadata["order_id"], "payment_expired")
     
     return status
 
+async def process_stripe_event(event: Dict):
+    """Apply one queued Stripe checkout webhook"""
+    if event["payment_status"] == "paid":
+        await db.payment_transactions.update_one(
+            {"session_id": event["session_id"]},
+            {"$set": {"payment_status": "paid"}}
+        )
+        
+        await mark_order_paid(event["metadata"].get("order_id"))
+
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     body = await request.body()
@@ -1494,47 +2547,57 @@ async def stripe_webhook(request: Request):
     stripe_checkout = StripeCheckout(api_key=os.environ['STRIPE_API_KEY'], webhook_url=webhook_url)
     
     try:
+        # Signature is checked before queueing; the event is processed by the inbox workers
         webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        if webhook_response.payment_status == "paid":
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {"payment_status": "paid"}}
-            )
-            
-            await db.orders.update_one(
-                {"order_id": webhook_response.metadata.get("order_id")},
-                {"$set": {"payment_status": "paid", "status": "confirmed"}}
-            )
-        
-        return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    
+    event_id = getattr(webhook_response, "event_id", None) or f"{webhook_response.session_id}:{webhook_response.payment_status}"
+    await webhook_inbox.enqueue("stripe", event_id, {
+        "event_type": getattr(webhook_response, "event_type", None),
+        "session_id": webhook_response.session_id,
+        "payment_status": webhook_response.payment_status,
+        "metadata": dict(webhook_response.metadata or {})
+    })
+    return {"status": "success"}
 
 @api_router.post("/payments/razorpay/order")
-async def create_razorpay_order(order_id: str):
+async def create_razorpay_order(order_id: str, idempotency_key: Optional[str] = Header(None)):
+    return await idempotency.run(
+        "razorpay_order", idempotency_key, fingerprint({"order_id": order_id}),
+        lambda claim: open_razorpay_order(order_id, claim)
+    )
+
+async def open_razorpay_order(order_id: str, claim: IdempotencyClaim) -> Dict:
     order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
     amount_in_paise = int(order["total_amount"] * 100)
     
-    razorpay_order = razorpay_client.order.create({
-        "amount": amount_in_paise,
-        "currency": "INR",
-        "payment_capture": 1
-    })
+    # A previous attempt with this Idempotency-Key may already have opened the Razorpay order
+    razorpay_order = None
+    if claim.marker.get("razorpay_order_id"):
+        razorpay_order = razorpay_client.order.fetch(claim.marker["razorpay_order_id"])
+    elif claim.marker.get("receipt"):
+        # It died during or just after the create call; Razorpay finds the order by receipt
+        found = razorpay_client.order.all({"receipt": claim.marker["receipt"]}).get("items", [])
+        razorpay_order = found[0] if found else None
+    
+    if razorpay_order is None:
+        receipt = claim.marker.get("receipt") or f"rcpt_{uuid.uuid4().hex[:16]}"
+        await claim.mark(receipt=receipt)
+        razorpay_order = razorpay_client.order.create({
+            "amount": amount_in_paise,
+            "currency": "INR",
+            "receipt": receipt,
+            "payment_capture": 1
+        })
+        await claim.mark(razorpay_order_id=razorpay_order["id"])
     
-    await db.payment_transactions.insert_one({
-        "transaction_id": f"txn_{uuid.uuid4().hex[:12]}",
-        "order_id": order_id,
-        "razorpay_order_id": razorpay_order["id"],
-        "amount": order["total_amount"],
-        "currency": "INR",
-        "payment_status": "pending",
-        "payment_method": "razorpay",
-        "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await record_payment_transaction(
+        {"razorpay_order_id": razorpay_order["id"]}, order_id, order["total_amount"], "INR", "razorpay"
+    )
     
     return razorpay_order
 
@@ -1554,32 +2617,44 @@ async def verify_razorpay_payment(razorpay_order_id: str, razorpay_payment_id: s
                 {"$set": {"payment_status": "paid", "razorpay_payment_id": razorpay_payment_id}}
             )
             
-            await db.orders.update_one(
-                {"order_id": transaction["order_id"]},
-                {"$set": {"payment_status": "paid", "status": "confirmed"}}
-            )
+            await mark_order_paid(transaction["order_id"])
             
-            # Send order confirmation email with tracking link
+            # Queue order confirmation email with tracking link
             order = await db.orders.find_one({"order_id": transaction["order_id"]}, {"_id": 0})
             if order:
-                site_url = os.environ.get("SITE_URL", "https://paridhaancreations.xyz")
-                tracking_url = f"{site_url}/track/{transaction['order_id']}"
-                await send_order_email(order, "confirmation", tracking_url)
+                await queue_order_notifications(
+                    order, "paid", email_type="confirmation", whatsapp_type="payment_received",
+                    tracking_url=order_tracking_url(transaction["order_id"])
+                )
         
         return {"status": "success", "message": "Payment verified"}
     except Exception as e:
+        transaction = await db.payment_transactions.find_one({"razorpay_order_id": razorpay_order_id}, {"_id": 0, "order_id": 1})
+        if transaction:
+            await inventory.release(transaction["order_id"], "payment_failed")
         raise HTTPException(status_code=400, detail=f"Payment verification failed: {str(e)}")
 
 @api_router.get("/admin/analytics")
-async def get_analytics(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def get_analytics(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """Dashboard totals plus a revenue summary for a day range (default: last 30 days), served from daily rollups"""
     await require_admin(authorization, session_token)
     
-    total_orders = await db.orders.count_documents({})
-    total_revenue = 0
-    orders = await db.orders.find({"payment_status": "paid"}, {"_id": 0}).to_list(10000)
-    for order in orders:
-        total_revenue += order["total_amount"]
+    try:
+        for value in (start_date, end_date):
+            if value:
+                datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    if not start_date and not end_date:
+        start_date = (datetime.now(timezone.utc) - timedelta(days=29)).date().isoformat()
     
+    total_orders = await db.orders.count_documents({})
+    total_revenue = await rollup_total_revenue(db)
     total_products = await db.products.count_documents({})
     total_users = await db.users.count_documents({})
     
@@ -1587,14 +2662,20 @@ async def get_analytics(authorization: Optional[str] = Header(None), session_tok
         "total_orders": total_orders,
         "total_revenue": total_revenue,
         "total_products": total_products,
-        "total_users": total_users
+        "total_users": total_users,
+        "period": await summarize_revenue(db, start_date, end_date)
     }
 
 @api_router.get("/admin/orders")
-async def get_all_orders(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def get_all_orders(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
     await require_admin(authorization, session_token)
-    orders = await db.orders.find({}, {"_id": 0}).to_list(1000)
-    return orders
+    return await list_documents(db.orders, {}, "order_id", 1000, cursor, limit, fields)
 
 @api_router.put("/admin/orders/{order_id}/status")
 async def update_order_status(order_id: str, status: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -1608,24 +2689,29 @@ async def update_order_status(order_id: str, status: str, authorization: Optiona
         {"order_id": order_id},
         {"$set": {"status": status}}
     )
+    if status == "cancelled":
+        await inventory.release(order_id, "cancelled")
     
-    # Get site URL for tracking link
-    site_url = os.environ.get("SITE_URL", "https://paridhaancreations.xyz")
-    tracking_url = f"{site_url}/track/{order_id}"
-    
-    # Send SMS notification
-    if order.get("shipping_address", {}).get("phone"):
-        await send_order_notification(order_id, order["shipping_address"]["phone"], status, tracking_url)
-    
-    # Send email notification with tracking link
+    # Queue SMS and email notifications with tracking link
     email_type_map = {
         "confirmed": "confirmation",
         "processing": "confirmation",
         "shipped": "shipped",
         "delivered": "delivered"
     }
-    if status in email_type_map:
-        await send_order_email(order, email_type_map[status], tracking_url)
+    whatsapp_type_map = {
+        "confirmed": "confirmation",
+        "shipped": "shipped",
+        "out_for_delivery": "out_for_delivery",
+        "delivered": "delivered"
+    }
+    await queue_order_notifications(
+        order, status,
+        email_type=email_type_map.get(status),
+        sms_status=status,
+        whatsapp_type=whatsapp_type_map.get(status),
+        tracking_url=order_tracking_url(order_id)
+    )
     
     return {"message": "Order status updated"}
 
@@ -1664,9 +2750,11 @@ async def create_review(review: ReviewCreate, authorization: Optional[str] = Hea
     return review_obj
 
 @api_router.get("/reviews/{product_id}")
-async def get_product_reviews(product_id: str):
-    reviews = await db.reviews.find({"product_id": product_id}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return reviews
+async def get_product_reviews(product_id: str, cursor: Optional[str] = None, limit: Optional[int] = None, fields: Optional[str] = None):
+    return await list_documents(
+        db.reviews, {"product_id": product_id}, "review_id", 1000, cursor, limit, fields,
+        sort=[("created_at", -1)]
+    )
 
 @api_router.delete("/reviews/{review_id}")
 async def delete_review(review_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -1752,6 +2840,8 @@ async def bulk_update_products(updates: List[Dict[str, Any]], authorization: Opt
             )
             if result.matched_count > 0:
                 updated_count += 1
+                if "price" in update_data or "badge" in update_data:
+                    await publish_cache_invalidation("product", product_id)
     
     return {"message": f"Updated {updated_count} products"}
 
@@ -1799,88 +2889,11 @@ async def generate_invoice(order_id: str, authorization: Optional[str] = Header(
     if user and order.get("user_id") != user.user_id and not user.is_admin:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#0F4C75'),
-        spaceAfter=30,
-        alignment=TA_CENTER
-    )
-    
-    elements.append(Paragraph("Paridhaan Creations", title_style))
-    elements.append(Paragraph("INVOICE", styles['Heading2']))
-    elements.append(Spacer(1, 0.3*inch))
-    
-    invoice_data = [
-        ["Invoice Number:", order_id],
-        ["Order Date:", order.get("created_at", "")[:10]],
-        ["Payment Status:", order.get("payment_status", "").upper()],
-        ["Order Status:", order.get("status", "").upper()]
-    ]
-    
-    invoice_table = Table(invoice_data, colWidths=[2*inch, 3*inch])
-    invoice_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    elements.append(invoice_table)
-    elements.append(Spacer(1, 0.3*inch))
-    
-    elements.append(Paragraph("Bill To:", styles['Heading3']))
-    addr = order.get("shipping_address", {})
-    address_text = f"""
-        {addr.get('full_name', '')}<br/>
-        {addr.get('address_line1', '')}<br/>
-        {addr.get('address_line2', '') + '<br/>' if addr.get('address_line2') else ''}
-        {addr.get('city', '')}, {addr.get('state', '')} {addr.get('pincode', '')}<br/>
-        Phone: {addr.get('phone', '')}
-    """
-    elements.append(Paragraph(address_text, styles['Normal']))
-    elements.append(Spacer(1, 0.3*inch))
-    
-    items_data = [["Product", "Quantity", "Price", "Total"]]
-    for item in order.get("items", []):
-        items_data.append([
-            item.get("product_name", ""),
-            str(item.get("quantity", 0)),
-            f"₹{item.get('price', 0):.2f}",
-            f"₹{(item.get('price', 0) * item.get('quantity', 0)):.2f}"
-        ])
-    
-    items_data.append(["", "", "Total:", f"₹{order.get('total_amount', 0):.2f}"])
-    
-    items_table = Table(items_data, colWidths=[3*inch, 1*inch, 1.5*inch, 1.5*inch])
-    items_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#0F4C75')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('GRID', (0, 0), (-1, -2), 1, colors.grey),
-        ('LINEABOVE', (2, -1), (-1, -1), 2, colors.HexColor('#0F4C75')),
-        ('FONTNAME', (2, -1), (-1, -1), 'Helvetica-Bold'),
-    ]))
-    elements.append(items_table)
-    elements.append(Spacer(1, 0.5*inch))
-    
-    footer_text = "Thank you for your business!<br/>Paridhaan Creations"
-    elements.append(Paragraph(footer_text, ParagraphStyle('Footer', parent=styles['Normal'], alignment=TA_CENTER)))
-    
-    doc.build(elements)
-    buffer.seek(0)
-    
-    return JSONResponse(
-        content=buffer.getvalue().decode('latin-1'),
+    pdf_path = await render_invoice_file(render_order_summary, "order_invoice", order_id, order)
+    return FileResponse(
+        pdf_path,
         media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename=invoice_{order_id}.pdf"}
+        filename=f"invoice_{order_id}.pdf"
     )
 
 @api_router.get("/products/{product_id}/recommendations")
@@ -1915,54 +2928,101 @@ async def get_product_recommendations(product_id: str):
     
     return recommendations[:4]
 
-@api_router.get("/admin/customer-insights")
-async def get_customer_insights(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
-    """Get customer segmentation and insights"""
-    await require_admin(authorization, session_token)
-    
-    orders = await db.orders.find({"payment_status": "paid"}, {"_id": 0}).to_list(10000)
-    
-    total_customers = len(set(o.get("user_id") or o.get("guest_email") for o in orders))
-    
-    customer_orders = {}
-    for order in orders:
-        customer_id = order.get("user_id") or order.get("guest_email", "guest")
-        if customer_id not in customer_orders:
-            customer_orders[customer_id] = {"orders": 0, "total_spent": 0}
-        customer_orders[customer_id]["orders"] += 1
-        customer_orders[customer_id]["total_spent"] += order.get("total_amount", 0)
-    
-    repeat_customers = sum(1 for c in customer_orders.values() if c["orders"] > 1)
-    
-    avg_order_value = sum(o.get("total_amount", 0) for o in orders) / len(orders) if orders else 0
-    
-    category_popularity = Counter()
-    for order in orders:
-        for item in order.get("items", []):
-            product = await db.products.find_one({"product_id": item["product_id"]}, {"_id": 0})
-            if product:
-                category_popularity[product.get("category", "unknown")] += item.get("quantity", 0)
-    
-    top_categories = dict(category_popularity.most_common(5))
+CUSTOMER_INSIGHTS_REFRESH_SECONDS = int(os.environ.get('CUSTOMER_INSIGHTS_REFRESH_SECONDS', '0'))  # 0 = compute per request
+
+async def compute_customer_insights() -> Dict:
+    """Customer segmentation in one $facet aggregation over paid orders"""
+    customer_id = {"$ifNull": ["$user_id", {"$ifNull": ["$guest_email", "guest"]}]}
+    amount = {"$ifNull": ["$total_amount", 0]}
+    per_customer = {"$group": {"_id": customer_id, "orders": {"$sum": 1}, "total_spent": {"$sum": amount}}}
+    cutoff = datetime.now(timezone.utc) - timedelta(days=30)
     
-    recent_orders_30days = len([o for o in orders if datetime.fromisoformat(o["created_at"].replace('Z', '+00:00')) > datetime.now(timezone.utc) - timedelta(days=30)])
+    pipeline = [
+        {"$match": {"payment_status": "paid"}},
+        {"$facet": {
+            "summary": [
+                {"$group": {"_id": None, "orders": {"$sum": 1}, "revenue": {"$sum": amount}}}
+            ],
+            "customers": [
+                per_customer,
+                {"$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "repeat": {"$sum": {"$cond": [{"$gt": ["$orders", 1]}, 1, 0]}}
+                }}
+            ],
+            "vip_customers": [
+                per_customer,
+                {"$sort": {"total_spent": -1}},
+                {"$limit": 10},
+                {"$project": {"_id": 0, "customer_id": "$_id", "orders": 1, "total_spent": 1}}
+            ],
+            "top_categories": [
+                {"$unwind": "$items"},
+                # Collapse to one row per product first so $lookup runs once per product
+                {"$group": {"_id": "$items.product_id", "quantity": {"$sum": {"$ifNull": ["$items.quantity", 0]}}}},
+                {"$lookup": {"from": "products", "localField": "_id", "foreignField": "product_id", "as": "product"}},
+                {"$unwind": "$product"},
+                {"$group": {"_id": {"$ifNull": ["$product.category", "unknown"]}, "quantity": {"$sum": "$quantity"}}},
+                {"$sort": {"quantity": -1}},
+                {"$limit": 5}
+            ],
+            "recent": [
+                # created_at is an ISO string on most orders, a datetime on older ones
+                {"$match": {"$or": [
+                    {"created_at": {"$gt": cutoff.isoformat()}},
+                    {"created_at": {"$gt": cutoff}}
+                ]}},
+                {"$count": "count"}
+            ]
+        }}
+    ]
+    result = (await db.orders.aggregate(pipeline).to_list(1))[0]
     
-    vip_customers = sorted(
-        [{"customer_id": k, **v} for k, v in customer_orders.items()],
-        key=lambda x: x["total_spent"],
-        reverse=True
-    )[:10]
+    summary = result["summary"][0] if result["summary"] else {"orders": 0, "revenue": 0}
+    customers = result["customers"][0] if result["customers"] else {"total": 0, "repeat": 0}
+    total_customers = customers["total"]
+    repeat_customers = customers["repeat"]
     
     return {
         "total_customers": total_customers,
         "repeat_customers": repeat_customers,
         "repeat_rate": (repeat_customers / total_customers * 100) if total_customers > 0 else 0,
-        "avg_order_value": avg_order_value,
-        "top_categories": top_categories,
-        "recent_orders_30days": recent_orders_30days,
-        "vip_customers": vip_customers
+        "avg_order_value": summary["revenue"] / summary["orders"] if summary["orders"] else 0,
+        "top_categories": {row["_id"]: row["quantity"] for row in result["top_categories"]},
+        "recent_orders_30days": result["recent"][0]["count"] if result["recent"] else 0,
+        "vip_customers": result["vip_customers"],
+        "computed_at": datetime.now(timezone.utc).isoformat()
     }
 
+async def refresh_customer_insights():
+    """Recompute the materialized insights every CUSTOMER_INSIGHTS_REFRESH_SECONDS"""
+    while True:
+        try:
+            insights = await compute_customer_insights()
+            await db.analytics_snapshots.update_one(
+                {"snapshot_id": "customer_insights"},
+                {"$set": {"data": insights, "computed_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Customer insights refresh failed: {str(e)}")
+        await asyncio.sleep(CUSTOMER_INSIGHTS_REFRESH_SECONDS)
+
+@api_router.get("/admin/customer-insights")
+async def get_customer_insights(fresh: bool = False, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Get customer segmentation and insights"""
+    await require_admin(authorization, session_token)
+    
+    if CUSTOMER_INSIGHTS_REFRESH_SECONDS > 0 and not fresh:
+        snapshot = await db.analytics_snapshots.find_one({"snapshot_id": "customer_insights"}, {"_id": 0})
+        if snapshot:
+            return snapshot["data"]
+    
+    return await compute_customer_insights()
+
 # ============ ABANDONED CART RECOVERY ENDPOINTS ============
 
 class AbandonedCartUpdate(BaseModel):
@@ -1971,6 +3031,15 @@ class AbandonedCartUpdate(BaseModel):
     recovery_status: Optional[str] = None  # pending, contacted, recovered, lost
     notes: Optional[str] = None
 
+def abandonment_stage(hours_abandoned: float) -> tuple:
+    if hours_abandoned < 1:
+        return "fresh", "< 1 hour"
+    if hours_abandoned < 24:
+        return "warm", f"{int(hours_abandoned)} hours"
+    if hours_abandoned < 72:
+        return "cooling", f"{int(hours_abandoned / 24)} days"
+    return "cold", f"{int(hours_abandoned / 24)}+ days"
+
 @api_router.get("/admin/abandoned-carts")
 async def get_abandoned_carts(
     authorization: Optional[str] = Header(None),
@@ -1981,72 +3050,35 @@ async def get_abandoned_carts(
     """Get abandoned carts (carts with items that haven't converted to orders)"""
     await require_admin(authorization, session_token)
     
-    # Calculate the threshold time
-    threshold_time = datetime.now(timezone.utc) - timedelta(hours=hours_threshold)
+    now = datetime.now(timezone.utc)
+    threshold_time = now - timedelta(hours=hours_threshold)
     
-    # Find carts that:
-    # 1. Have items
-    # 2. Were last updated before threshold
-    # 3. Don't have a corresponding paid order
+    # Open carts idle since before the threshold - served by the (cart_state, last_activity_at) index
+    abandoned_carts = await db.cart.find(
+        {"cart_state": "open", "last_activity_at": {"$lt": threshold_time}},
+        {"_id": 0}
+    ).sort("last_activity_at", -1).limit(limit).to_list(limit)
     
-    pipeline = [
-        {
-            "$match": {
-                "items": {"$exists": True, "$ne": []},
-                "updated_at": {"$lt": threshold_time}
-            }
-        },
-        {
-            "$lookup": {
-                "from": "orders",
-                "let": {"cart_user": "$user_id", "cart_session": "$session_id"},
-                "pipeline": [
-                    {
-                        "$match": {
-                            "$expr": {
-                                "$and": [
-                                    {"$or": [
-                                        {"$eq": ["$user_id", "$$cart_user"]},
-                                        {"$eq": ["$session_id", "$$cart_session"]}
-                                    ]},
-                                    {"$eq": ["$payment_status", "paid"]}
-                                ]
-                            }
-                        }
-                    }
-                ],
-                "as": "completed_orders"
-            }
-        },
-        {
-            "$match": {
-                "completed_orders": {"$size": 0}
-            }
-        },
-        {
-            "$sort": {"updated_at": -1}
-        },
-        {
-            "$limit": limit
-        },
-        {
-            "$project": {
-                "_id": 0,
-                "completed_orders": 0
-            }
-        }
-    ]
+    # Enrich with product details and user contacts in two batched lookups
+    product_ids = list({item["product_id"] for cart in abandoned_carts for item in cart.get("items", [])})
+    products = await db.products.find(
+        {"product_id": {"$in": product_ids}}, {"_id": 0, "product_id": 1, "name": 1, "images": 1, "price": 1}
+    ).to_list(len(product_ids) or 1)
+    products_by_id = {p["product_id"]: p for p in products}
     
-    abandoned_carts = await db.cart.aggregate(pipeline).to_list(limit)
+    user_ids = list({cart["user_id"] for cart in abandoned_carts if cart.get("user_id")})
+    users = await db.users.find(
+        {"user_id": {"$in": user_ids}}, {"_id": 0, "user_id": 1, "email": 1, "name": 1}
+    ).to_list(len(user_ids) or 1)
+    users_by_id = {u["user_id"]: u for u in users}
     
-    # Enrich cart data with product details and calculate total
     enriched_carts = []
     for cart in abandoned_carts:
         cart_total = 0
         enriched_items = []
         
         for item in cart.get("items", []):
-            product = await db.products.find_one({"product_id": item["product_id"]}, {"_id": 0})
+            product = products_by_id.get(item["product_id"])
             if product:
                 item_total = product.get("price", 0) * item.get("quantity", 1)
                 cart_total += item_total
@@ -2059,46 +3091,17 @@ async def get_abandoned_carts(
                     "item_total": item_total
                 })
         
-        # Get user email if logged in user
-        user_email = None
-        user_name = None
-        if cart.get("user_id"):
-            user = await db.users.find_one({"user_id": cart["user_id"]}, {"_id": 0})
-            if user:
-                user_email = user.get("email")
-                user_name = user.get("name")
-        
-        # Calculate time since abandoned
-        updated_at = cart.get("updated_at")
-        if isinstance(updated_at, str):
-            updated_at = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
-        
-        # Ensure updated_at is timezone-aware
-        if updated_at and updated_at.tzinfo is None:
-            updated_at = updated_at.replace(tzinfo=timezone.utc)
-        
-        hours_abandoned = (datetime.now(timezone.utc) - updated_at).total_seconds() / 3600 if updated_at else 0
-        
-        # Determine abandonment stage
-        if hours_abandoned < 1:
-            stage = "fresh"
-            stage_label = "< 1 hour"
-        elif hours_abandoned < 24:
-            stage = "warm"
-            stage_label = f"{int(hours_abandoned)} hours"
-        elif hours_abandoned < 72:
-            stage = "cooling"
-            stage_label = f"{int(hours_abandoned / 24)} days"
-        else:
-            stage = "cold"
-            stage_label = f"{int(hours_abandoned / 24)}+ days"
+        user = users_by_id.get(cart.get("user_id"), {})
+        last_activity_at = as_utc_datetime(cart.get("last_activity_at"))
+        hours_abandoned = (now - last_activity_at).total_seconds() / 3600 if last_activity_at else 0
+        stage, stage_label = abandonment_stage(hours_abandoned)
         
         enriched_carts.append({
             "cart_id": cart.get("cart_id"),
             "user_id": cart.get("user_id"),
             "session_id": cart.get("session_id"),
-            "user_email": user_email or cart.get("guest_email"),
-            "user_name": user_name,
+            "user_email": user.get("email") or cart.get("guest_email"),
+            "user_name": user.get("name"),
             "guest_phone": cart.get("guest_phone"),
             "items": enriched_items,
             "items_count": len(enriched_items),
@@ -2115,14 +3118,7 @@ async def get_abandoned_carts(
     # Get summary stats
     total_abandoned = len(enriched_carts)
     total_value = sum(c["cart_total"] for c in enriched_carts)
-    
-    # Count by stage
-    stage_counts = {
-        "fresh": len([c for c in enriched_carts if c["stage"] == "fresh"]),
-        "warm": len([c for c in enriched_carts if c["stage"] == "warm"]),
-        "cooling": len([c for c in enriched_carts if c["stage"] == "cooling"]),
-        "cold": len([c for c in enriched_carts if c["stage"] == "cold"])
-    }
+    stage_counts = Counter(c["stage"] for c in enriched_carts)
     
     return {
         "abandoned_carts": enriched_carts,
@@ -2130,7 +3126,7 @@ async def get_abandoned_carts(
             "total_abandoned": total_abandoned,
             "total_value": total_value,
             "avg_cart_value": total_value / total_abandoned if total_abandoned > 0 else 0,
-            "by_stage": stage_counts
+            "by_stage": {stage: stage_counts[stage] for stage in ["fresh", "warm", "cooling", "cold"]}
         }
     }
 
@@ -2142,111 +3138,32 @@ async def get_abandoned_cart_stats(
     """Get abandoned cart statistics for dashboard"""
     await require_admin(authorization, session_token)
     
-    # Get counts for different time periods
     now = datetime.now(timezone.utc)
     
-    async def count_abandoned(hours):
-        threshold = now - timedelta(hours=hours)
-        pipeline = [
-            {
-                "$match": {
-                    "items": {"$exists": True, "$ne": []},
-                    "updated_at": {"$lt": threshold}
-                }
-            },
-            {
-                "$lookup": {
-                    "from": "orders",
-                    "let": {"cart_user": "$user_id", "cart_session": "$session_id"},
-                    "pipeline": [
-                        {
-                            "$match": {
-                                "$expr": {
-                                    "$and": [
-                                        {"$or": [
-                                            {"$eq": ["$user_id", "$$cart_user"]},
-                                            {"$eq": ["$session_id", "$$cart_session"]}
-                                        ]},
-                                        {"$eq": ["$payment_status", "paid"]}
-                                    ]
-                                }
-                            }
-                        }
-                    ],
-                    "as": "completed_orders"
-                }
-            },
-            {
-                "$match": {
-                    "completed_orders": {"$size": 0}
-                }
-            },
-            {
-                "$count": "total"
-            }
-        ]
-        result = await db.cart.aggregate(pipeline).to_list(1)
-        return result[0]["total"] if result else 0
-    
-    # Get stats for different periods
-    abandoned_1h = await count_abandoned(1)
-    abandoned_24h = await count_abandoned(24)
-    abandoned_72h = await count_abandoned(72)
-    abandoned_7d = await count_abandoned(168)
-    
-    # Calculate potential revenue lost (from 24h+ abandoned)
-    pipeline = [
-        {
-            "$match": {
-                "items": {"$exists": True, "$ne": []},
-                "updated_at": {"$lt": now - timedelta(hours=24)}
-            }
-        },
-        {
-            "$lookup": {
-                "from": "orders",
-                "let": {"cart_user": "$user_id", "cart_session": "$session_id"},
-                "pipeline": [
-                    {
-                        "$match": {
-                            "$expr": {
-                                "$and": [
-                                    {"$or": [
-                                        {"$eq": ["$user_id", "$$cart_user"]},
-                                        {"$eq": ["$session_id", "$$cart_session"]}
-                                    ]},
-                                    {"$eq": ["$payment_status", "paid"]}
-                                ]
-                            }
-                        }
-                    }
-                ],
-                "as": "completed_orders"
-            }
-        },
-        {
-            "$match": {
-                "completed_orders": {"$size": 0}
-            }
-        }
-    ]
-    
-    abandoned_carts = await db.cart.aggregate(pipeline).to_list(1000)
+    def idle_since(hours):
+        return {"$lt": ["$last_activity_at", now - timedelta(hours=hours)]}
     
-    # Calculate total potential revenue
-    potential_revenue = 0
-    for cart in abandoned_carts:
-        for item in cart.get("items", []):
-            product = await db.products.find_one({"product_id": item["product_id"]}, {"_id": 0, "price": 1})
-            if product:
-                potential_revenue += product.get("price", 0) * item.get("quantity", 1)
+    # One indexed pass over open carts idle for 1h+; the longer windows are subsets
+    result = await db.cart.aggregate([
+        {"$match": {"cart_state": "open", "last_activity_at": {"$lt": now - timedelta(hours=1)}}},
+        {"$group": {
+            "_id": None,
+            "abandoned_1h": {"$sum": 1},
+            "abandoned_24h": {"$sum": {"$cond": [idle_since(24), 1, 0]}},
+            "abandoned_72h": {"$sum": {"$cond": [idle_since(72), 1, 0]}},
+            "abandoned_7d": {"$sum": {"$cond": [idle_since(168), 1, 0]}},
+            # Potential revenue counts carts abandoned for 24h+
+            "potential_revenue_lost": {"$sum": {"$cond": [idle_since(24), {"$ifNull": ["$cart_value", 0]}, 0]}}
+        }}
+    ]).to_list(1)
+    stats = result[0] if result else {}
     
     return {
-        "abandoned_1h": abandoned_1h,
-        "abandoned_24h": abandoned_24h,
-        "abandoned_72h": abandoned_72h,
-        "abandoned_7d": abandoned_7d,
-        "potential_revenue_lost": potential_revenue,
+        "abandoned_1h": stats.get("abandoned_1h", 0),
+        "abandoned_24h": stats.get("abandoned_24h", 0),
+        "abandoned_72h": stats.get("abandoned_72h", 0),
+        "abandoned_7d": stats.get("abandoned_7d", 0),
+        "potential_revenue_lost": stats.get("potential_revenue_lost", 0),
         "recovery_tip": "Contact customers within 24 hours for best recovery rates!"
     }
 
@@ -2276,6 +3193,33 @@ async def update_abandoned_cart(
     
     return {"message": "Cart updated successfully", "cart_id": cart_id}
 
+CART_RECOVERY_INTERVAL_SECONDS = int(os.environ.get('CART_RECOVERY_INTERVAL_SECONDS', '0'))  # 0 = no automatic nudges
+
+cart_recovery = CartRecoveryScheduler(
+    db,
+    send_email=send_order_email,
+    send_whatsapp=WhatsAppService.send_text_message,
+    cart_url=f"{os.environ.get('SITE_URL', 'https://paridhaancreations.xyz')}/cart",
+    batch_size=int(os.environ.get('CART_RECOVERY_BATCH_SIZE', '200')),
+    sends_per_second=float(os.environ.get('CART_RECOVERY_SENDS_PER_SECOND', '5'))
+)
+
+@api_router.get("/admin/abandoned-carts/recovery")
+async def get_cart_recovery_status(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Recovery scheduler watermarks and the last run's counts"""
+    await require_admin(authorization, session_token)
+    return {
+        "enabled": CART_RECOVERY_INTERVAL_SECONDS > 0,
+        "interval_seconds": CART_RECOVERY_INTERVAL_SECONDS,
+        **(await cart_recovery.status())
+    }
+
+@api_router.post("/admin/abandoned-carts/recovery/run")
+async def run_cart_recovery(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Run one recovery pass now"""
+    await require_admin(authorization, session_token)
+    return await cart_recovery.run_once()
+
 @api_router.post("/cart/save-contact")
 async def save_cart_contact(
     guest_email: Optional[str] = None,
@@ -2414,7 +3358,14 @@ async def update_ticket_status(ticket_id: str, status: str, authorization: Optio
     return {"message": f"Ticket status updated to {status}"}
 
 @api_router.get("/admin/support/tickets")
-async def get_all_tickets(status: Optional[str] = None, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+async def get_all_tickets(
+    status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    fields: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
     """Get all support tickets (admin only)"""
     await require_admin(authorization, session_token)
     
@@ -2422,8 +3373,10 @@ async def get_all_tickets(status: Optional[str] = None, authorization: Optional[
     if status:
         query["status"] = status
     
-    tickets = await db.support_tickets.find(query, {"_id": 0}).sort("created_at", -1).to_list(100)
-    return tickets
+    return await list_documents(
+        db.support_tickets, query, "ticket_id", 100, cursor, limit, fields,
+        sort=[("created_at", -1)]
+    )
 
 @api_router.get("/admin/support/stats")
 async def get_support_stats(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -2443,6 +3396,20 @@ async def get_support_stats(authorization: Optional[str] = Header(None), session
         "closed": total - open_tickets - in_progress - resolved
     }
 
+# ============ DATABASE INDEX ENDPOINTS ============
+
+@api_router.get("/admin/db/indexes")
+async def get_index_report(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Report missing, unused and unregistered indexes (admin only)"""
+    await require_admin(authorization, session_token)
+    return await index_report(db)
+
+@api_router.post("/admin/db/indexes")
+async def apply_indexes(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Create any registered indexes that are missing (admin only)"""
+    await require_admin(authorization, session_token)
+    return await ensure_indexes(db)
+
 # ============ STOCK ALERTS ENDPOINTS ============
 
 @api_router.get("/admin/stock-alerts")
@@ -2455,15 +3422,19 @@ async def get_stock_alerts(threshold: int = 5, authorization: Optional[str] = He
         {"_id": 0}
     ).sort("stock", 1).to_list(50)
     
+    # Negative stock: late payments confirmed after their reservation expired
+    oversold = [p for p in low_stock_products if p["stock"] < 0]
     out_of_stock = [p for p in low_stock_products if p["stock"] == 0]
     critical_stock = [p for p in low_stock_products if 0 < p["stock"] <= 2]
     low_stock = [p for p in low_stock_products if 2 < p["stock"] <= threshold]
     
     return {
+        "oversold": oversold,
         "out_of_stock": out_of_stock,
         "critical": critical_stock,
         "low": low_stock,
-        "total_alerts": len(low_stock_products)
+        "total_alerts": len(low_stock_products),
+        "reservations": await inventory.summary()
     }
 
 @api_router.put("/admin/products/{product_id}/restock")
@@ -2855,7 +3826,8 @@ async def get_uploaded_file(filename: str):
         'jpeg': 'image/jpeg',
         'png': 'image/png',
         'webp': 'image/webp',
-        'gif': 'image/gif'
+        'gif': 'image/gif',
+        'pdf': 'application/pdf'
     }
     content_type = content_types.get(ext, 'application/octet-stream')
     
@@ -2883,6 +3855,25 @@ async def delete_uploaded_file(filename: str, authorization: Optional[str] = Hea
 
 # ==================== GST & INVOICE APIs ====================
 
+# PDF rendering runs in worker processes so ReportLab never blocks the event loop
+invoice_renderer = InvoiceRenderer(
+    UPLOAD_DIR,
+    max_workers=int(os.environ.get('INVOICE_RENDER_WORKERS', '2')),
+    max_pending=int(os.environ.get('INVOICE_RENDER_MAX_PENDING', '8')),
+    queue_timeout=float(os.environ.get('INVOICE_RENDER_QUEUE_TIMEOUT_SECONDS', '10'))
+)
+
+async def render_invoice_file(render_fn, prefix: str, key: str, document: Dict[str, Any]) -> Path:
+    """Cached PDF path for document; 503 when the render queue is full"""
+    try:
+        return await invoice_renderer.render(render_fn, prefix, key, document)
+    except RendererBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Invoice generation is busy, please retry shortly",
+            headers={"Retry-After": "5"}
+        )
+
 # Indian states with codes for GST
 INDIAN_STATES = {
     "01": "Jammu & Kashmir", "02": "Himachal Pradesh", "03": "Punjab", "04": "Chandigarh",
@@ -2933,103 +3924,23 @@ def number_to_words(num: float) -> str:
     result += ' Only'
     return result
 
-async def generate_invoice_number() -> str:
-    """Generate unique invoice number like PC-2024-0001"""
+invoice_sequencer = InvoiceSequencer(db)
+
+async def generate_invoice_numbers(count: int) -> List[str]:
+    """Reserve count consecutive invoice numbers like PC-2024-0001"""
     gst_settings = await db.gst_settings.find_one({"setting_id": "gst_settings"}, {"_id": 0})
     prefix = gst_settings.get("invoice_prefix", "PC") if gst_settings else "PC"
-    year = datetime.now().year
-    
-    # Get last invoice number for this year
-    last_invoice = await db.invoices.find_one(
-        {"invoice_number": {"$regex": f"^{prefix}-{year}-"}},
-        sort=[("created_at", -1)]
-    )
-    
-    if last_invoice:
-        last_num = int(last_invoice["invoice_number"].split("-")[-1])
-        new_num = last_num + 1
-    else:
-        new_num = 1
-    
-    return f"{prefix}-{year}-{new_num:04d}"
+    return await invoice_sequencer.allocate(prefix, datetime.now().year, count)
+
+async def generate_invoice_number() -> str:
+    """Generate unique invoice number like PC-2024-0001"""
+    return (await generate_invoice_numbers(1))[0]
+
+gst_engine = GSTEngine(db, get_state_code)
 
 async def calculate_gst(items: List[Dict], customer_state: str, gst_settings: Dict) -> Dict:
     """Calculate GST breakdown for order items"""
-    business_state_code = gst_settings.get("business_state_code", "08")
-    customer_state_code = get_state_code(customer_state)
-    is_inter_state = business_state_code != customer_state_code
-    
-    total_taxable = 0
-    total_cgst = 0
-    total_sgst = 0
-    total_igst = 0
-    item_details = []
-    
-    for item in items:
-        # Get product GST rate
-        product = await db.products.find_one({"product_id": item["product_id"]}, {"_id": 0})
-        if not product:
-            continue
-            
-        # Priority: Product GST > Category GST > Default GST
-        gst_rate = product.get("gst_rate")
-        hsn_code = product.get("hsn_code", "")
-        
-        if gst_rate is None:
-            category = await db.categories.find_one({"slug": product["category"]}, {"_id": 0})
-            if category:
-                gst_rate = category.get("gst_rate")
-                if not hsn_code:
-                    hsn_code = category.get("hsn_code", "")
-        
-        if gst_rate is None:
-            gst_rate = gst_settings.get("default_gst_rate", 18.0)
-        
-        # Calculate taxable amount (price is inclusive of GST)
-        item_total = item["price"] * item["quantity"]
-        if gst_settings.get("prices_include_gst", True):
-            taxable_amount = item_total / (1 + gst_rate / 100)
-        else:
-            taxable_amount = item_total
-        
-        # Calculate GST
-        if is_inter_state:
-            igst = taxable_amount * gst_rate / 100
-            cgst = 0
-            sgst = 0
-        else:
-            cgst = taxable_amount * (gst_rate / 2) / 100
-            sgst = taxable_amount * (gst_rate / 2) / 100
-            igst = 0
-        
-        total_taxable += taxable_amount
-        total_cgst += cgst
-        total_sgst += sgst
-        total_igst += igst
-        
-        item_details.append({
-            "product_id": item["product_id"],
-            "product_name": item.get("product_name", product["name"]),
-            "hsn_code": hsn_code,
-            "quantity": item["quantity"],
-            "unit_price": item["price"],
-            "taxable_amount": round(taxable_amount, 2),
-            "gst_rate": gst_rate,
-            "cgst": round(cgst, 2),
-            "sgst": round(sgst, 2),
-            "igst": round(igst, 2),
-            "total": round(item_total, 2)
-        })
-    
-    return {
-        "is_inter_state": is_inter_state,
-        "items": item_details,
-        "taxable_amount": round(total_taxable, 2),
-        "cgst_amount": round(total_cgst, 2),
-        "sgst_amount": round(total_sgst, 2),
-        "igst_amount": round(total_igst, 2),
-        "total_gst": round(total_cgst + total_sgst + total_igst, 2)
-    }
+    return await gst_engine.calculate(items, customer_state, gst_settings)
 
 # GST Settings APIs
 @api_router.get("/gst-settings")
@@ -3075,55 +3986,35 @@ async def get_indian_states():
     return [{"code": code, "name": name} for code, name in INDIAN_STATES.items()]
 
 # Invoice Generation API
-@api_router.get("/orders/{order_id}/invoice")
-async def get_or_generate_invoice(order_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
-    """Get or generate invoice for an order"""
-    # Check if invoice already exists
-    existing_invoice = await db.invoices.find_one({"order_id": order_id}, {"_id": 0})
-    if existing_invoice:
-        return existing_invoice
-    
-    # Get order
-    order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
-    # Only generate invoice for paid/confirmed orders
-    if order["payment_status"] not in ["paid", "completed"] and order["status"] not in ["confirmed", "processing", "shipped", "delivered"]:
-        raise HTTPException(status_code=400, detail="Invoice can only be generated for confirmed/paid orders")
-    
-    # Get GST settings
-    gst_settings = await db.gst_settings.find_one({"setting_id": "gst_settings"}, {"_id": 0})
-    if not gst_settings:
-        gst_settings = {
-            "business_name": "Paridhaan Creations",
-            "gstin": "08BFVPG3792N1ZH",
-            "business_address": "Terra City 1, Tijara, 301411",
-            "business_state": "Rajasthan",
-            "business_state_code": "08",
-            "default_gst_rate": 18.0,
-            "prices_include_gst": True,
-            "invoice_prefix": "PC"
-        }
-    
-    # Calculate GST
+DEFAULT_INVOICE_GST_SETTINGS = {
+    "business_name": "Paridhaan Creations",
+    "gstin": "08BFVPG3792N1ZH",
+    "business_address": "Terra City 1, Tijara, 301411",
+    "business_state": "Rajasthan",
+    "business_state_code": "08",
+    "default_gst_rate": 18.0,
+    "prices_include_gst": True,
+    "invoice_prefix": "PC"
+}
+
+INVOICE_PAYMENT_STATUSES = ["paid", "completed"]
+INVOICE_ORDER_STATUSES = ["confirmed", "processing", "shipped", "delivered"]
+
+def is_invoice_eligible(order: Dict) -> bool:
+    """Invoices are only issued for confirmed/paid orders"""
+    return order.get("payment_status") in INVOICE_PAYMENT_STATUSES or order.get("status") in INVOICE_ORDER_STATUSES
+
+def build_invoice(order: Dict, gst_settings: Dict, gst_calc: Dict, invoice_number: str) -> Dict:
+    """Invoice document for an order from its GST breakdown"""
     customer_state = order["shipping_address"]["state"]
-    gst_calc = await calculate_gst(order["items"], customer_state, gst_settings)
-    
-    # Generate invoice number
-    invoice_number = await generate_invoice_number()
-    
-    # Calculate totals
     subtotal = sum(item["price"] * item["quantity"] for item in order["items"])
     discount = order.get("discount_amount", 0)
-    taxable_amount = gst_calc["taxable_amount"]
     grand_total = order["total_amount"]
-    
-    # Create invoice
+
     invoice = {
         "invoice_id": f"inv_{uuid.uuid4().hex[:12]}",
         "invoice_number": invoice_number,
-        "order_id": order_id,
+        "order_id": order["order_id"],
         # Seller Details
         "seller_name": gst_settings.get("business_name", "Paridhaan Creations"),
         "seller_gstin": gst_settings.get("gstin", ""),
@@ -3145,7 +4036,7 @@ async def get_or_generate_invoice(order_id: str, authorization: Optional[str] =
         # Amounts
         "subtotal": round(subtotal, 2),
         "discount": round(discount, 2),
-        "taxable_amount": round(taxable_amount, 2),
+        "taxable_amount": round(gst_calc["taxable_amount"], 2),
         "cgst_amount": gst_calc["cgst_amount"],
         "sgst_amount": gst_calc["sgst_amount"],
         "igst_amount": gst_calc["igst_amount"],
@@ -3169,29 +4060,70 @@ async def get_or_generate_invoice(order_id: str, authorization: Optional[str] =
         "order_date": order["created_at"].isoformat() if isinstance(order["created_at"], datetime) else order["created_at"],
         "created_at": datetime.now(timezone.utc)
     }
-    
+
     # Generate QR code data (for UPI/verification)
-    qr_data = f"Invoice: {invoice_number}|Amount: {grand_total}|GSTIN: {gst_settings.get('gstin', '')}"
-    invoice["qr_code_data"] = qr_data
+    invoice["qr_code_data"] = f"Invoice: {invoice_number}|Amount: {grand_total}|GSTIN: {gst_settings.get('gstin', '')}"
+    return invoice
+
+def invoice_order_update(invoice: Dict, gst_calc: Dict) -> Dict:
+    """$set applied to the order once its invoice exists"""
+    return {
+        "invoice_number": invoice["invoice_number"],
+        "invoice_generated_at": datetime.now(timezone.utc),
+        "gst_details": {
+            "is_inter_state": gst_calc["is_inter_state"],
+            "taxable_amount": gst_calc["taxable_amount"],
+            "cgst_amount": gst_calc["cgst_amount"],
+            "sgst_amount": gst_calc["sgst_amount"],
+            "igst_amount": gst_calc["igst_amount"],
+            "total_gst": gst_calc["total_gst"]
+        }
+    }
+
+@api_router.get("/orders/{order_id}/invoice")
+async def get_or_generate_invoice(order_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Get or generate invoice for an order"""
+    # Check if invoice already exists
+    existing_invoice = await db.invoices.find_one({"order_id": order_id}, {"_id": 0})
+    if existing_invoice:
+        return existing_invoice
+    
+    # Get order
+    order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    # Only generate invoice for paid/confirmed orders
+    if not is_invoice_eligible(order):
+        raise HTTPException(status_code=400, detail="Invoice can only be generated for confirmed/paid orders")
+    
+    # Get GST settings
+    gst_settings = await db.gst_settings.find_one({"setting_id": "gst_settings"}, {"_id": 0})
+    if not gst_settings:
+        gst_settings = DEFAULT_INVOICE_GST_SETTINGS
+    
+    # Calculate GST
+    customer_state = order["shipping_address"]["state"]
+    gst_calc = await calculate_gst(order["items"], customer_state, gst_settings)
+    
+    # Generate invoice number
+    invoice_number = await generate_invoice_number()
+    invoice = build_invoice(order, gst_settings, gst_calc, invoice_number)
     
     # Save invoice
-    await db.invoices.insert_one(invoice)
+    try:
+        await db.invoices.insert_one(invoice)
+    except DuplicateKeyError:
+        # A concurrent request invoiced this order first; its number wins and ours is left unused
+        existing_invoice = await db.invoices.find_one({"order_id": order_id}, {"_id": 0})
+        if existing_invoice:
+            return existing_invoice
+        raise
     
     # Update order with invoice number
     await db.orders.update_one(
         {"order_id": order_id},
-        {"$set": {
-            "invoice_number": invoice_number,
-            "invoice_generated_at": datetime.now(timezone.utc),
-            "gst_details": {
-                "is_inter_state": gst_calc["is_inter_state"],
-                "taxable_amount": taxable_amount,
-                "cgst_amount": gst_calc["cgst_amount"],
-                "sgst_amount": gst_calc["sgst_amount"],
-                "igst_amount": gst_calc["igst_amount"],
-                "total_gst": gst_calc["total_gst"]
-            }
-        }}
+        {"$set": invoice_order_update(invoice, gst_calc)}
     )
     
     # Remove _id before returning
@@ -3207,199 +4139,20 @@ async def generate_invoice_pdf(order_id: str):
         # Try to generate invoice first
         invoice = await get_or_generate_invoice(order_id, None, None)
     
-    # Generate PDF
+    pdf_path = await render_invoice_file(render_tax_invoice, "invoice", invoice["invoice_id"], invoice)
     pdf_filename = f"invoice_{invoice['invoice_number'].replace('-', '_')}.pdf"
-    pdf_path = UPLOAD_DIR / pdf_filename
-    
-    # Create PDF
-    doc = SimpleDocTemplate(str(pdf_path), pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle('Title', parent=styles['Heading1'], fontSize=20, alignment=TA_CENTER, spaceAfter=20, textColor=colors.HexColor('#8B4513'))
-    header_style = ParagraphStyle('Header', parent=styles['Normal'], fontSize=10, alignment=TA_CENTER, textColor=colors.grey)
-    normal_style = ParagraphStyle('Normal', parent=styles['Normal'], fontSize=9)
-    bold_style = ParagraphStyle('Bold', parent=styles['Normal'], fontSize=9, fontName='Helvetica-Bold')
-    right_style = ParagraphStyle('Right', parent=styles['Normal'], fontSize=9, alignment=TA_RIGHT)
-    
-    # Header - Tax Invoice
-    elements.append(Paragraph("TAX INVOICE", title_style))
-    elements.append(Spacer(1, 10))
-    
-    # Invoice details row
-    invoice_info = [
-        [Paragraph(f"<b>Invoice No:</b> {invoice['invoice_number']}", normal_style),
-         Paragraph(f"<b>Invoice Date:</b> {invoice['invoice_date'][:10]}", right_style)],
-        [Paragraph(f"<b>Order ID:</b> {invoice['order_id']}", normal_style),
-         Paragraph(f"<b>Order Date:</b> {invoice['order_date'][:10]}", right_style)]
-    ]
-    invoice_table = Table(invoice_info, colWidths=[280, 250])
-    invoice_table.setStyle(TableStyle([
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-    ]))
-    elements.append(invoice_table)
-    elements.append(Spacer(1, 15))
-    
-    # Seller and Buyer Details
-    seller_buyer_data = [
-        [Paragraph("<b>SELLER DETAILS</b>", bold_style), Paragraph("<b>BUYER DETAILS</b>", bold_style)],
-        [Paragraph(f"<b>{invoice['seller_name']}</b>", normal_style), 
-         Paragraph(f"<b>{invoice['buyer_name']}</b>", normal_style)],
-        [Paragraph(f"GSTIN: {invoice['seller_gstin']}", normal_style),
-         Paragraph(f"GSTIN: {invoice.get('buyer_gstin') or 'N/A'}", normal_style)],
-        [Paragraph(f"{invoice['seller_address']}", normal_style),
-         Paragraph(f"{invoice['buyer_address']}", normal_style)],
-        [Paragraph(f"State: {invoice['seller_state']} ({invoice['seller_state_code']})", normal_style),
-         Paragraph(f"State: {invoice['buyer_state']} ({invoice['buyer_state_code']})", normal_style)],
-        [Paragraph(f"Phone: {invoice.get('seller_phone') or ''}", normal_style),
-         Paragraph(f"Phone: {invoice.get('buyer_phone') or ''}", normal_style)],
-    ]
-    
-    seller_buyer_table = Table(seller_buyer_data, colWidths=[265, 265])
-    seller_buyer_table.setStyle(TableStyle([
-        ('BOX', (0, 0), (-1, -1), 1, colors.black),
-        ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#f5f5f5')),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('PADDING', (0, 0), (-1, -1), 8),
-    ]))
-    elements.append(seller_buyer_table)
-    elements.append(Spacer(1, 15))
-    
-    # Items table header
-    is_inter_state = invoice.get("is_inter_state", False)
-    if is_inter_state:
-        items_header = ['S.No', 'Item Description', 'HSN', 'Qty', 'Rate', 'Taxable', 'IGST%', 'IGST', 'Total']
-        col_widths = [30, 130, 50, 35, 50, 55, 40, 45, 55]
-    else:
-        items_header = ['S.No', 'Item Description', 'HSN', 'Qty', 'Rate', 'Taxable', 'CGST%', 'CGST', 'SGST', 'Total']
-        col_widths = [25, 115, 45, 30, 45, 50, 35, 40, 40, 50]
-    
-    items_data = [items_header]
-    
-    for idx, item in enumerate(invoice['items'], 1):
-        if is_inter_state:
-            row = [
-                str(idx),
-                item['product_name'][:30],
-                item.get('hsn_code', ''),
-                str(item['quantity']),
-                f"₹{item['unit_price']:.2f}",
-                f"₹{item['taxable_amount']:.2f}",
-                f"{item['gst_rate']}%",
-                f"₹{item['igst']:.2f}",
-                f"₹{item['total']:.2f}"
-            ]
-        else:
-            row = [
-                str(idx),
-                item['product_name'][:25],
-                item.get('hsn_code', ''),
-                str(item['quantity']),
-                f"₹{item['unit_price']:.2f}",
-                f"₹{item['taxable_amount']:.2f}",
-                f"{item['gst_rate']/2}%",
-                f"₹{item['cgst']:.2f}",
-                f"₹{item['sgst']:.2f}",
-                f"₹{item['total']:.2f}"
-            ]
-        items_data.append(row)
-    
-    items_table = Table(items_data, colWidths=col_widths)
-    items_table.setStyle(TableStyle([
-        ('BOX', (0, 0), (-1, -1), 1, colors.black),
-        ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#8B4513')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('FONTSIZE', (0, 0), (-1, -1), 8),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('ALIGN', (1, 1), (1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('PADDING', (0, 0), (-1, -1), 5),
-    ]))
-    elements.append(items_table)
-    elements.append(Spacer(1, 15))
-    
-    # Summary table
-    summary_data = [
-        ['Subtotal:', f"₹{invoice['subtotal']:.2f}"],
-    ]
-    if invoice.get('discount', 0) > 0:
-        summary_data.append(['Discount:', f"-₹{invoice['discount']:.2f}"])
-    summary_data.append(['Taxable Amount:', f"₹{invoice['taxable_amount']:.2f}"])
-    
-    if is_inter_state:
-        summary_data.append([f"IGST:", f"₹{invoice['igst_amount']:.2f}"])
-    else:
-        summary_data.append([f"CGST:", f"₹{invoice['cgst_amount']:.2f}"])
-        summary_data.append([f"SGST:", f"₹{invoice['sgst_amount']:.2f}"])
-    
-    summary_data.append(['Total GST:', f"₹{invoice['total_gst']:.2f}"])
-    summary_data.append(['', ''])
-    summary_data.append([Paragraph('<b>GRAND TOTAL:</b>', bold_style), Paragraph(f"<b>₹{invoice['grand_total']:.2f}</b>", bold_style)])
-    
-    summary_table = Table(summary_data, colWidths=[380, 150])
-    summary_table.setStyle(TableStyle([
-        ('ALIGN', (0, 0), (0, -1), 'RIGHT'),
-        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
-        ('LINEABOVE', (0, -1), (-1, -1), 1, colors.black),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('PADDING', (0, 0), (-1, -1), 5),
-    ]))
-    elements.append(summary_table)
-    elements.append(Spacer(1, 10))
-    
-    # Amount in words
-    elements.append(Paragraph(f"<b>Amount in Words:</b> {invoice['amount_in_words']}", normal_style))
-    elements.append(Spacer(1, 20))
-    
-    # Bank Details & Signature
-    if invoice.get('bank_name'):
-        bank_data = [
-            [Paragraph("<b>Bank Details:</b>", bold_style), '', Paragraph("<b>For Paridhaan Creations</b>", bold_style)],
-            [f"Bank: {invoice.get('bank_name', '')}", '', ''],
-            [f"A/C No: {invoice.get('bank_account_number', '')}", '', ''],
-            [f"IFSC: {invoice.get('bank_ifsc', '')}", '', ''],
-            ['', '', Paragraph("<b>Authorized Signatory</b>", normal_style)],
-        ]
-    else:
-        bank_data = [
-            ['', '', Paragraph("<b>For Paridhaan Creations</b>", bold_style)],
-            ['', '', ''],
-            ['', '', ''],
-            ['', '', Paragraph("<b>Authorized Signatory</b>", normal_style)],
-        ]
-    
-    bank_table = Table(bank_data, colWidths=[200, 130, 200])
-    bank_table.setStyle(TableStyle([
-        ('ALIGN', (2, 0), (2, -1), 'CENTER'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-    ]))
-    elements.append(bank_table)
-    elements.append(Spacer(1, 20))
-    
-    # Footer
-    if invoice.get('invoice_footer_text'):
-        elements.append(Paragraph(f"<i>{invoice['invoice_footer_text']}</i>", header_style))
-    
-    elements.append(Paragraph("This is a computer generated invoice and does not require a physical signature.", header_style))
-    
-    # Build PDF
-    doc.build(elements)
-    
-    # Update invoice with PDF path
-    await db.invoices.update_one(
-        {"order_id": order_id},
-        {"$set": {"pdf_path": f"/api/uploads/{pdf_filename}"}}
-    )
+
+    # Only touch the document when a new render replaced the previous file
+    if invoice.get("pdf_path") != f"/api/uploads/{pdf_path.name}":
+        await db.invoices.update_one(
+            {"order_id": order_id},
+            {"$set": {"pdf_path": f"/api/uploads/{pdf_path.name}"}}
+        )
     
     return FileResponse(
         pdf_path,
         media_type="application/pdf",
-        filename=pdf_filename,
-        headers={"Content-Disposition": f"attachment; filename={pdf_filename}"}
+        filename=pdf_filename
     )
 
 @api_router.get("/admin/invoices")
@@ -3412,6 +4165,175 @@ async def list_invoices(authorization: Optional[str] = Header(None), session_tok
     
     return {"invoices": invoices, "total": total}
 
+INVOICE_EXPORT_MAX_ORDERS = 5000
+
+async def generate_missing_invoices(orders: List[Dict]) -> List[Dict]:
+    """Invoices for every eligible order, creating the missing ones in one batched pass"""
+    eligible = [order for order in orders if is_invoice_eligible(order)]
+    order_ids = [order["order_id"] for order in eligible]
+    existing = await db.invoices.find({"order_id": {"$in": order_ids}}, {"_id": 0}).to_list(len(order_ids) or 1)
+    invoices_by_order = {invoice["order_id"]: invoice for invoice in existing}
+
+    missing = [order for order in eligible if order["order_id"] not in invoices_by_order]
+    if missing:
+        gst_settings = await db.gst_settings.find_one({"setting_id": "gst_settings"}, {"_id": 0}) or DEFAULT_INVOICE_GST_SETTINGS
+        gst_calcs = await gst_engine.calculate_many(
+            [(order["items"], order["shipping_address"]["state"]) for order in missing], gst_settings
+        )
+        invoice_numbers = await generate_invoice_numbers(len(missing))
+
+        new_invoices = []
+        order_updates = []
+        for order, gst_calc, invoice_number in zip(missing, gst_calcs, invoice_numbers):
+            invoice = build_invoice(order, gst_settings, gst_calc, invoice_number)
+            new_invoices.append(invoice)
+            order_updates.append(UpdateOne({"order_id": order["order_id"]}, {"$set": invoice_order_update(invoice, gst_calc)}))
+
+        try:
+            await db.invoices.insert_many(new_invoices, ordered=False)
+        except BulkWriteError as e:
+            # Another request invoiced some of these orders meanwhile; keep theirs
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            logging.error(f"Bulk invoice insert skipped {len(failed)} documents")
+            raced_ids = [new_invoices[i]["order_id"] for i in failed]
+            new_invoices = [invoice for i, invoice in enumerate(new_invoices) if i not in failed]
+            order_updates = [update for i, update in enumerate(order_updates) if i not in failed]
+            raced = await db.invoices.find({"order_id": {"$in": raced_ids}}, {"_id": 0}).to_list(len(raced_ids))
+            invoices_by_order.update({invoice["order_id"]: invoice for invoice in raced})
+
+        if order_updates:
+            await db.orders.bulk_write(order_updates, ordered=False)
+        for invoice in new_invoices:
+            invoice.pop("_id", None)
+            invoices_by_order[invoice["order_id"]] = invoice
+
+    return [invoices_by_order[order_id] for order_id in order_ids if order_id in invoices_by_order]
+
+async def stream_invoice_zip(invoices: List[Dict], notice: Optional[str] = None):
+    """Render invoices in parallel and yield ZIP bytes as each PDF is ready; notice is added as NOTICE.txt"""
+    zip_stream = ZipStream()
+    archive = zipfile.ZipFile(zip_stream, mode="w", compression=zipfile.ZIP_STORED)
+    # Leave spare render slots for interactive downloads while an export runs
+    slots = asyncio.Semaphore(invoice_renderer.max_workers)
+    errors = []
+
+    async def render(invoice):
+        async with slots:
+            try:
+                return invoice, await invoice_renderer.render(render_tax_invoice, "invoice", invoice["invoice_id"], invoice)
+            except Exception as e:
+                logging.error(f"Invoice export failed for {invoice['invoice_number']}: {str(e)}")
+                errors.append(f"{invoice['invoice_number']} ({invoice['order_id']}): {str(e)}")
+                return invoice, None
+
+    tasks = [asyncio.create_task(render(invoice)) for invoice in invoices]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            invoice, pdf_path = await next_done
+            if pdf_path is None:
+                continue
+            archive.write(pdf_path, arcname=f"{invoice['invoice_number']}.pdf")
+            yield zip_stream.drain()
+
+        if errors:
+            archive.writestr("errors.txt", "\n".join(errors))
+        if notice:
+            archive.writestr("NOTICE.txt", notice)
+        archive.close()
+        yield zip_stream.drain()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+@api_router.get("/admin/invoices/export")
+async def export_invoices(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    status: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """Generate missing invoices for matching orders and download their PDFs as a ZIP (admin only).
+    At most INVOICE_EXPORT_MAX_ORDERS orders per ZIP, oldest first; when more match, the
+    X-Next-Cursor header is set and passing it as ?cursor= downloads the next part."""
+    await require_admin(authorization, session_token)
+
+    query = {}
+    if start_date or end_date:
+        try:
+            created_at = {}
+            if start_date:
+                created_at["$gte"] = datetime.strptime(start_date, "%Y-%m-%d").date().isoformat()
+            if end_date:
+                # end_date is inclusive; created_at is an ISO string
+                created_at["$lt"] = (datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)).date().isoformat()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+        query["created_at"] = created_at
+    if status:
+        query["status"] = status
+    if payment_status:
+        query["payment_status"] = payment_status
+    if not query:
+        raise HTTPException(status_code=400, detail="Provide a date range or status filter")
+    if cursor:
+        try:
+            query = {"$and": [query, keyset_filter(cursor, "order_id", ascending=True)]}
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    orders = await db.orders.find(query, {"_id": 0}).sort(
+        [("created_at", 1), ("order_id", 1)]
+    ).limit(INVOICE_EXPORT_MAX_ORDERS + 1).to_list(INVOICE_EXPORT_MAX_ORDERS + 1)
+    next_cursor = None
+    if len(orders) > INVOICE_EXPORT_MAX_ORDERS:
+        orders = orders[:INVOICE_EXPORT_MAX_ORDERS]
+        next_cursor = cursor_for(orders[-1], "order_id")
+    invoices = await generate_missing_invoices(orders)
+    if not invoices and not next_cursor:
+        raise HTTPException(status_code=404, detail="No invoiceable orders match the filter")
+
+    filename = f"invoices_{start_date or 'all'}_{end_date or 'all'}.zip"
+    headers = {"Content-Disposition": f"attachment; filename={filename}", "X-Export-Orders": str(len(orders))}
+    notice = None
+    if next_cursor:
+        # More orders match than one ZIP holds; the client fetches the rest with ?cursor=
+        headers["X-Next-Cursor"] = next_cursor
+        notice = (
+            f"This export stops after {INVOICE_EXPORT_MAX_ORDERS} orders (last: {orders[-1]['order_id']}).\n"
+            f"Download the rest with the same filters and cursor={next_cursor}\n"
+        )
+    return StreamingResponse(stream_invoice_zip(invoices, notice), media_type="application/zip", headers=headers)
+
+GST_BULK_MAX_ORDERS = 10000
+
+@api_router.post("/admin/gst/calculate")
+async def calculate_gst_bulk(request: BulkGSTRequest, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """GST breakdown for many orders in one call (admin only)"""
+    await require_admin(authorization, session_token)
+    
+    order_ids = list(dict.fromkeys(request.order_ids))
+    if len(order_ids) > GST_BULK_MAX_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {GST_BULK_MAX_ORDERS} orders per request")
+    
+    orders = await db.orders.find(
+        {"order_id": {"$in": order_ids}},
+        {"_id": 0, "order_id": 1, "items": 1, "shipping_address.state": 1}
+    ).to_list(len(order_ids) or 1)
+    gst_settings = await db.gst_settings.find_one({"setting_id": "gst_settings"}, {"_id": 0}) or DEFAULT_INVOICE_GST_SETTINGS
+    
+    gst_calcs = await gst_engine.calculate_many(
+        [(order["items"], order["shipping_address"]["state"]) for order in orders], gst_settings
+    )
+    results = {order["order_id"]: gst_calc for order, gst_calc in zip(orders, gst_calcs)}
+    
+    return {
+        "results": results,
+        "not_found": [order_id for order_id in order_ids if order_id not in results]
+    }
+
 # Update product GST
 @api_router.put("/admin/products/{product_id}/gst")
 async def update_product_gst(product_id: str, gst_rate: Optional[float] = None, hsn_code: Optional[str] = None, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
@@ -3460,6 +4382,7 @@ async def update_category_gst(category_id: str, gst_rate: Optional[float] = None
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    await publish_cache_invalidation("gst_categories", category_id)
     
     category = await db.categories.find_one({"category_id": category_id}, {"_id": 0})
     return category
@@ -3477,6 +4400,39 @@ async def get_shiprocket_pickup_locations(authorization: Optional[str] = Header(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# Default pickup pincode from business address (Tijara, Rajasthan)
+PICKUP_PINCODE = os.environ.get('SHIPROCKET_PICKUP_PINCODE', '301411')
+COURIER_PREWARM_INTERVAL_SECONDS = int(os.environ.get('COURIER_PREWARM_INTERVAL_SECONDS', '0'))  # 0 = no scheduled pre-warm
+
+async def fetch_courier_quotes(pickup_pincode: str, delivery_pincode: str, weight: float, cod: int) -> List[Dict]:
+    couriers = await ShiprocketService.get_available_couriers(
+        pickup_pincode=pickup_pincode,
+        delivery_pincode=delivery_pincode,
+        weight=weight,
+        cod=cod
+    )
+    
+    # Format courier data
+    formatted_couriers = []
+    for c in couriers[:10]:  # Top 10 couriers
+        formatted_couriers.append({
+            "courier_id": c.get("courier_company_id"),
+            "courier_name": c.get("courier_name"),
+            "rate": c.get("rate"),
+            "etd": c.get("etd"),  # Estimated Time of Delivery
+            "rating": c.get("rating"),
+            "min_weight": c.get("min_weight"),
+            "charge_weight": c.get("charge_weight")
+        })
+    return formatted_couriers
+
+courier_quotes = CourierQuoteCache(
+    db,
+    fetch=fetch_courier_quotes,
+    fresh_hours=float(os.environ.get('COURIER_QUOTE_FRESH_HOURS', '6')),
+    max_age_hours=float(os.environ.get('COURIER_QUOTE_MAX_AGE_HOURS', '48'))
+)
+
 @api_router.get("/shiprocket/couriers")
 async def get_available_couriers(
     delivery_pincode: str,
@@ -3485,39 +4441,82 @@ async def get_available_couriers(
     session_token: Optional[str] = Cookie(None)
 ):
     """Get available courier services with rates"""
-    # Default pickup pincode from business address (Tijara, Rajasthan)
-    pickup_pincode = "301411"
-    
     try:
-        couriers = await ShiprocketService.get_available_couriers(
-            pickup_pincode=pickup_pincode,
-            delivery_pincode=delivery_pincode,
-            weight=weight,
-            cod=0  # Prepaid only
-        )
-        
-        # Format courier data
-        formatted_couriers = []
-        for c in couriers[:10]:  # Top 10 couriers
-            formatted_couriers.append({
-                "courier_id": c.get("courier_company_id"),
-                "courier_name": c.get("courier_name"),
-                "rate": c.get("rate"),
-                "etd": c.get("etd"),  # Estimated Time of Delivery
-                "rating": c.get("rating"),
-                "min_weight": c.get("min_weight"),
-                "charge_weight": c.get("charge_weight")
-            })
+        quote = await courier_quotes.get(PICKUP_PINCODE, delivery_pincode, weight, cod=0)  # Prepaid only
         
         return {
             "success": True,
-            "couriers": formatted_couriers,
-            "pickup_pincode": pickup_pincode,
-            "delivery_pincode": delivery_pincode
+            "couriers": quote["couriers"],
+            "pickup_pincode": PICKUP_PINCODE,
+            "delivery_pincode": delivery_pincode,
+            "quoted_at": quote["fetched_at"].isoformat()
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@api_router.get("/admin/shipping/courier-quotes")
+async def get_courier_quote_cache(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Courier quote cache counters"""
+    await require_admin(authorization, session_token)
+    return {
+        "prewarm_interval_seconds": COURIER_PREWARM_INTERVAL_SECONDS,
+        "stored_quotes": await db.courier_quotes.estimated_document_count(),
+        **courier_quotes.stats()
+    }
+
+@api_router.post("/admin/shipping/courier-quotes/prewarm")
+async def prewarm_courier_quotes(limit: int = 50, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Fetch quotes for the most-ordered delivery pincodes now"""
+    await require_admin(authorization, session_token)
+    return await courier_quotes.prewarm(PICKUP_PINCODE, limit=min(max(limit, 1), 500))
+
+DISPATCH_CLAIM_SECONDS = 300
+
+async def claim_order_dispatch(order_id: str) -> bool:
+    """Mark an order as being dispatched; False if another request is already on it.
+    The claim expires after DISPATCH_CLAIM_SECONDS in case its holder died."""
+    now = datetime.now(timezone.utc)
+    result = await db.orders.update_one(
+        {"order_id": order_id, "dispatching_until": {"$not": {"$gt": now}}},
+        {"$set": {"dispatching_until": now + timedelta(seconds=DISPATCH_CLAIM_SECONDS)}}
+    )
+    return result.modified_count == 1
+
+async def release_order_dispatch(order_id: str):
+    await db.orders.update_one({"order_id": order_id}, {"$unset": {"dispatching_until": ""}})
+
+async def create_shipment_record(order: Dict) -> Tuple[Dict, Dict]:
+    """Create the Shiprocket order and our shipment record; returns (shipment, Shiprocket response)"""
+    order_id = order["order_id"]
+    sr_response = await ShiprocketService.create_shiprocket_order(order)
+    
+    # Create shipment record
+    shipment = {
+        "shipment_id": f"ship_{uuid.uuid4().hex[:12]}",
+        "order_id": order_id,
+        "shiprocket_order_id": sr_response.get("order_id"),
+        "shiprocket_shipment_id": sr_response.get("shipment_id"),
+        "status": "processing",
+        "tracking_history": [{
+            "status": "Order created in Shiprocket",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "location": "Tijara, Rajasthan"
+        }],
+        "created_at": datetime.now(timezone.utc),
+        "updated_at": datetime.now(timezone.utc)
+    }
+    
+    await db.shipments.insert_one(shipment)
+    
+    # Update order status
+    await db.orders.update_one(
+        {"order_id": order_id},
+        {"$set": {"status": "processing", "shiprocket_order_id": sr_response.get("order_id")}}
+    )
+    
+    shipment.pop("_id", None)
+    return shipment, sr_response
+
 @api_router.post("/shiprocket/create-shipment/{order_id}")
 async def create_shiprocket_shipment(
     order_id: str,
@@ -3533,52 +4532,81 @@ async def create_shiprocket_shipment(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Check if shipment already exists
-    existing_shipment = await db.shipments.find_one({"order_id": order_id}, {"_id": 0})
-    if existing_shipment and existing_shipment.get("shiprocket_order_id"):
-        return {
-            "success": True,
-            "message": "Shipment already exists",
-            "shipment": existing_shipment
-        }
+    if not await claim_order_dispatch(order_id):
+        raise HTTPException(status_code=409, detail="Order is being dispatched by another request")
     
     try:
-        # Create order in Shiprocket
-        sr_response = await ShiprocketService.create_shiprocket_order(order)
-        
-        # Create shipment record
-        shipment = {
-            "shipment_id": f"ship_{uuid.uuid4().hex[:12]}",
-            "order_id": order_id,
-            "shiprocket_order_id": sr_response.get("order_id"),
-            "shiprocket_shipment_id": sr_response.get("shipment_id"),
-            "status": "processing",
-            "tracking_history": [{
-                "status": "Order created in Shiprocket",
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "location": "Tijara, Rajasthan"
-            }],
-            "created_at": datetime.now(timezone.utc),
-            "updated_at": datetime.now(timezone.utc)
-        }
-        
-        await db.shipments.insert_one(shipment)
-        
-        # Update order status
-        await db.orders.update_one(
-            {"order_id": order_id},
-            {"$set": {"status": "processing", "shiprocket_order_id": sr_response.get("order_id")}}
-        )
+        # Check if shipment already exists
+        existing_shipment = await db.shipments.find_one({"order_id": order_id}, {"_id": 0})
+        if existing_shipment and existing_shipment.get("shiprocket_order_id"):
+            return {
+                "success": True,
+                "message": "Shipment already exists",
+                "shipment": existing_shipment
+            }
         
-        shipment.pop("_id", None)
+        shipment, sr_response = await create_shipment_record(order)
         return {
             "success": True,
             "message": "Shipment created successfully",
             "shipment": shipment,
             "shiprocket_response": sr_response
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await release_order_dispatch(order_id)
+
+async def record_courier_assignment(order_id: str, courier_id: int, awb_data: Dict, label_url: Optional[str]):
+    """Store the AWB on the shipment and mark the order shipped"""
+    update_data = {
+        "courier_id": courier_id,
+        "courier_name": awb_data.get("courier_name", ""),
+        "awb_number": awb_data.get("awb_code", ""),
+        "shipping_rate": awb_data.get("freight_charge", 0),
+        "status": "shipped",
+        "tracking_url": f"https://shiprocket.co/tracking/{awb_data.get('awb_code', '')}",
+        "updated_at": datetime.now(timezone.utc)
+    }
+    if label_url is not None:
+        update_data["label_url"] = label_url
+    
+    await db.shipments.update_one(
+        {"order_id": order_id},
+        {
+            "$set": update_data,
+            # Add tracking history
+            "$push": {
+                "tracking_history": {
+                    "status": f"Courier assigned: {awb_data.get('courier_name', '')}",
+                    "awb": awb_data.get("awb_code", ""),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "location": "Tijara, Rajasthan"
+                }
+            }
+        }
+    )
+    
+    # Update order status
+    await db.orders.update_one(
+        {"order_id": order_id},
+        {"$set": {"status": "shipped"}}
+    )
+
+def order_tracking_url(order_id: str) -> str:
+    site_url = os.environ.get("SITE_URL", "https://paridhaancreations.xyz")
+    return f"{site_url}/track/{order_id}"
+
+async def notify_order_shipped(order_id: str):
+    """Queue the "shipped" email and SMS with the tracking link"""
+    order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
+    if order:
+        await queue_order_notifications(
+            order, "shipped", email_type="shipped", sms_status="shipped", whatsapp_type="shipped",
+            tracking_url=order_tracking_url(order_id)
+        )
 
 @api_router.post("/shiprocket/assign-courier/{order_id}")
 async def assign_courier_to_shipment(
@@ -3590,6 +4618,14 @@ async def assign_courier_to_shipment(
     """Assign courier and generate AWB for a shipment (admin only)"""
     await require_admin(authorization, session_token)
     
+    if not await claim_order_dispatch(order_id):
+        raise HTTPException(status_code=409, detail="Order is being dispatched by another request")
+    try:
+        return await assign_courier(order_id, courier_id)
+    finally:
+        await release_order_dispatch(order_id)
+
+async def assign_courier(order_id: str, courier_id: int) -> Dict:
     # Get shipment
     shipment = await db.shipments.find_one({"order_id": order_id}, {"_id": 0})
     if not shipment:
@@ -3610,51 +4646,8 @@ async def assign_courier_to_shipment(
         # Generate label
         label_response = await ShiprocketService.generate_label(shipment["shiprocket_shipment_id"])
         
-        # Site URL for tracking
-        site_url = os.environ.get("SITE_URL", "https://paridhaancreations.xyz")
-        tracking_url = f"{site_url}/track/{order_id}"
-        
-        # Update shipment record
-        update_data = {
-            "courier_id": courier_id,
-            "courier_name": awb_data.get("courier_name", ""),
-            "awb_number": awb_data.get("awb_code", ""),
-            "shipping_rate": awb_data.get("freight_charge", 0),
-            "status": "shipped",
-            "label_url": label_response.get("label_url", ""),
-            "tracking_url": f"https://shiprocket.co/tracking/{awb_data.get('awb_code', '')}",
-            "updated_at": datetime.now(timezone.utc)
-        }
-        
-        # Add tracking history
-        update_data["$push"] = {
-            "tracking_history": {
-                "status": f"Courier assigned: {awb_data.get('courier_name', '')}",
-                "awb": awb_data.get("awb_code", ""),
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "location": "Tijara, Rajasthan"
-            }
-        }
-        
-        await db.shipments.update_one(
-            {"order_id": order_id},
-            {"$set": {k: v for k, v in update_data.items() if k != "$push"}, "$push": update_data.get("$push", {})}
-        )
-        
-        # Update order status
-        await db.orders.update_one(
-            {"order_id": order_id},
-            {"$set": {"status": "shipped"}}
-        )
-        
-        # Send "shipped" email with tracking link
-        order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
-        if order:
-            await send_order_email(order, "shipped", tracking_url)
-            
-            # Also send SMS if phone available
-            if order.get("shipping_address", {}).get("phone"):
-                await send_order_notification(order_id, order["shipping_address"]["phone"], "shipped", tracking_url)
+        await record_courier_assignment(order_id, courier_id, awb_data, label_response.get("label_url", ""))
+        await notify_order_shipped(order_id)
         
         return {
             "success": True,
@@ -3662,11 +4655,219 @@ async def assign_courier_to_shipment(
             "awb_number": awb_data.get("awb_code"),
             "courier_name": awb_data.get("courier_name"),
             "label_url": label_response.get("label_url"),
-            "tracking_url": tracking_url
+            "tracking_url": order_tracking_url(order_id)
         }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# ============ BULK DISPATCH ============
+# Create + assign for many orders at once. Orders run concurrently behind a
+# semaphore (kept below the Shiprocket connection pool size); each takes the
+# cheapest courier from the quote cache. One pickup request, one merged label
+# and one manifest cover the whole batch. The batch runs as a task and records
+# its progress in shipment_batches; the response streams the same results as
+# NDJSON, one line per order as it finishes and a summary line last. Closing
+# the stream does not stop the batch.
+
+BULK_SHIPMENT_MAX_ORDERS = 500
+BULK_SHIPMENT_CONCURRENCY = int(os.environ.get('BULK_SHIPMENT_CONCURRENCY', '8'))
+
+# Running batches; held so they are not garbage collected once the stream is gone
+bulk_dispatch_tasks: set = set()
+
+class BulkShipmentRequest(BaseModel):
+    order_ids: Optional[List[str]] = None
+    # Used when order_ids is not given: paid orders in these statuses
+    statuses: List[str] = ["confirmed", "processing"]
+    courier_id: Optional[int] = None  # None = cheapest serviceable courier per order
+    schedule_pickup: bool = True
+
+def parcel_weight(order: Dict) -> float:
+    # Same estimate create_shiprocket_order sends: 500g per unit by default, minimum 500g
+    return max(0.5, sum(item.get("weight", 0.5) * item.get("quantity", 1) for item in order.get("items", [])))
+
+async def dispatch_order(order: Dict, courier_id: Optional[int]) -> Dict:
+    """Create (if needed) and assign one order; returns its result line"""
+    order_id = order["order_id"]
+    if not await claim_order_dispatch(order_id):
+        return {"order_id": order_id, "status": "skipped", "reason": "Being dispatched by another request"}
+    try:
+        # Read after claiming: another request may have shipped it since the batch was loaded
+        shipment = await db.shipments.find_one({"order_id": order_id}, {"_id": 0})
+        if shipment and shipment.get("awb_number"):
+            return {"order_id": order_id, "status": "skipped", "reason": "AWB already assigned", "awb_number": shipment["awb_number"],
+                    "shiprocket_shipment_id": shipment.get("shiprocket_shipment_id")}
+        
+        if not shipment or not shipment.get("shiprocket_order_id"):
+            shipment, _ = await create_shipment_record(order)
+        
+        rate = None
+        if courier_id is None:
+            pincode = order.get("shipping_address", {}).get("pincode", "")
+            quote = await courier_quotes.get(PICKUP_PINCODE, pincode, parcel_weight(order), cod=0)
+            if not quote["couriers"]:
+                return {"order_id": order_id, "status": "failed", "error": f"No courier serves pincode {pincode}"}
+            cheapest = min(quote["couriers"], key=lambda c: c.get("rate") or float("inf"))
+            courier_id, rate = cheapest["courier_id"], cheapest.get("rate")
+        
+        awb_response = await ShiprocketService.assign_awb(shipment_id=shipment["shiprocket_shipment_id"], courier_id=courier_id)
+        awb_data = awb_response.get("response", {}).get("data", {})
+        if not awb_data.get("awb_code"):
+            return {"order_id": order_id, "status": "failed", "error": f"No AWB returned: {str(awb_response)[:200]}"}
+        
+        # Label comes from the merged batch label
+        await record_courier_assignment(order_id, courier_id, awb_data, None)
+        return {
+            "order_id": order_id,
+            "status": "assigned",
+            "awb_number": awb_data.get("awb_code"),
+            "courier_id": courier_id,
+            "courier_name": awb_data.get("courier_name"),
+            "rate": rate,
+            "shiprocket_shipment_id": shipment["shiprocket_shipment_id"]
+        }
+    finally:
+        await release_order_dispatch(order_id)
+
+async def run_bulk_dispatch(batch_id: str, orders: List[Dict], request: BulkShipmentRequest, lines: asyncio.Queue):
+    """Dispatch the batch, recording each result in shipment_batches and putting it on lines"""
+    semaphore = asyncio.Semaphore(BULK_SHIPMENT_CONCURRENCY)
+    
+    async def run(order: Dict) -> Dict:
+        async with semaphore:
+            try:
+                result = await dispatch_order(order, request.courier_id)
+            except Exception as e:
+                result = {"order_id": order["order_id"], "status": "failed", "error": str(e)}
+        if result["status"] == "assigned":
+            # Notifications run outside the semaphore so they don't hold up Shiprocket calls
+            try:
+                await notify_order_shipped(order["order_id"])
+            except Exception as e:
+                logging.error(f"Shipped notification failed for {order['order_id']}: {str(e)}")
+        return result
+    
+    started = time.monotonic()
+    counts = {"assigned": 0, "skipped": 0, "failed": 0}
+    assigned_shipment_ids = []
+    summary = {"orders": len(orders)}
+    try:
+        for next_done in asyncio.as_completed([run(order) for order in orders]):
+            result = await next_done
+            counts[result["status"]] += 1
+            if result["status"] == "assigned":
+                assigned_shipment_ids.append(result["shiprocket_shipment_id"])
+            await db.shipment_batches.update_one(
+                {"_id": batch_id}, {"$push": {"results": result}, "$inc": {f"counts.{result['status']}": 1}}
+            )
+            lines.put_nowait(result)
+        
+        summary.update(counts)
+        if assigned_shipment_ids:
+            order_ids = [o["order_id"] for o in orders]
+            if request.schedule_pickup:
+                try:
+                    summary["pickup"] = await ShiprocketService.schedule_pickup(assigned_shipment_ids)
+                except Exception as e:
+                    summary["pickup_error"] = str(e)
+            try:
+                label = await ShiprocketService.generate_label(assigned_shipment_ids)
+                summary["label_url"] = label.get("label_url")
+            except Exception as e:
+                summary["label_error"] = str(e)
+            try:
+                manifest = await ShiprocketService.generate_manifest(assigned_shipment_ids)
+                summary["manifest_url"] = manifest.get("manifest_url")
+            except Exception as e:
+                summary["manifest_error"] = str(e)
+            documents = {k: summary[k] for k in ["label_url", "manifest_url"] if summary.get(k)}
+            if documents:
+                await db.shipments.update_many(
+                    {"order_id": {"$in": order_ids}, "shiprocket_shipment_id": {"$in": assigned_shipment_ids}},
+                    {"$set": documents}
+                )
+        summary["duration_seconds"] = round(time.monotonic() - started, 2)
+        await db.shipment_batches.update_one(
+            {"_id": batch_id},
+            {"$set": {"status": "completed", "summary": summary, "completed_at": datetime.now(timezone.utc)}}
+        )
+    except BaseException as e:
+        # Cancelled at shutdown or a database error: leave a record of where the batch stopped
+        summary.update(counts)
+        summary["error"] = str(e) or type(e).__name__
+        await asyncio.shield(db.shipment_batches.update_one(
+            {"_id": batch_id},
+            {"$set": {"status": "interrupted", "summary": summary, "completed_at": datetime.now(timezone.utc)}}
+        ))
+        raise
+    finally:
+        lines.put_nowait({"summary": summary})
+
+async def stream_bulk_dispatch(lines: asyncio.Queue):
+    while True:
+        line = await lines.get()
+        yield json.dumps(line, default=str) + "\n"
+        if "summary" in line:
+            return
+
+@api_router.post("/admin/shipments/bulk")
+async def bulk_dispatch_shipments(
+    request: BulkShipmentRequest,
+    authorization: Optional[str] = Header(None),
+    session_token: Optional[str] = Cookie(None)
+):
+    """Create shipments and assign couriers for many orders; streams NDJSON results (admin only)"""
+    await require_admin(authorization, session_token)
+    
+    if request.order_ids:
+        order_ids = list(dict.fromkeys(request.order_ids))
+        if len(order_ids) > BULK_SHIPMENT_MAX_ORDERS:
+            raise HTTPException(status_code=400, detail=f"At most {BULK_SHIPMENT_MAX_ORDERS} orders per batch")
+        query = {"order_id": {"$in": order_ids}}
+    else:
+        query = {"payment_status": "paid", "status": {"$in": request.statuses}}
+    
+    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", 1).to_list(BULK_SHIPMENT_MAX_ORDERS)
+    if not orders:
+        raise HTTPException(status_code=404, detail="No orders to dispatch")
+    
+    batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+    await db.shipment_batches.insert_one({
+        "_id": batch_id,
+        "status": "running",
+        "order_ids": [o["order_id"] for o in orders],
+        "options": request.model_dump(exclude={"order_ids"}),
+        "counts": {},
+        "results": [],
+        "created_at": datetime.now(timezone.utc)
+    })
+    
+    lines: asyncio.Queue = asyncio.Queue()
+    task = asyncio.create_task(run_bulk_dispatch(batch_id, orders, request, lines))
+    bulk_dispatch_tasks.add(task)
+    task.add_done_callback(bulk_dispatch_tasks.discard)
+    
+    return StreamingResponse(stream_bulk_dispatch(lines), media_type="application/x-ndjson", headers={"X-Batch-Id": batch_id})
+
+@api_router.get("/admin/shipments/bulk/{batch_id}")
+async def get_bulk_dispatch(batch_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Progress and results of a bulk dispatch, also after its stream was closed"""
+    await require_admin(authorization, session_token)
+    batch = await db.shipment_batches.find_one({"_id": batch_id})
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    batch["batch_id"] = batch.pop("_id")
+    return batch
+
+TRACKING_POLL_INTERVAL_SECONDS = int(os.environ.get('TRACKING_POLL_INTERVAL_SECONDS', '1800'))  # 0 = webhook only
+
+shipment_tracker = ShipmentTracker(
+    db,
+    fetch=ShiprocketService.track_shipment,
+    ttl_seconds=float(os.environ.get('TRACKING_CACHE_SECONDS', '300')),
+    webhook_quiet_minutes=float(os.environ.get('TRACKING_WEBHOOK_QUIET_MINUTES', '120'))
+)
+
 @api_router.get("/shiprocket/track/{order_id}")
 async def track_shipment(order_id: str):
     """Track shipment by order ID (public - for customers)"""
@@ -3675,9 +4876,6 @@ async def track_shipment(order_id: str):
     if not shipment:
         raise HTTPException(status_code=404, detail="Shipment not found")
     
-    # Get order for customer details
-    order = await db.orders.find_one({"order_id": order_id}, {"_id": 0})
-    
     result = {
         "order_id": order_id,
         "status": shipment.get("status", "pending"),
@@ -3690,24 +4888,20 @@ async def track_shipment(order_id: str):
         "created_at": shipment.get("created_at")
     }
     
-    # If AWB exists, try to get live tracking from Shiprocket
+    # Live tracking is cached on the shipment; falls back to stored data if Shiprocket fails
     if shipment.get("awb_number"):
-        try:
-            live_tracking = await ShiprocketService.track_shipment(shipment["awb_number"])
-            tracking_data = live_tracking.get("tracking_data", {})
-            
-            result["live_tracking"] = {
-                "current_status": tracking_data.get("shipment_status_id"),
-                "current_status_text": tracking_data.get("shipment_status"),
-                "current_location": tracking_data.get("current_location"),
-                "delivered_date": tracking_data.get("delivered_date"),
-                "activities": tracking_data.get("shipment_track_activities", [])
-            }
-        except:
-            pass  # If live tracking fails, return stored data
+        live_tracking = await shipment_tracker.live_tracking(shipment)
+        if live_tracking:
+            result["live_tracking"] = live_tracking
     
     return result
 
+@api_router.get("/admin/shipping/tracking")
+async def get_tracking_cache_stats(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Live tracking cache counters and the last poll"""
+    await require_admin(authorization, session_token)
+    return {"poll_interval_seconds": TRACKING_POLL_INTERVAL_SECONDS, **shipment_tracker.stats()}
+
 @api_router.get("/shiprocket/track-awb/{awb_number}")
 async def track_by_awb(awb_number: str):
     """Track shipment by AWB number (public)"""
@@ -3717,76 +4911,80 @@ async def track_by_awb(awb_number: str):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+async def process_shiprocket_event(body: Dict):
+    """Apply one queued Shiprocket status webhook"""
+    awb_number = body["awb"]
+    status = body.get("current_status")
+    status_id = body.get("current_status_id")
+    location = body.get("scans", [{}])[-1].get("location", "") if body.get("scans") else ""
+    
+    # Find shipment by AWB
+    shipment = await db.shipments.find_one({"awb_number": awb_number})
+    if not shipment:
+        return  # Not shipped through this store
+    
+    await shipment_tracker.apply_status(shipment, status_id, status, location)
+
 @api_router.post("/shiprocket/webhook")
 async def shiprocket_webhook(request: Request):
-    """Webhook endpoint for Shiprocket status updates"""
+    """Webhook endpoint for Shiprocket status updates; queued and processed by the inbox workers"""
     try:
         body = await request.json()
         
         awb_number = body.get("awb")
-        status = body.get("current_status")
-        status_id = body.get("current_status_id")
-        location = body.get("scans", [{}])[-1].get("location", "") if body.get("scans") else ""
-        
         if not awb_number:
             return {"status": "ignored", "message": "No AWB number"}
         
-        # Find shipment by AWB
-        shipment = await db.shipments.find_one({"awb_number": awb_number})
-        if not shipment:
-            return {"status": "ignored", "message": "Shipment not found"}
-        
-        # Map Shiprocket status to our status
-        status_map = {
-            6: "shipped",
-            7: "in_transit",
-            8: "out_for_delivery",
-            9: "delivered",
-            10: "cancelled",
-            11: "rto_initiated",
-            12: "rto_delivered"
-        }
-        
-        new_status = status_map.get(status_id, shipment.get("status"))
-        
-        # Update shipment
-        await db.shipments.update_one(
-            {"awb_number": awb_number},
-            {
-                "$set": {
-                    "status": new_status,
-                    "updated_at": datetime.now(timezone.utc)
-                },
-                "$push": {
-                    "tracking_history": {
-                        "status": status,
-                        "status_id": status_id,
-                        "location": location,
-                        "timestamp": datetime.now(timezone.utc).isoformat()
-                    }
-                }
-            }
+        scans = body.get("scans") or [{}]
+        timestamp = body.get("current_timestamp") or scans[-1].get("date", "")
+        queued = await webhook_inbox.enqueue(
+            "shiprocket",
+            f"{awb_number}:{body.get('current_status_id')}:{timestamp}",
+            body,
+            ordering_key=awb_number
         )
         
-        # Update order status
-        order_status_map = {
-            "delivered": "delivered",
-            "cancelled": "cancelled",
-            "rto_initiated": "return_initiated",
-            "rto_delivered": "returned"
-        }
-        
-        if new_status in order_status_map:
-            await db.orders.update_one(
-                {"order_id": shipment["order_id"]},
-                {"$set": {"status": order_status_map[new_status]}}
-            )
-        
-        return {"status": "success", "message": "Webhook processed"}
+        return {"status": "success", "message": "Webhook queued" if queued else "Duplicate webhook"}
     except Exception as e:
         logging.error(f"Webhook error: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '2'))
+
+webhook_inbox = WebhookInbox(
+    db,
+    handlers={"shiprocket": process_shiprocket_event, "stripe": process_stripe_event},
+    max_attempts=int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '8'))
+)
+
+@api_router.get("/admin/webhooks/inbox")
+async def get_webhook_inbox(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Queued webhook counts by source and status, plus the latest dead events"""
+    await require_admin(authorization, session_token)
+    return await webhook_inbox.summary()
+
+@api_router.post("/admin/webhooks/inbox/{event_id}/retry")
+async def retry_webhook_event(event_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Requeue a webhook that exhausted its retries"""
+    await require_admin(authorization, session_token)
+    if not await webhook_inbox.retry(event_id):
+        raise HTTPException(status_code=404, detail="No dead webhook with that ID")
+    return {"message": "Webhook requeued"}
+
+@api_router.get("/admin/notifications/outbox")
+async def get_notification_outbox(authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Queued customer notification counts by channel and status, plus the latest failures"""
+    await require_admin(authorization, session_token)
+    return await notification_outbox.summary()
+
+@api_router.post("/admin/notifications/outbox/{message_id}/retry")
+async def retry_notification(message_id: str, authorization: Optional[str] = Header(None), session_token: Optional[str] = Cookie(None)):
+    """Requeue a notification that exhausted its retries"""
+    await require_admin(authorization, session_token)
+    if not await notification_outbox.retry(message_id):
+        raise HTTPException(status_code=404, detail="No failed notification with that ID")
+    return {"message": "Notification requeued"}
+
 @api_router.get("/admin/shipments")
 async def get_all_shipments(
     authorization: Optional[str] = Header(None),
@@ -3889,6 +5087,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+background_workers: List[asyncio.Task] = []
+
+@app.on_event("startup")
+async def start_background_workers():
+    await merge_duplicate_carts()
+    index_result = await ensure_indexes(db)
+    if index_result["required_failed"]:
+        # e.g. atomic add-to-cart without its unique indexes would create duplicate carts
+        raise RuntimeError(f"Required indexes could not be built: {index_result['required_failed']}")
+    await rebuild_product_search_index()
+    try:
+        # Awaited so the dashboard never reads empty rollups after a deploy
+        await backfill_revenue_rollups(db)
+    except Exception as e:
+        logging.error(f"Revenue rollup backfill failed: {str(e)}")
+    background_workers.append(asyncio.create_task(listen_for_cache_invalidations()))
+    background_workers.append(asyncio.create_task(run_banner_counter_flusher()))
+    background_workers.append(asyncio.create_task(backfill_cart_states()))
+    if CUSTOMER_INSIGHTS_REFRESH_SECONDS > 0:
+        background_workers.append(asyncio.create_task(refresh_customer_insights()))
+    background_workers.append(asyncio.create_task(inventory.run_expiry_sweeper()))
+    if CART_RECOVERY_INTERVAL_SECONDS > 0:
+        background_workers.append(asyncio.create_task(cart_recovery.run_forever(CART_RECOVERY_INTERVAL_SECONDS)))
+    if COURIER_PREWARM_INTERVAL_SECONDS > 0:
+        background_workers.append(asyncio.create_task(
+            courier_quotes.run_prewarm_forever(PICKUP_PINCODE, COURIER_PREWARM_INTERVAL_SECONDS)
+        ))
+    if TRACKING_POLL_INTERVAL_SECONDS > 0:
+        background_workers.append(asyncio.create_task(shipment_tracker.run_poller(TRACKING_POLL_INTERVAL_SECONDS)))
+    for _ in range(WEBHOOK_WORKERS):
+        background_workers.append(asyncio.create_task(webhook_inbox.run_worker()))
+    for _ in range(NOTIFICATION_DISPATCHERS):
+        background_workers.append(asyncio.create_task(notification_outbox.run_dispatcher()))
+    invoice_renderer.start()
+    # Create the shared Shiprocket client up front
+    shiprocket_service.get_client()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # Let running bulk dispatches finish: their AWBs are already assigned in Shiprocket
+    await asyncio.gather(*bulk_dispatch_tasks, return_exceptions=True)
+    for task in background_workers:
+        task.cancel()
+    await asyncio.gather(*background_workers, return_exceptions=True)
+    await banner_counter_buffer.flush()
+    invoice_renderer.shutdown()
+    await shiprocket_service.close_client()
+    await whatsapp_service.close_client()
+    if twilio_client is not None:
+        await twilio_client.http_client.close()
     client.close()
\ No newline at end of file
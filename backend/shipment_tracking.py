@@ -0,0 +1,233 @@
+"""
+Shipment tracking
+Live Shiprocket tracking is cached on the shipment document (live_tracking,
+live_tracking_at) and reused for TTL seconds, so tracking page refreshes are
+served from the shipment read the endpoint does anyway. Concurrent requests for
+the same AWB share one Shiprocket call. When a call fails the last snapshot is
+served, and the AWB is not retried for FAILURE_BACKOFF_SECONDS. Delivered,
+cancelled and returned shipments fetch once more after reaching that status and
+then never again.
+
+Status changes arrive through the Shiprocket webhook (apply_status), which also
+drops the cached snapshot so the next page load shows the new scans. The poller
+covers in-transit shipments that have not had a webhook for webhook_quiet_minutes.
+"""
+
+import time
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, Any, Optional
+
+# After a failed fetch an AWB is served from its last snapshot for this long
+FAILURE_BACKOFF_SECONDS = 30
+
+# Shiprocket status id -> shipment status
+SHIPMENT_STATUS_BY_ID = {
+    6: "shipped",
+    7: "in_transit",
+    8: "out_for_delivery",
+    9: "delivered",
+    10: "cancelled",
+    11: "rto_initiated",
+    12: "rto_delivered"
+}
+
+ORDER_STATUS_BY_SHIPMENT_STATUS = {
+    "delivered": "delivered",
+    "cancelled": "cancelled",
+    "rto_initiated": "return_initiated",
+    "rto_delivered": "returned"
+}
+
+IN_TRANSIT_STATUSES = ["shipped", "in_transit", "out_for_delivery"]
+FINAL_STATUSES = ["delivered", "cancelled", "rto_delivered"]
+
+
+def tracking_snapshot(response: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a Shiprocket track response shown on the tracking page"""
+    tracking_data = response.get("tracking_data", {})
+    return {
+        "current_status": tracking_data.get("shipment_status_id"),
+        "current_status_text": tracking_data.get("shipment_status"),
+        "current_location": tracking_data.get("current_location"),
+        "delivered_date": tracking_data.get("delivered_date"),
+        "activities": tracking_data.get("shipment_track_activities", [])
+    }
+
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class ShipmentTracker:
+    """Cached live tracking plus webhook/poller status updates"""
+
+    def __init__(
+        self,
+        db,
+        fetch: Callable[[str], Awaitable[Dict[str, Any]]],
+        ttl_seconds: float = 300,
+        webhook_quiet_minutes: float = 120,
+    ):
+        self.shipments = db.shipments
+        self.orders = db.orders
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.webhook_quiet_minutes = webhook_quiet_minutes
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._failed_at: Dict[str, float] = {}
+        self.cached = 0
+        self.fetched = 0
+        self.failed = 0
+        self.last_poll: Optional[Dict[str, Any]] = None
+
+    def _is_fresh(self, shipment: Dict[str, Any]) -> bool:
+        fetched_at = _as_utc(shipment.get("live_tracking_at"))
+        if not shipment.get("live_tracking") or fetched_at is None:
+            return False
+        if shipment.get("status") in FINAL_STATUSES:
+            # live_tracking_at is unset when a status arrives, so this snapshot was fetched after it
+            return True
+        return (datetime.now(timezone.utc) - fetched_at).total_seconds() < self.ttl_seconds
+
+    async def live_tracking(self, shipment: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Tracking snapshot for a shipment with an AWB; None if it was never fetched and Shiprocket fails"""
+        if self._is_fresh(shipment):
+            self.cached += 1
+            return shipment["live_tracking"]
+        failed_at = self._failed_at.get(shipment["awb_number"])
+        if failed_at:
+            if time.monotonic() - failed_at < FAILURE_BACKOFF_SECONDS:
+                return shipment.get("live_tracking")
+            del self._failed_at[shipment["awb_number"]]
+        try:
+            # shield: a customer closing the page must not cancel a fetch other requests share
+            return await asyncio.shield(self._refresh(shipment["awb_number"]))
+        except Exception as e:
+            logging.warning(f"Live tracking failed for AWB {shipment['awb_number']}: {str(e)}")
+            return shipment.get("live_tracking")
+
+    def _refresh(self, awb_number: str) -> asyncio.Task:
+        task = self._inflight.get(awb_number)
+        if task is None:
+            task = asyncio.create_task(self._fetch_and_store(awb_number))
+            self._inflight[awb_number] = task
+            task.add_done_callback(lambda _: self._inflight.pop(awb_number, None))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return task
+
+    async def _fetch_and_store(self, awb_number: str) -> Dict[str, Any]:
+        try:
+            snapshot = tracking_snapshot(await self.fetch(awb_number))
+        except Exception:
+            self.failed += 1
+            self._failed_at[awb_number] = time.monotonic()
+            raise
+        self.fetched += 1
+        self._failed_at.pop(awb_number, None)
+        await self.shipments.update_one(
+            {"awb_number": awb_number},
+            {"$set": {"live_tracking": snapshot, "live_tracking_at": datetime.now(timezone.utc)}}
+        )
+        return snapshot
+
+    async def apply_status(
+        self,
+        shipment: Dict[str, Any],
+        status_id: Optional[int],
+        status_text: Optional[str],
+        location: str,
+        from_webhook: bool = True,
+    ) -> str:
+        """Record a Shiprocket status on the shipment and its order; returns the shipment status"""
+        new_status = SHIPMENT_STATUS_BY_ID.get(status_id, shipment.get("status"))
+        now = datetime.now(timezone.utc)
+
+        update = {
+            "$set": {"status": new_status, "updated_at": now},
+            "$push": {
+                "tracking_history": {
+                    "status": status_text,
+                    "status_id": status_id,
+                    "location": location,
+                    "timestamp": now.isoformat()
+                }
+            }
+        }
+        if from_webhook:
+            update["$set"]["last_webhook_at"] = now
+            # New scans: the cached snapshot is out of date
+            update["$unset"] = {"live_tracking_at": ""}
+        await self.shipments.update_one({"awb_number": shipment["awb_number"]}, update)
+
+        if new_status in ORDER_STATUS_BY_SHIPMENT_STATUS:
+            await self.orders.update_one(
+                {"order_id": shipment["order_id"]},
+                {"$set": {"status": ORDER_STATUS_BY_SHIPMENT_STATUS[new_status]}}
+            )
+        return new_status
+
+    async def poll_in_transit(self, limit: int = 200, concurrency: int = 5) -> Dict[str, int]:
+        """Refresh in-transit shipments the webhook has gone quiet on"""
+        now = datetime.now(timezone.utc)
+        shipments = await self.shipments.find(
+            {
+                "status": {"$in": IN_TRANSIT_STATUSES},
+                "awb_number": {"$nin": [None, ""]},
+                # $not also matches documents without the field
+                "last_webhook_at": {"$not": {"$gte": now - timedelta(minutes=self.webhook_quiet_minutes)}},
+                "live_tracking_at": {"$not": {"$gte": now - timedelta(seconds=self.ttl_seconds)}},
+            },
+            {"_id": 0, "awb_number": 1, "order_id": 1, "status": 1}
+        ).limit(limit).to_list(limit)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def poll(shipment: Dict[str, Any]) -> bool:
+            async with semaphore:
+                snapshot = await self._refresh(shipment["awb_number"])
+            status_id = snapshot.get("current_status")
+            if SHIPMENT_STATUS_BY_ID.get(status_id, shipment["status"]) == shipment["status"]:
+                return False
+            await self.apply_status(
+                shipment, status_id, snapshot.get("current_status_text"),
+                snapshot.get("current_location") or "", from_webhook=False
+            )
+            return True
+
+        results = await asyncio.gather(*(poll(shipment) for shipment in shipments), return_exceptions=True)
+        for shipment, result in zip(shipments, results):
+            if isinstance(result, Exception):
+                logging.warning(f"Tracking poll failed for AWB {shipment['awb_number']}: {str(result)}")
+        report = {
+            "checked": len(shipments),
+            "status_changes": sum(1 for result in results if result is True),
+            "failed": sum(1 for result in results if isinstance(result, Exception)),
+        }
+        self.last_poll = {**report, "at": now.isoformat()}
+        return report
+
+    async def run_poller(self, interval_seconds: float):
+        while True:
+            try:
+                report = await self.poll_in_transit()
+                if report["status_changes"] or report["failed"]:
+                    logging.info(f"Tracking poll: {report}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Tracking poll failed: {str(e)}")
+            await asyncio.sleep(interval_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "served_cached": self.cached,
+            "fetched": self.fetched,
+            "fetch_failures": self.failed,
+            "in_flight": len(self._inflight),
+            "last_poll": self.last_poll,
+        }
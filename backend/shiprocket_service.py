@@ -4,58 +4,107 @@ Handles all shipping operations with Shiprocket API
 """
 
 import os
+import asyncio
+import importlib.util
 import httpx
 from datetime import datetime, timezone, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Union
 from pydantic import BaseModel
 
 # Shiprocket API Configuration
 SHIPROCKET_EMAIL = os.environ.get("SHIPROCKET_EMAIL")
 SHIPROCKET_PASSWORD = os.environ.get("SHIPROCKET_PASSWORD")
 SHIPROCKET_API_URL = os.environ.get("SHIPROCKET_API_URL", "https://apiv2.shiprocket.in/v1/external")
+SHIPROCKET_MAX_CONNECTIONS = int(os.environ.get("SHIPROCKET_MAX_CONNECTIONS", "20"))
+
+# HTTP/2 needs the h2 package; fall back to keep-alive HTTP/1.1 without it
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Shared pooled client; connections are kept alive across calls"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=SHIPROCKET_MAX_CONNECTIONS,
+                max_keepalive_connections=SHIPROCKET_MAX_CONNECTIONS,
+                keepalive_expiry=60.0
+            ),
+            http2=HTTP2_AVAILABLE
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared client on shutdown"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 
 class ShiprocketAuth:
     """Handles Shiprocket API authentication with token caching"""
     
     _token: Optional[str] = None
     _token_expiry: Optional[datetime] = None
+    # Only one caller logs in when the token expires; the rest wait for it
+    _refresh_lock = asyncio.Lock()
     
     @classmethod
-    async def get_token(cls) -> str:
-        """Get valid Shiprocket token, refreshing if necessary"""
-        # Check if token is valid
+    def _valid_token(cls) -> Optional[str]:
         if cls._token and cls._token_expiry and datetime.now(timezone.utc) < cls._token_expiry:
             return cls._token
+        return None
+    
+    @classmethod
+    async def get_token(cls) -> str:
+        """Get valid Shiprocket token, refreshing if necessary"""
+        token = cls._valid_token()
+        if token:
+            return token
         
+        async with cls._refresh_lock:
+            # Another caller may have refreshed while we waited
+            token = cls._valid_token()
+            if token:
+                return token
+            return await cls._login()
+    
+    @classmethod
+    async def _login(cls) -> str:
         # Get new token with retry
         max_retries = 3
         last_error = None
         
         for attempt in range(max_retries):
             try:
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.post(
-                        f"{SHIPROCKET_API_URL}/auth/login",
-                        json={
-                            "email": SHIPROCKET_EMAIL,
-                            "password": SHIPROCKET_PASSWORD
-                        }
-                    )
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        cls._token = data.get("token")
-                        # Token valid for 10 days, refresh after 9 days
-                        cls._token_expiry = datetime.now(timezone.utc) + timedelta(days=9)
-                        return cls._token
-                    else:
-                        last_error = f"Status {response.status_code}: {response.text[:200]}"
+                client = get_client()
+                response = await client.post(
+                    f"{SHIPROCKET_API_URL}/auth/login",
+                    json={
+                        "email": SHIPROCKET_EMAIL,
+                        "password": SHIPROCKET_PASSWORD
+                    }
+                )
+                
+                if response.status_code == 200:
+                    data = response.json()
+                    cls._token = data.get("token")
+                    # Token valid for 10 days, refresh after 9 days
+                    cls._token_expiry = datetime.now(timezone.utc) + timedelta(days=9)
+                    return cls._token
+                else:
+                    last_error = f"Status {response.status_code}: {response.text[:200]}"
             except Exception as e:
                 last_error = str(e)
             
             # Wait before retry
             if attempt < max_retries - 1:
-                import asyncio
                 await asyncio.sleep(1)
         
         raise Exception(f"Shiprocket authentication failed after {max_retries} attempts: {last_error}")
@@ -144,17 +193,17 @@ class ShiprocketService:
             "weight": total_weight
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{SHIPROCKET_API_URL}/orders/create/adhoc",
-                json=payload,
-                headers=headers
-            )
-            
-            if response.status_code not in [200, 201]:
-                raise Exception(f"Failed to create Shiprocket order: {response.text}")
-            
-            return response.json()
+        client = get_client()
+        response = await client.post(
+            f"{SHIPROCKET_API_URL}/orders/create/adhoc",
+            json=payload,
+            headers=headers
+        )
+        
+        if response.status_code not in [200, 201]:
+            raise Exception(f"Failed to create Shiprocket order: {response.text}")
+        
+        return response.json()
     
     @staticmethod
     async def get_available_couriers(
@@ -173,21 +222,21 @@ class ShiprocketService:
             "cod": cod
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{SHIPROCKET_API_URL}/courier/serviceability/",
-                params=params,
-                headers=headers
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to get couriers: {response.text}")
-            
-            data = response.json()
-            couriers = data.get("data", {}).get("available_courier_companies", [])
-            
-            # Sort by rate (cheapest first)
-            return sorted(couriers, key=lambda x: x.get("rate", float('inf')))
+        client = get_client()
+        response = await client.get(
+            f"{SHIPROCKET_API_URL}/courier/serviceability/",
+            params=params,
+            headers=headers
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"Failed to get couriers: {response.text}")
+        
+        data = response.json()
+        couriers = data.get("data", {}).get("available_courier_companies", [])
+        
+        # Sort by rate (cheapest first)
+        return sorted(couriers, key=lambda x: x.get("rate", float('inf')))
     
     @staticmethod
     async def assign_awb(shipment_id: int, courier_id: int) -> Dict[str, Any]:
@@ -199,151 +248,151 @@ class ShiprocketService:
             "courier_id": courier_id
         }
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{SHIPROCKET_API_URL}/courier/assign/awb",
-                json=payload,
-                headers=headers
-            )
-            
-            if response.status_code not in [200, 201]:
-                raise Exception(f"Failed to assign AWB: {response.text}")
-            
-            return response.json()
+        client = get_client()
+        response = await client.post(
+            f"{SHIPROCKET_API_URL}/courier/assign/awb",
+            json=payload,
+            headers=headers
+        )
+        
+        if response.status_code not in [200, 201]:
+            raise Exception(f"Failed to assign AWB: {response.text}")
+        
+        return response.json()
     
     @staticmethod
-    async def generate_label(shipment_id: int) -> Dict[str, Any]:
-        """Generate shipping label PDF"""
+    async def generate_label(shipment_id: Union[int, List[int]]) -> Dict[str, Any]:
+        """Generate shipping label PDF; a list of shipment IDs gives one merged PDF"""
         headers = await ShiprocketAuth.get_headers()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{SHIPROCKET_API_URL}/courier/generate/label",
-                json={"shipment_id": [shipment_id]},
-                headers=headers
-            )
-            
-            if response.status_code not in [200, 201]:
-                raise Exception(f"Failed to generate label: {response.text}")
-            
-            return response.json()
+        client = get_client()
+        response = await client.post(
+            f"{SHIPROCKET_API_URL}/courier/generate/label",
+            json={"shipment_id": shipment_id if isinstance(shipment_id, list) else [shipment_id]},
+            headers=headers
+        )
+        
+        if response.status_code not in [200, 201]:
+            raise Exception(f"Failed to generate label: {response.text}")
+        
+        return response.json()
     
     @staticmethod
-    async def generate_manifest(shipment_id: int) -> Dict[str, Any]:
-        """Generate manifest PDF"""
+    async def generate_manifest(shipment_id: Union[int, List[int]]) -> Dict[str, Any]:
+        """Generate manifest PDF; a list of shipment IDs gives one manifest"""
         headers = await ShiprocketAuth.get_headers()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{SHIPROCKET_API_URL}/manifests/generate",
-                json={"shipment_id": [shipment_id]},
-                headers=headers
-            )
-            
-            if response.status_code not in [200, 201]:
-                raise Exception(f"Failed to generate manifest: {response.text}")
-            
-            return response.json()
+        client = get_client()
+        response = await client.post(
+            f"{SHIPROCKET_API_URL}/manifests/generate",
+            json={"shipment_id": shipment_id if isinstance(shipment_id, list) else [shipment_id]},
+            headers=headers
+        )
+        
+        if response.status_code not in [200, 201]:
+            raise Exception(f"Failed to generate manifest: {response.text}")
+        
+        return response.json()
     
     @staticmethod
-    async def schedule_pickup(shipment_id: int) -> Dict[str, Any]:
-        """Schedule pickup for shipment"""
+    async def schedule_pickup(shipment_id: Union[int, List[int]]) -> Dict[str, Any]:
+        """Schedule pickup for one shipment or a list of them"""
         headers = await ShiprocketAuth.get_headers()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{SHIPROCKET_API_URL}/courier/generate/pickup",
-                json={"shipment_id": [shipment_id]},
-                headers=headers
-            )
-            
-            if response.status_code not in [200, 201]:
-                raise Exception(f"Failed to schedule pickup: {response.text}")
-            
-            return response.json()
+        client = get_client()
+        response = await client.post(
+            f"{SHIPROCKET_API_URL}/courier/generate/pickup",
+            json={"shipment_id": shipment_id if isinstance(shipment_id, list) else [shipment_id]},
+            headers=headers
+        )
+        
+        if response.status_code not in [200, 201]:
+            raise Exception(f"Failed to schedule pickup: {response.text}")
+        
+        return response.json()
     
     @staticmethod
     async def track_shipment(awb_number: str) -> Dict[str, Any]:
         """Track shipment by AWB number"""
         headers = await ShiprocketAuth.get_headers()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{SHIPROCKET_API_URL}/courier/track/awb/{awb_number}",
-                headers=headers
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to track shipment: {response.text}")
-            
-            return response.json()
+        client = get_client()
+        response = await client.get(
+            f"{SHIPROCKET_API_URL}/courier/track/awb/{awb_number}",
+            headers=headers
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"Failed to track shipment: {response.text}")
+        
+        return response.json()
     
     @staticmethod
     async def track_by_order_id(order_id: str) -> Dict[str, Any]:
         """Track shipment by order ID"""
         headers = await ShiprocketAuth.get_headers()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{SHIPROCKET_API_URL}/courier/track",
-                params={"order_id": order_id},
-                headers=headers
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to track shipment: {response.text}")
-            
-            return response.json()
+        client = get_client()
+        response = await client.get(
+            f"{SHIPROCKET_API_URL}/courier/track",
+            params={"order_id": order_id},
+            headers=headers
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"Failed to track shipment: {response.text}")
+        
+        return response.json()
     
     @staticmethod
     async def cancel_order(shiprocket_order_id: int) -> Dict[str, Any]:
         """Cancel order in Shiprocket"""
         headers = await ShiprocketAuth.get_headers()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{SHIPROCKET_API_URL}/orders/cancel",
-                json={"ids": [shiprocket_order_id]},
-                headers=headers
-            )
-            
-            if response.status_code not in [200, 201]:
-                raise Exception(f"Failed to cancel order: {response.text}")
-            
-            return response.json()
+        client = get_client()
+        response = await client.post(
+            f"{SHIPROCKET_API_URL}/orders/cancel",
+            json={"ids": [shiprocket_order_id]},
+            headers=headers
+        )
+        
+        if response.status_code not in [200, 201]:
+            raise Exception(f"Failed to cancel order: {response.text}")
+        
+        return response.json()
     
     @staticmethod
     async def get_pickup_locations() -> List[Dict[str, Any]]:
         """Get all pickup locations"""
         headers = await ShiprocketAuth.get_headers()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{SHIPROCKET_API_URL}/settings/company/pickup",
-                headers=headers
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to get pickup locations: {response.text}")
-            
-            data = response.json()
-            return data.get("data", {}).get("shipping_address", [])
+        client = get_client()
+        response = await client.get(
+            f"{SHIPROCKET_API_URL}/settings/company/pickup",
+            headers=headers
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"Failed to get pickup locations: {response.text}")
+        
+        data = response.json()
+        return data.get("data", {}).get("shipping_address", [])
     
     @staticmethod
     async def get_channels() -> List[Dict[str, Any]]:
         """Get all sales channels"""
         headers = await ShiprocketAuth.get_headers()
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{SHIPROCKET_API_URL}/channels",
-                headers=headers
-            )
-            
-            if response.status_code != 200:
-                raise Exception(f"Failed to get channels: {response.text}")
-            
-            return response.json().get("data", [])
+        client = get_client()
+        response = await client.get(
+            f"{SHIPROCKET_API_URL}/channels",
+            headers=headers
+        )
+        
+        if response.status_code != 200:
+            raise Exception(f"Failed to get channels: {response.text}")
+        
+        return response.json().get("data", [])
 
 
 # Shipment status mapping
@@ -103,7 +103,73 @@ class TestCartFunctionality:
             print(f"PASS: Added product {product_id} to cart")
         else:
             pytest.skip("No products available to add to cart")
-    
+
+    def test_cart_tracks_abandonment_state(self):
+        """Test cart writes keep cart_state, item_count and cart_value up to date"""
+        products = session.get(f"{BASE_URL}/api/products").json()
+        if len(products) == 0:
+            pytest.skip("No products available to add to cart")
+
+        session.post(f"{BASE_URL}/api/cart/add", json={"product_id": products[0]["product_id"], "quantity": 1})
+        response = session.get(f"{BASE_URL}/api/cart")
+        assert response.status_code == 200
+        data = response.json()
+
+        assert data.get("cart_state") == "open"
+        assert data.get("item_count") == len(data["items"])
+        assert data.get("cart_value", 0) > 0
+        print(f"PASS: Cart state is {data['cart_state']} with value ₹{data['cart_value']:.2f}")
+
+    def test_cart_mutations_return_updated_cart(self):
+        """Test add, set-quantity and remove each return the updated cart"""
+        products = session.get(f"{BASE_URL}/api/products").json()
+        if len(products) == 0:
+            pytest.skip("No products available to add to cart")
+        product_id = products[0]["product_id"]
+
+        data = session.post(f"{BASE_URL}/api/cart/add", json={"product_id": product_id, "quantity": 1}).json()
+        assert any(item["product_id"] == product_id for item in data["items"])
+
+        response = session.put(f"{BASE_URL}/api/cart/items/{product_id}", params={"quantity": 3})
+        assert response.status_code == 200
+        line = next(item for item in response.json()["items"] if item["product_id"] == product_id)
+        assert line["quantity"] == 3
+        # cart_value is the sum of the stored line prices
+        cart = response.json()
+        assert abs(cart["cart_value"] - sum(item["price"] * item["quantity"] for item in cart["items"])) < 0.01
+
+        response = session.delete(f"{BASE_URL}/api/cart/remove/{product_id}")
+        assert response.status_code == 200
+        assert all(item["product_id"] != product_id for item in response.json()["items"])
+        print("PASS: Cart mutations return the updated cart")
+
+    def test_priced_cart(self):
+        """Test the priced cart hydrates items and totals in one request"""
+        products = session.get(f"{BASE_URL}/api/products").json()
+        if len(products) == 0:
+            pytest.skip("No products available to add to cart")
+        session.post(f"{BASE_URL}/api/cart/add", json={"product_id": products[0]["product_id"], "quantity": 1})
+
+        response = session.get(f"{BASE_URL}/api/cart/priced")
+        assert response.status_code == 200
+        data = response.json()
+        for field in ["items", "subtotal", "gst", "coupon", "discount", "total"]:
+            assert field in data
+
+        available = [item for item in data["items"] if item["available"]]
+        for item in available:
+            for field in ["name", "image", "price", "in_stock", "line_total"]:
+                assert field in item
+        assert data["subtotal"] == round(sum(item["line_total"] for item in available), 2)
+        assert data["cart_value"] == data["subtotal"]
+        print(f"PASS: Priced cart with {len(available)} items, subtotal ₹{data['subtotal']:.2f}")
+
+    def test_add_unknown_product_to_cart(self):
+        """Test adding a product that does not exist returns 404"""
+        response = session.post(f"{BASE_URL}/api/cart/add", json={"product_id": "prod_does_not_exist", "quantity": 1})
+        assert response.status_code == 404
+        print("PASS: Unknown product rejected with 404")
+
     def test_save_cart_contact_email(self):
         """Test saving contact info for abandoned cart recovery - email only"""
         response = session.post(
@@ -166,7 +232,15 @@ class TestAdminEndpointsAuth:
         response = session.get(f"{BASE_URL}/api/admin/abandoned-carts/stats")
         assert response.status_code == 403
         print("PASS: Abandoned carts stats endpoint requires admin auth (403)")
-    
+
+    def test_cart_recovery_requires_auth(self):
+        """Test that cart recovery status and manual run require admin auth"""
+        response = session.get(f"{BASE_URL}/api/admin/abandoned-carts/recovery")
+        assert response.status_code == 403
+        response = session.post(f"{BASE_URL}/api/admin/abandoned-carts/recovery/run")
+        assert response.status_code == 403
+        print("PASS: Cart recovery endpoints require admin auth (403)")
+
     def test_admin_shipments_requires_auth(self):
         """Test that admin shipments endpoint requires admin auth"""
         response = session.get(f"{BASE_URL}/api/admin/shipments")
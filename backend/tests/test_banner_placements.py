@@ -94,7 +94,13 @@ class TestBannerAdminEndpoints:
         response = requests.get(f"{BASE_URL}/api/banners/stats")
         assert response.status_code == 403
         print("✓ GET /api/banners/stats correctly requires admin auth")
-    
+
+    def test_get_banner_timeseries_requires_auth(self):
+        """GET /api/banners/stats/timeseries should require admin auth"""
+        response = requests.get(f"{BASE_URL}/api/banners/stats/timeseries?days=7&granularity=day")
+        assert response.status_code == 403
+        print("✓ GET /api/banners/stats/timeseries correctly requires admin auth")
+
     def test_create_banner_requires_auth(self):
         """POST /api/banners should require admin auth"""
         response = requests.post(f"{BASE_URL}/api/banners", json=TEST_BANNER_DATA)
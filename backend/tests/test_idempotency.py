@@ -0,0 +1,65 @@
+"""
+Idempotency-Key Tests
+Tests: order replay, key reuse with a different body, unknown order on payment endpoints
+"""
+import uuid
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://pooja-creations.preview.emergentagent.com')
+
+SHIPPING_ADDRESS = {
+    "full_name": "TEST Idempotency",
+    "phone": "9876543210",
+    "address_line1": "1 Test Street",
+    "city": "Jaipur",
+    "state": "Rajasthan",
+    "pincode": "302001"
+}
+
+
+def order_payload(product_id, quantity):
+    return {
+        "items": [{"product_id": product_id, "product_name": "TEST", "quantity": quantity, "price": 1}],
+        "total_amount": 1,
+        "payment_method": "razorpay",
+        "shipping_address": SHIPPING_ADDRESS,
+        "guest_email": "test_idempotency@example.com"
+    }
+
+
+class TestIdempotencyKey:
+    """Retried POSTs with the same Idempotency-Key create one object"""
+
+    def test_order_retry_returns_same_order(self):
+        """Repeating POST /orders with the same key replays the first order"""
+        products = [p for p in requests.get(f"{BASE_URL}/api/products").json() if p.get("stock", 0) > 0]
+        if not products:
+            pytest.skip("No products in stock")
+        payload = order_payload(products[0]["product_id"], 1)
+        headers = {"Idempotency-Key": f"test-{uuid.uuid4()}"}
+
+        first = requests.post(f"{BASE_URL}/api/orders", json=payload, headers=headers)
+        assert first.status_code == 200
+        retry = requests.post(f"{BASE_URL}/api/orders", json=payload, headers=headers)
+        assert retry.status_code == 200
+        assert retry.json()["order_id"] == first.json()["order_id"]
+        assert retry.headers.get("Idempotent-Replayed") == "true"
+
+        # Same key with a different body is rejected
+        changed = requests.post(f"{BASE_URL}/api/orders", json=order_payload(products[0]["product_id"], 2), headers=headers)
+        assert changed.status_code == 422
+        print(f"✓ Retry replayed order {first.json()['order_id']}")
+
+    def test_failed_request_is_not_stored(self):
+        """A failed request releases its key so a retry runs again"""
+        headers = {"Idempotency-Key": f"test-{uuid.uuid4()}"}
+        for _ in range(2):
+            response = requests.post(f"{BASE_URL}/api/payments/razorpay/order?order_id=order_does_not_exist", headers=headers)
+            assert response.status_code == 404
+        print("✓ Failed payment order not replayed")
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v", "--tb=short"])
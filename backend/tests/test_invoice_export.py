@@ -0,0 +1,103 @@
+"""
+Invoice Export API Tests
+Tests: bulk invoice ZIP export and batched GST calculation
+"""
+import io
+import zipfile
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://pooja-creations.preview.emergentagent.com')
+ADMIN_TOKEN = "admin_session_1769177330151"
+HEADERS = {"Authorization": f"Bearer {ADMIN_TOKEN}"}
+
+
+class TestInvoiceExport:
+    """Test the bulk invoice ZIP export"""
+
+    def test_requires_admin(self):
+        """Export is admin only"""
+        response = requests.get(f"{BASE_URL}/api/admin/invoices/export", params={"status": "delivered"})
+        assert response.status_code in [401, 403]
+        print("✓ Export requires admin auth")
+
+    def test_requires_filter(self):
+        """A date range or status filter is mandatory"""
+        response = requests.get(f"{BASE_URL}/api/admin/invoices/export", headers=HEADERS)
+        assert response.status_code == 400
+        print("✓ Export without filter rejected")
+
+    def test_invalid_date(self):
+        """Dates must be YYYY-MM-DD"""
+        response = requests.get(f"{BASE_URL}/api/admin/invoices/export", params={"start_date": "01/09/2026"}, headers=HEADERS)
+        assert response.status_code == 400
+        print("✓ Invalid date rejected")
+
+    def test_invalid_cursor(self):
+        """Continuation cursors come from X-Next-Cursor; anything else is rejected"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/invoices/export",
+            params={"payment_status": "paid", "cursor": "not-a-cursor"},
+            headers=HEADERS
+        )
+        assert response.status_code == 400
+        print("✓ Invalid export cursor rejected")
+
+    def test_export_zip(self):
+        """Paid orders in the range come back as one PDF per invoice"""
+        response = requests.get(
+            f"{BASE_URL}/api/admin/invoices/export",
+            params={"start_date": "2024-01-01", "end_date": "2030-12-31", "payment_status": "paid"},
+            headers=HEADERS
+        )
+        if response.status_code == 404:
+            pytest.skip("No paid orders to export")
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/zip"
+
+        archive = zipfile.ZipFile(io.BytesIO(response.content))
+        assert archive.testzip() is None
+        names = archive.namelist()
+        assert all(name.endswith(".pdf") or name == "errors.txt" for name in names)
+        print(f"✓ Export returned {len(names)} files")
+
+
+class TestBulkGST:
+    """Test the batched GST calculation API"""
+
+    def test_requires_admin(self):
+        response = requests.post(f"{BASE_URL}/api/admin/gst/calculate", json={"order_ids": []})
+        assert response.status_code in [401, 403]
+        print("✓ Bulk GST requires admin auth")
+
+    def test_unknown_orders_reported(self):
+        """Unknown order ids come back in not_found"""
+        response = requests.post(
+            f"{BASE_URL}/api/admin/gst/calculate",
+            json={"order_ids": ["order_does_not_exist"]},
+            headers=HEADERS
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["results"] == {}
+        assert data["not_found"] == ["order_does_not_exist"]
+        print("✓ Unknown orders reported as not_found")
+
+    def test_breakdown_shape(self):
+        """Each result carries the same fields as an invoice GST breakdown"""
+        orders = requests.get(f"{BASE_URL}/api/admin/orders", params={"limit": 20}, headers=HEADERS).json()["items"]
+        if not orders:
+            pytest.skip("No orders available")
+
+        response = requests.post(
+            f"{BASE_URL}/api/admin/gst/calculate",
+            json={"order_ids": [o["order_id"] for o in orders]},
+            headers=HEADERS
+        )
+        assert response.status_code == 200
+        for breakdown in response.json()["results"].values():
+            for field in ["is_inter_state", "items", "taxable_amount", "cgst_amount", "sgst_amount", "igst_amount", "total_gst"]:
+                assert field in breakdown
+            assert breakdown["total_gst"] == round(breakdown["cgst_amount"] + breakdown["sgst_amount"] + breakdown["igst_amount"], 2)
+        print(f"✓ GST computed for {len(response.json()['results'])} orders")
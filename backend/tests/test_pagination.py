@@ -0,0 +1,95 @@
+"""
+Pagination & Field Projection Tests
+Tests: keyset cursors and ?fields= on list endpoints
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://pooja-creations.preview.emergentagent.com')
+ADMIN_TOKEN = "admin_session_1769177330151"
+
+
+class TestProductPagination:
+    """Test cursor pagination on /api/products"""
+
+    def test_unpaginated_list_unchanged(self):
+        """Without cursor/limit the endpoint still returns a list"""
+        response = requests.get(f"{BASE_URL}/api/products")
+        assert response.status_code == 200
+        assert isinstance(response.json(), list)
+        print("✓ /api/products still returns a plain list")
+
+    def test_limit_returns_page(self):
+        """limit= returns items and next_cursor"""
+        response = requests.get(f"{BASE_URL}/api/products", params={"limit": 2})
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["items"]) <= 2
+        assert "next_cursor" in data
+        print(f"✓ Page of {len(data['items'])} products, next_cursor={bool(data['next_cursor'])}")
+
+    def test_walk_all_pages(self):
+        """Following cursors visits every product exactly once"""
+        total = len(requests.get(f"{BASE_URL}/api/products").json())
+        seen = []
+        cursor = None
+        for _ in range(500):
+            params = {"limit": 5, "fields": "name"}
+            if cursor:
+                params["cursor"] = cursor
+            data = requests.get(f"{BASE_URL}/api/products", params=params).json()
+            seen.extend(p["product_id"] for p in data["items"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        assert len(seen) == len(set(seen))
+        assert len(seen) == total
+        print(f"✓ Walked {len(seen)} products across pages")
+
+    def test_fields_projection(self):
+        """fields= only returns the requested fields plus the id"""
+        response = requests.get(f"{BASE_URL}/api/products", params={"fields": "name,price"})
+        assert response.status_code == 200
+        products = response.json()
+        if not products:
+            pytest.skip("No products available")
+        assert set(products[0].keys()) <= {"product_id", "name", "price"}
+        print(f"✓ Projected fields: {sorted(products[0].keys())}")
+
+    def test_invalid_cursor(self):
+        """A garbage cursor returns 400"""
+        response = requests.get(f"{BASE_URL}/api/products", params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
+        print("✓ Invalid cursor rejected")
+
+    def test_invalid_field_name(self):
+        """Operators in field names are rejected"""
+        response = requests.get(f"{BASE_URL}/api/products", params={"fields": "$where"})
+        assert response.status_code == 400
+        print("✓ Invalid field name rejected")
+
+
+class TestAdminPagination:
+    """Test cursor pagination on admin list endpoints"""
+
+    def test_admin_orders_page(self):
+        response = requests.get(
+            f"{BASE_URL}/api/admin/orders",
+            params={"limit": 10, "fields": "status,total_amount"},
+            headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert "items" in data and "next_cursor" in data
+        print(f"✓ Admin orders page returned {len(data['items'])} orders")
+
+    def test_admin_tickets_page(self):
+        response = requests.get(
+            f"{BASE_URL}/api/admin/support/tickets",
+            params={"limit": 10},
+            headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}
+        )
+        assert response.status_code == 200
+        assert "items" in response.json()
+        print("✓ Admin tickets page returned")
@@ -0,0 +1,82 @@
+"""
+Product Search API Tests
+Tests: ranked search on /api/products, faceted /api/products/search and cursor pagination
+"""
+import pytest
+import requests
+import os
+
+BASE_URL = os.environ.get('REACT_APP_BACKEND_URL', 'https://pooja-creations.preview.emergentagent.com')
+
+
+class TestProductSearch:
+    """Test the inverted-index product search"""
+
+    def test_products_search_returns_list(self):
+        """GET /api/products?search= keeps returning a plain list"""
+        response = requests.get(f"{BASE_URL}/api/products", params={"search": "brass"})
+        assert response.status_code == 200
+        assert isinstance(response.json(), list)
+        print(f"✓ /api/products?search=brass returned {len(response.json())} products")
+
+    def test_search_endpoint_structure(self):
+        """GET /api/products/search returns products, total, facets and next_cursor"""
+        response = requests.get(f"{BASE_URL}/api/products/search", params={"limit": 5})
+        assert response.status_code == 200
+        data = response.json()
+        assert isinstance(data["products"], list)
+        assert len(data["products"]) <= 5
+        assert "total" in data
+        assert "next_cursor" in data
+        for facet in ["category", "price_band", "laddu_gopal_sizes", "badge"]:
+            assert facet in data["facets"]
+        print(f"✓ Search returned {data['total']} matches with facets {list(data['facets'].keys())}")
+
+    def test_prefix_match(self):
+        """A name prefix finds the product it came from"""
+        products = requests.get(f"{BASE_URL}/api/products").json()
+        named = [p for p in products if len(p.get("name", "").split()[0]) >= 4] if products else []
+        if not named:
+            pytest.skip("No products available")
+
+        word = named[0]["name"].split()[0]
+        response = requests.get(f"{BASE_URL}/api/products/search", params={"q": word[:3], "limit": 100})
+        assert response.status_code == 200
+        ids = [p["product_id"] for p in response.json()["products"]]
+        assert named[0]["product_id"] in ids
+        print(f"✓ Prefix '{word[:3]}' matched {named[0]['name']}")
+
+    def test_cursor_pagination_has_no_overlap(self):
+        """Following next_cursor never repeats a product"""
+        first = requests.get(f"{BASE_URL}/api/products/search", params={"limit": 2, "sort": "newest"}).json()
+        if not first["next_cursor"]:
+            pytest.skip("Not enough products to paginate")
+
+        second = requests.get(f"{BASE_URL}/api/products/search", params={
+            "limit": 2, "sort": "newest", "cursor": first["next_cursor"]
+        }).json()
+        first_ids = {p["product_id"] for p in first["products"]}
+        second_ids = {p["product_id"] for p in second["products"]}
+        assert first_ids.isdisjoint(second_ids)
+        print("✓ Second page does not overlap the first")
+
+    def test_invalid_cursor(self):
+        """A malformed cursor, or one from another sort, returns 400 instead of page 1"""
+        response = requests.get(f"{BASE_URL}/api/products/search", params={"cursor": "not-a-cursor"})
+        assert response.status_code == 400
+        response = requests.get(f"{BASE_URL}/api/products", params={"search": "laddu", "cursor": "not-a-cursor"})
+        assert response.status_code == 400
+
+        first = requests.get(f"{BASE_URL}/api/products/search", params={"limit": 1, "sort": "newest"}).json()
+        if first["next_cursor"]:
+            response = requests.get(f"{BASE_URL}/api/products/search", params={
+                "limit": 1, "sort": "price_asc", "cursor": first["next_cursor"]
+            })
+            assert response.status_code == 400
+        print("✓ Invalid search cursors rejected")
+
+    def test_invalid_sort(self):
+        """Unknown sort returns 400"""
+        response = requests.get(f"{BASE_URL}/api/products/search", params={"sort": "bogus"})
+        assert response.status_code == 400
+        print("✓ Invalid sort rejected")
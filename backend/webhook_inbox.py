@@ -0,0 +1,188 @@
+"""
+Webhook inbox
+Webhook endpoints only verify and insert the event into webhook_inbox, then
+acknowledge; worker tasks process it afterwards. The document _id is
+"<source>:<dedupe key>" (Shiprocket: awb/status/timestamp, Stripe: event id),
+so a redelivered event is a duplicate-key insert and is dropped.
+
+Workers claim an event by flipping it pending -> processing. Events that share
+an ordering_key (the AWB for Shiprocket) are processed strictly in arrival
+order: only the oldest unfinished event of a key can be claimed, so a scan
+that is backing off holds back the later scans of the same shipment (and only
+those). Failures
+retry with exponential backoff until max_attempts, then the event is parked as
+dead for an admin to retry. A claim whose worker died is released after
+LEASE_SECONDS. Processed events expire after DONE_RETENTION_DAYS, which is also
+the dedupe window.
+
+    pending -> processing -> done
+                          -> pending (retry, next_attempt_at in the future)
+                          -> dead
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Any, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+INBOX_COLLECTION = "webhook_inbox"
+
+LEASE_SECONDS = 120
+DONE_RETENTION_DAYS = 7
+MAX_BACKOFF_SECONDS = 3600
+
+UNFINISHED_STATUSES = ["pending", "processing"]
+
+
+class WebhookInbox:
+    """Durable queue between webhook endpoints and their processing"""
+
+    def __init__(
+        self,
+        db,
+        handlers: Dict[str, Callable[[Dict[str, Any]], Awaitable[Any]]],
+        max_attempts: int = 8,
+        base_delay_seconds: float = 5,
+        batch_size: int = 50,
+    ):
+        self.events = db[INBOX_COLLECTION]
+        self.handlers = handlers
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+
+    async def enqueue(self, source: str, dedupe_key: str, payload: Dict[str, Any], ordering_key: Optional[str] = None) -> bool:
+        """Store an event; False when it was already received"""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.events.insert_one({
+                "_id": f"{source}:{dedupe_key}",
+                "source": source,
+                "ordering_key": f"{source}:{ordering_key}" if ordering_key else None,
+                "payload": payload,
+                "status": "pending",
+                "attempts": 0,
+                "received_at": now,
+                "next_attempt_at": now,
+            })
+        except DuplicateKeyError:
+            return False
+        self._wakeup.set()
+        return True
+
+    async def _release_expired_leases(self):
+        await self.events.update_many(
+            {"status": "processing", "locked_until": {"$lt": datetime.now(timezone.utc)}},
+            {"$set": {"status": "pending"}}
+        )
+
+    async def _claimable(self) -> List[Dict[str, Any]]:
+        """Due events that are at the head of their ordering key, oldest first"""
+        # Heads are picked before the due filter and the limit, so keys whose head is
+        # backing off never crowd unrelated events out of the batch
+        return await self.events.aggregate([
+            {"$match": {"status": {"$in": UNFINISHED_STATUSES}}},
+            {"$sort": {"received_at": 1}},
+            # Events without an ordering key are their own group
+            {"$group": {
+                "_id": {"$ifNull": ["$ordering_key", "$_id"]},
+                "head": {"$first": {"_id": "$_id", "status": "$status", "next_attempt_at": "$next_attempt_at", "received_at": "$received_at"}},
+            }},
+            {"$match": {"head.status": "pending", "head.next_attempt_at": {"$lte": datetime.now(timezone.utc)}}},
+            {"$sort": {"head.received_at": 1}},
+            {"$limit": self.batch_size},
+            {"$project": {"_id": "$head._id"}},
+        ]).to_list(self.batch_size)
+
+    async def _claim(self, event_id: str) -> Optional[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        return await self.events.find_one_and_update(
+            {"_id": event_id, "status": "pending"},
+            {
+                "$set": {"status": "processing", "locked_until": now + timedelta(seconds=LEASE_SECONDS)},
+                "$inc": {"attempts": 1},
+            },
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _process(self, event: Dict[str, Any]):
+        now = datetime.now(timezone.utc)
+        try:
+            await self.handlers[event["source"]](event["payload"])
+        except Exception as e:
+            error = str(e)[:500]
+            if event["attempts"] >= self.max_attempts:
+                logging.error(f"Webhook {event['_id']} failed {event['attempts']} times, giving up: {error}")
+                update = {"status": "dead", "last_error": error, "failed_at": now}
+            else:
+                delay = min(self.base_delay_seconds * 2 ** (event["attempts"] - 1), MAX_BACKOFF_SECONDS)
+                logging.warning(f"Webhook {event['_id']} failed (attempt {event['attempts']}), retrying in {delay:.0f}s: {error}")
+                update = {"status": "pending", "last_error": error, "next_attempt_at": now + timedelta(seconds=delay)}
+        else:
+            update = {"status": "done", "processed_at": now, "expires_at": now + timedelta(days=DONE_RETENTION_DAYS)}
+        await self.events.update_one({"_id": event["_id"], "status": "processing"}, {"$set": update, "$unset": {"locked_until": ""}})
+
+    async def drain_once(self) -> int:
+        """Process every event that is claimable now; returns how many were processed"""
+        await self._release_expired_leases()
+        processed = 0
+        while True:
+            claimable = await self._claimable()
+            claimed = 0
+            for candidate in claimable:
+                event = await self._claim(candidate["_id"])
+                if event is None:
+                    continue  # Another worker took it
+                claimed += 1
+                await self._process(event)
+            processed += claimed
+            if not claimed:
+                return processed
+
+    async def run_worker(self, poll_seconds: float = 1.0):
+        while True:
+            try:
+                self._wakeup.clear()
+                await self.drain_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Webhook inbox worker error: {str(e)}")
+            try:
+                # Woken early by a local enqueue; events from other workers are picked up by polling
+                await asyncio.wait_for(self._wakeup.wait(), timeout=poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def retry(self, event_id: str) -> bool:
+        """Requeue a dead event"""
+        result = await self.events.update_one(
+            {"_id": event_id, "status": "dead"},
+            {"$set": {"status": "pending", "attempts": 0, "next_attempt_at": datetime.now(timezone.utc)}}
+        )
+        return result.modified_count == 1
+
+    async def summary(self) -> Dict[str, Any]:
+        counts = await self.events.aggregate([
+            {"$group": {"_id": {"source": "$source", "status": "$status"}, "count": {"$sum": 1}}}
+        ]).to_list(None)
+        by_source: Dict[str, Dict[str, int]] = {}
+        for row in counts:
+            by_source.setdefault(row["_id"]["source"], {})[row["_id"]["status"]] = row["count"]
+
+        oldest = await self.events.find_one({"status": "pending"}, {"received_at": 1}, sort=[("received_at", 1)])
+        oldest_age = None
+        if oldest:
+            received_at = oldest["received_at"]
+            if received_at.tzinfo is None:
+                received_at = received_at.replace(tzinfo=timezone.utc)
+            oldest_age = round((datetime.now(timezone.utc) - received_at).total_seconds(), 1)
+
+        dead = await self.events.find(
+            {"status": "dead"}, {"payload": 0}
+        ).sort("failed_at", -1).limit(20).to_list(20)
+        return {"by_source": by_source, "oldest_pending_seconds": oldest_age, "dead": dead}
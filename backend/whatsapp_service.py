@@ -16,6 +16,23 @@ WHATSAPP_ACCESS_TOKEN = os.environ.get("WHATSAPP_ACCESS_TOKEN")
 WHATSAPP_PHONE_NUMBER_ID = os.environ.get("WHATSAPP_PHONE_NUMBER_ID")
 WHATSAPP_BUSINESS_ACCOUNT_ID = os.environ.get("WHATSAPP_BUSINESS_ACCOUNT_ID")
 
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """Shared pooled client for the Graph API"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=30.0, limits=httpx.Limits(max_connections=10, keepalive_expiry=60.0))
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
 class WhatsAppService:
     """WhatsApp Business API Service for order notifications"""
     
@@ -48,28 +65,28 @@ class WhatsAppService:
         phone = WhatsAppService.format_phone_number(phone)
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{WHATSAPP_API_URL}/{WHATSAPP_PHONE_NUMBER_ID}/messages",
-                    headers={
-                        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "messaging_product": "whatsapp",
-                        "recipient_type": "individual",
-                        "to": phone,
-                        "type": "text",
-                        "text": {"body": message}
-                    }
-                )
+            client = get_client()
+            response = await client.post(
+                f"{WHATSAPP_API_URL}/{WHATSAPP_PHONE_NUMBER_ID}/messages",
+                headers={
+                    "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "messaging_product": "whatsapp",
+                    "recipient_type": "individual",
+                    "to": phone,
+                    "type": "text",
+                    "text": {"body": message}
+                }
+            )
+            
+            if response.status_code == 200:
+                return {"success": True, "response": response.json()}
+            else:
+                logging.error(f"WhatsApp API error: {response.text}")
+                return {"success": False, "error": response.text}
                 
-                if response.status_code == 200:
-                    return {"success": True, "response": response.json()}
-                else:
-                    logging.error(f"WhatsApp API error: {response.text}")
-                    return {"success": False, "error": response.text}
-                    
         except Exception as e:
             logging.error(f"WhatsApp send error: {str(e)}")
             return {"success": False, "error": str(e)}
@@ -102,22 +119,22 @@ class WhatsAppService:
             payload["template"]["components"] = components
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{WHATSAPP_API_URL}/{WHATSAPP_PHONE_NUMBER_ID}/messages",
-                    headers={
-                        "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload
-                )
+            client = get_client()
+            response = await client.post(
+                f"{WHATSAPP_API_URL}/{WHATSAPP_PHONE_NUMBER_ID}/messages",
+                headers={
+                    "Authorization": f"Bearer {WHATSAPP_ACCESS_TOKEN}",
+                    "Content-Type": "application/json"
+                },
+                json=payload
+            )
+            
+            if response.status_code == 200:
+                return {"success": True, "response": response.json()}
+            else:
+                logging.error(f"WhatsApp template error: {response.text}")
+                return {"success": False, "error": response.text}
                 
-                if response.status_code == 200:
-                    return {"success": True, "response": response.json()}
-                else:
-                    logging.error(f"WhatsApp template error: {response.text}")
-                    return {"success": False, "error": response.text}
-                    
         except Exception as e:
             logging.error(f"WhatsApp template error: {str(e)}")
             return {"success": False, "error": str(e)}
@@ -61,20 +61,15 @@ export default function CartPage() {
 
   const fetchCart = async () => {
     try {
-      const response = await axios.get(`${API}/cart`, { withCredentials: true });
+      // Priced cart carries each product's name, image and price - no per-item fetches
+      const response = await axios.get(`${API}/cart/priced`, { withCredentials: true });
       setCart(response.data);
       
-      if (response.data.items && response.data.items.length > 0) {
-        const productPromises = response.data.items.map(item =>
-          axios.get(`${API}/products/${item.product_id}`)
-        );
-        const productResponses = await Promise.all(productPromises);
-        const productsMap = {};
-        productResponses.forEach(res => {
-          productsMap[res.data.product_id] = res.data;
-        });
-        setProducts(productsMap);
-      }
+      const productsMap = {};
+      response.data.items.filter(item => item.available).forEach(item => {
+        productsMap[item.product_id] = { ...item, images: [item.image] };
+      });
+      setProducts(productsMap);
     } catch (error) {
       console.error("Error fetching cart:", error);
     } finally {
@@ -96,8 +91,7 @@ export default function CartPage() {
     if (newQuantity < 1) return;
     
     try {
-      await axios.delete(`${API}/cart/remove/${productId}`, { withCredentials: true });
-      await axios.post(`${API}/cart/add`, { product_id: productId, quantity: newQuantity }, { withCredentials: true });
+      await axios.put(`${API}/cart/items/${productId}`, null, { params: { quantity: newQuantity }, withCredentials: true });
       fetchCart();
     } catch (error) {
       toast.error("Failed to update quantity");
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from "react";
+import React, { useState, useEffect, useCallback, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import axios from "axios";
 import { API } from "@/App";
@@ -35,6 +35,8 @@ export default function CheckoutPage() {
   const [gstSettings, setGstSettings] = useState(null);
   const [gstBreakdown, setGstBreakdown] = useState(null);
   const [indianStates, setIndianStates] = useState([]);
+  // Idempotency key for the order being placed, so double submits and retries create it once
+  const orderKey = useRef(null);
 
   useEffect(() => {
     fetchData();
@@ -43,7 +45,7 @@ export default function CheckoutPage() {
   const fetchData = async () => {
     try {
       const [cartRes, userRes, welcomeRes, bannerRes, gstRes, statesRes] = await Promise.all([
-        axios.get(`${API}/cart`, { withCredentials: true }),
+        axios.get(`${API}/cart/priced`, { withCredentials: true }),
         axios.get(`${API}/auth/me`, { withCredentials: true }).catch(() => null),
         axios.get(`${API}/user/first-time-buyer`, { withCredentials: true }).catch(() => null),
         axios.get(`${API}/banners?placement=checkout_page&status=active`).catch(() => ({ data: [] })),
@@ -74,17 +76,12 @@ export default function CheckoutPage() {
         setCheckoutBanner(bannerRes.data[0]);
       }
 
-      if (cartRes.data.items && cartRes.data.items.length > 0) {
-        const productPromises = cartRes.data.items.map(item =>
-          axios.get(`${API}/products/${item.product_id}`)
-        );
-        const productResponses = await Promise.all(productPromises);
-        const productsMap = {};
-        productResponses.forEach(res => {
-          productsMap[res.data.product_id] = res.data;
-        });
-        setProducts(productsMap);
-      }
+      // Priced cart carries each product's name, image, price and GST rate
+      const productsMap = {};
+      cartRes.data.items.filter(item => item.available).forEach(item => {
+        productsMap[item.product_id] = { ...item, images: [item.image] };
+      });
+      setProducts(productsMap);
     } catch (error) {
       console.error("Error fetching data:", error);
     } finally {
@@ -222,7 +219,7 @@ export default function CheckoutPage() {
     }
 
     try {
-      const orderItems = cart.items.map(item => ({
+      const orderItems = cart.items.filter(item => products[item.product_id]).map(item => ({
         product_id: item.product_id,
         product_name: products[item.product_id]?.name || "",
         quantity: item.quantity,
@@ -239,20 +236,30 @@ export default function CheckoutPage() {
         discount_amount: discount
       };
 
-      const orderResponse = await axios.post(`${API}/orders`, orderData, { withCredentials: true });
+      // Resubmitting the same order reuses its key; any change starts a new attempt
+      const payload = JSON.stringify(orderData);
+      if (orderKey.current?.payload !== payload) {
+        orderKey.current = { key: crypto.randomUUID(), payload };
+      }
+      const orderResponse = await axios.post(`${API}/orders`, orderData, {
+        withCredentials: true,
+        headers: { "Idempotency-Key": orderKey.current.key }
+      });
       const orderId = orderResponse.data.order_id;
 
       // All payment methods go through Razorpay with preferred method hint
       await handleRazorpayPayment(orderId, paymentMethod);
     } catch (error) {
       console.error("Checkout error:", error);
-      toast.error("Checkout failed");
+      toast.error(error.response?.data?.detail || "Checkout failed");
     }
   };
 
   const handleRazorpayPayment = async (orderId, preferredMethod = "razorpay") => {
     try {
-      const response = await axios.post(`${API}/payments/razorpay/order?order_id=${orderId}`);
+      const response = await axios.post(`${API}/payments/razorpay/order?order_id=${orderId}`, null, {
+        headers: { "Idempotency-Key": `razorpay-${orderId}` }
+      });
       const razorpayOrder = response.data;
 
       // Map payment method to Razorpay's preferred method
@@ -334,7 +341,9 @@ export default function CheckoutPage() {
   const handleStripePayment = async (orderId) => {
     try {
       const originUrl = window.location.origin;
-      const response = await axios.post(`${API}/payments/stripe/session?order_id=${orderId}&origin_url=${encodeURIComponent(originUrl)}`);
+      const response = await axios.post(`${API}/payments/stripe/session?order_id=${orderId}&origin_url=${encodeURIComponent(originUrl)}`, null, {
+        headers: { "Idempotency-Key": `stripe-${orderId}` }
+      });
       
       if (response.data.url) {
         window.location.href = response.data.url;